@@ -0,0 +1,156 @@
+"""
+Connection setup benchmark for one full DAG run.
+
+Replays the warehouse round trips the DAG's tasks make, once the way the operators
+used to (a new PostgresHook connection for every run/get_records call) and once
+through the pooled hooks in helpers.warehouse. Every round trip is a trivial
+statement, so the difference is connection setup. Airflow runs each task in its own
+process, so the pooled replay starts every task with an empty pool.
+
+    python benchmarks/connection_setup.py "host=<redshift-host> port=5439 dbname=dwh user=dwhuser password=..."
+
+Prints a JSON report with connections opened and wall time for both replays.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+from helpers.warehouse import PooledRedshiftHook
+
+# (task, round trips, concurrent threads) for one run of airbnb_stays_dag
+BEFORE_WORKLOAD = [
+    ("Stage_Listings", 1, 1),
+    ("Stage_Stays", 1, 1),
+    ("Load_Guest_Stays_Fact_Table", 1, 1),
+    ("Load_Listings_Dim_Table", 1, 1),
+    ("Load_Guests_Dim_Table", 1, 1),
+    ("Load_Reviews_Dim_Table", 1, 1),
+    ("Load_Availability_Dim_Table", 1, 1),
+    ("Load_Hosts_Dim_Table", 1, 1),
+    ("Run_Data_Quality_Checks", 10, 1),
+]
+
+AFTER_WORKLOAD = [
+    ("Stage_Listings", 1, 1),
+    ("Stage_Stays", 1, 1),
+    ("Load_Guest_Stays_Fact_Table", 2, 1),
+    ("Load_Listings_Dim_Table", 1, 1),
+    ("Load_Guests_Dim_Table", 1, 1),
+    ("Load_Reviews_Dim_Table", 1, 1),
+    ("Load_Availability_Dim_Table", 1, 1),
+    ("Load_Hosts_Dim_Table", 1, 1),
+    ("Run_Data_Quality_Checks", 5, 4),
+]
+
+STATEMENT = "SELECT 1"
+
+
+class _DsnPooledHook(PooledRedshiftHook):
+    # Connects from a DSN instead of an Airflow connection id
+    def __init__(self, dsn, max_connections):
+        super(_DsnPooledHook, self).__init__("benchmark", max_connections)
+        self.dsn = dsn
+
+    def _connection_kwargs(self):
+        return {"dsn": self.dsn}
+
+
+class _ConnectCounter:
+    def __init__(self):
+        self.count = 0
+        self._connect = psycopg2.connect
+
+    def __enter__(self):
+        def counting_connect(*args, **kwargs):
+            self.count += 1
+            return self._connect(*args, **kwargs)
+        psycopg2.connect = counting_connect
+        return self
+
+    def __exit__(self, *exc):
+        psycopg2.connect = self._connect
+
+
+def _fresh_connection_round_trip(dsn):
+    # What PostgresHook.get_records/run does: connect, execute, commit, close
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(STATEMENT)
+            cursor.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _replay(workload, round_trip):
+    for task, round_trips, threads in workload:
+        call = round_trip(task)
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(lambda _: call(), range(round_trips)))
+        else:
+            for _ in range(round_trips):
+                call()
+
+
+def benchmark_unpooled(dsn):
+    with _ConnectCounter() as counter:
+        start = time.perf_counter()
+        _replay(BEFORE_WORKLOAD, lambda task: lambda: _fresh_connection_round_trip(dsn))
+        elapsed = time.perf_counter() - start
+    return {"connections": counter.count, "seconds": elapsed}
+
+
+def benchmark_pooled(dsn, max_connections):
+    hooks = {}
+
+    def hook_for(task):
+        # One pool per task process
+        hooks[task] = _DsnPooledHook(dsn, max_connections)
+        return lambda: hooks[task].get_records(STATEMENT)
+
+    with _ConnectCounter() as counter:
+        start = time.perf_counter()
+        _replay(AFTER_WORKLOAD, hook_for)
+        elapsed = time.perf_counter() - start
+    for hook in hooks.values():
+        hook.close()
+    return {"connections": counter.count, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dsn", help="libpq connection string of the warehouse")
+    parser.add_argument("--repeat", type=int, default=5, help="DAG runs to replay")
+    parser.add_argument("--max-connections", type=int, default=8, help="Pool size per task")
+    args = parser.parse_args()
+
+    unpooled = [benchmark_unpooled(args.dsn) for _ in range(args.repeat)]
+    pooled = [benchmark_pooled(args.dsn, args.max_connections) for _ in range(args.repeat)]
+
+    def summary(results):
+        seconds = sorted(r["seconds"] for r in results)
+        return {"connections_per_run": results[0]["connections"],
+                "median_seconds_per_run": seconds[len(seconds) // 2]}
+
+    before, after = summary(unpooled), summary(pooled)
+    report = {
+        "benchmark": "connection_setup",
+        "repeat": args.repeat,
+        "unpooled": before,
+        "pooled": after,
+        "connections_saved_per_run": before["connections_per_run"] - after["connections_per_run"],
+        "seconds_saved_per_run": before["median_seconds_per_run"] - after["median_seconds_per_run"],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Scale benchmark of the check, clean and stage stages.
+
+For every scale, synthetic listings and stays sources (see synthetic_data.py) of
+scale x the base sizes are put into an in-process S3 stand-in (moto). The DAG's
+CheckSourceOperator and CleanSourceOperator configurations then run against them.
+The stage step runs the DAG's StageToRedshiftOperator configuration against a local
+PostgreSQL database through the local mode's LocalRedshiftHook, which turns the
+COPY into a COPY FROM STDIN. It only runs when --dsn is given.
+
+    python benchmarks/pipeline_scale.py --scales 1,10,100 --output baseline.json
+    python benchmarks/pipeline_scale.py --dsn "host=localhost dbname=dev" --baseline baseline.json
+
+Prints a JSON report with throughput and peak resident memory (including the clean
+shard processes) per scale, source and stage, plus the operators' phase timings. With --baseline, results that lose
+more than --tolerance of throughput or grow peak memory by more than --tolerance
+are listed as regressions and the exit status is 1.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import boto3
+import psutil
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+from helpers import warehouse, manifest_key, LocalRedshiftHook
+from helpers.table_design import STAGING_LISTINGS, STAGING_STAYS
+from operators import CheckSourceOperator, CleanSourceOperator, StageToRedshiftOperator
+from synthetic_data import generate_listings, generate_stays, write_json_array
+
+BUCKET = "airbnb-benchmark-bucket"
+AWS_CONN_ID = "benchmark"
+REDSHIFT_CONN_ID = "benchmark"
+
+Credentials = namedtuple("Credentials", ["access_key", "secret_key", "token"])
+
+# Source -> key, cleaned key, staging table, check and clean settings of airbnb_stays_dag
+SOURCES = {
+    "listings": {
+        "s3_key": "listings/airbnb-listings-united-states.json",
+        "s3_temp_file_store": "listings/temp_store/clean-listings-for-united-states.csv.gz",
+        "table": STAGING_LISTINGS,
+        "check": {"check_mode": "metadata", "estimate_count": True},
+        "clean": {"streaming": True, "shards": None},
+        "stage": {"manifest": True, "replace_condition": "country = 'United States'"},
+    },
+    "stays": {
+        "s3_key": "stays/2017/01/stays-2017-01-01.json",
+        "s3_temp_file_store": "stays/temp_store/clean-stays-for-2017-01-01.csv.gz",
+        "table": STAGING_STAYS,
+        "check": {"check_mode": "metadata"},
+        "clean": {},
+        "stage": {"replace_condition": "stay_date = '2017-01-01'"},
+    },
+}
+
+
+class _PeakMemory:
+    # Samples the resident memory of this process plus its children (clean shard workers).
+    # Pages a forked worker still shares with this process are counted for both.
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.before = self.peak = self._rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _rss(self):
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def _measure(scale, source, stage, records, size, run):
+    gc.collect()
+    with _PeakMemory() as memory:
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+    if records is None:
+        records = result
+    return {
+        "scale": scale,
+        "source": source,
+        "stage": stage,
+        "records": records,
+        "bytes": size,
+        "seconds": elapsed,
+        "records_per_second": records / elapsed if elapsed else None,
+        "megabytes_per_second": size / elapsed / 2 ** 20 if elapsed else None,
+        "rss_before_mb": memory.before / 2 ** 20,
+        "peak_rss_mb": memory.peak / 2 ** 20,
+    }
+
+
+def _put_source(client, key, records):
+    with tempfile.TemporaryFile() as fileobj:
+        count, size = write_json_array(records, fileobj)
+        fileobj.seek(0)
+        client.upload_fileobj(fileobj, BUCKET, key)
+    return count, size
+
+
+def _cleaned_objects(client, key):
+    # The objects a manifest COPY or a plain COPY of `key` would load
+    try:
+        manifest = client.get_object(Bucket=BUCKET, Key=manifest_key(key))
+    except client.exceptions.NoSuchKey:
+        return [key]
+    entries = json.loads(manifest["Body"].read())["entries"]
+    return [entry["url"].split("/", 3)[3] for entry in entries]
+
+
+def run_scale(scale, args):
+    listing_count = args.base_listings * scale
+    stay_count = args.base_stays * scale
+    results = []
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        # The operators pick up the stand-in through the per-process caches
+        warehouse._credentials[AWS_CONN_ID] = Credentials("benchmark", "benchmark", None)
+        warehouse._s3_clients[AWS_CONN_ID] = client
+        if args.dsn:
+            redshift = LocalRedshiftHook(REDSHIFT_CONN_ID, client, dsn=args.dsn)
+            warehouse._pools[REDSHIFT_CONN_ID] = redshift
+
+        generated = {
+            "listings": _put_source(client, SOURCES["listings"]["s3_key"],
+                                    generate_listings(listing_count, seed=args.seed)),
+            "stays": _put_source(client, SOURCES["stays"]["s3_key"],
+                                 generate_stays(stay_count, listing_count, seed=args.seed)),
+        }
+
+        for source, settings in SOURCES.items():
+            count, size = generated[source]
+            check_settings = dict(settings["check"], **({"check_mode": args.check_mode} if args.check_mode else {}))
+            check = CheckSourceOperator(task_id="Check_" + source,
+                                        aws_credentials_id=AWS_CONN_ID,
+                                        s3_bucket=BUCKET,
+                                        s3_key=settings["s3_key"],
+                                        **check_settings)
+            results.append(_measure(scale, source, "check", count, size, lambda: check.execute({})))
+            results[-1]["phases"] = check.metrics.phases
+
+            clean_settings = dict(settings["clean"], **({"shards": args.shards} if args.shards != -1 else {}))
+            clean = CleanSourceOperator(task_id="Clean_" + source,
+                                        aws_credentials_id=AWS_CONN_ID,
+                                        s3_bucket=BUCKET,
+                                        s3_key=settings["s3_key"],
+                                        s3_temp_file_store=settings["s3_temp_file_store"],
+                                        **clean_settings)
+            results.append(_measure(scale, source, "clean", count, size, lambda: clean.execute({})))
+            results[-1]["phases"] = clean.metrics.phases
+
+            if args.dsn:
+                table = settings["table"]
+                redshift.run([table.create_sql(physical=False), "TRUNCATE {}".format(table.name)])
+                stage = StageToRedshiftOperator(task_id="Stage_" + source,
+                                                redshift_conn_id=REDSHIFT_CONN_ID,
+                                                aws_credentials_id=AWS_CONN_ID,
+                                                table_name=table.name,
+                                                s3_bucket=BUCKET,
+                                                s3_key=settings["s3_temp_file_store"],
+                                                s3_format="csv",
+                                                **settings["stage"])
+                staged_bytes = sum(client.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+                                   for key in _cleaned_objects(client, settings["s3_temp_file_store"]))
+
+                def run_stage():
+                    stage.execute({})
+                    return redshift.get_records("SELECT COUNT(*) FROM {}".format(table.name))[0][0]
+                results.append(_measure(scale, source, "stage", None, staged_bytes, run_stage))
+                results[-1]["phases"] = stage.metrics.phases
+
+        warehouse._s3_clients.pop(AWS_CONN_ID, None)
+        if args.dsn:
+            warehouse._pools.pop(REDSHIFT_CONN_ID).close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Results that are slower or use more memory than the baseline beyond the tolerance
+    :param results: Current results
+    :param baseline: Results of an earlier report
+    :param tolerance: Allowed relative change, e.g. 0.2
+    """
+    previous = {(r["scale"], r["source"], r["stage"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["scale"], result["source"], result["stage"]))
+        if before is None:
+            continue
+        if result["records_per_second"] < before["records_per_second"] * (1 - tolerance):
+            regressions.append({"scale": result["scale"], "source": result["source"], "stage": result["stage"],
+                                "metric": "records_per_second",
+                                "baseline": before["records_per_second"], "current": result["records_per_second"]})
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append({"scale": result["scale"], "source": result["source"], "stage": result["stage"],
+                                "metric": "peak_rss_mb",
+                                "baseline": before["peak_rss_mb"], "current": result["peak_rss_mb"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1,10,100", help="Comma separated multiples of the base sizes")
+    parser.add_argument("--base-listings", type=int, default=1000, help="Listings records at scale 1")
+    parser.add_argument("--base-stays", type=int, default=5000, help="Stays records at scale 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check-mode", choices=["full", "metadata"], default=None,
+                        help="Override the DAG's check mode")
+    parser.add_argument("--shards", type=int, default=-1,
+                        help="Override the DAG's clean shards, 0 for one per core")
+    parser.add_argument("--dsn", default=None, help="libpq connection string of a local PostgreSQL for the stage step")
+    parser.add_argument("--output", default=None, help="Also write the report to this file")
+    parser.add_argument("--baseline", default=None, help="Report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+    if args.shards == 0:
+        args.shards = None
+
+    results = []
+    for scale in (int(scale) for scale in args.scales.split(",")):
+        results.extend(run_scale(scale, args))
+
+    report = {
+        "benchmark": "pipeline_scale",
+        "base_listings": args.base_listings,
+        "base_stays": args.base_stays,
+        "seed": args.seed,
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as fileobj:
+            report["regressions"] = compare(results, json.load(fileobj)["results"], args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fileobj:
+            fileobj.write(text)
+    print(text)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Synthetic AirBnB source data in the shape of the public listings and reviews exports.
+
+Every record is wrapped in the export's {"datasetid", "recordid", "fields", ...} envelope
+and `fields` carries every column CleanSourceOperator keeps or drops. Values include
+what the cleaner has to deal with: pipes, quotes and newlines in free text, optional
+fields that are missing (NaN once loaded into a DataFrame) and a small share of
+duplicated ids. Generation is deterministic for a given seed.
+
+    python benchmarks/synthetic_data.py listings 10000 listings.json
+    python benchmarks/synthetic_data.py stays 50000 stays.json --date 2017-01-01
+"""
+import argparse
+import json
+import os
+import random
+
+WORDS = ["cozy", "sunny", "loft", "studio", "downtown", "quiet", "spacious", "modern", "garden", "view",
+         "beach", "historic", "bright", "private", "charming", "central", "room", "apartment", "house", "park"]
+CITIES = [("New York", "NY", "10001"), ("Los Angeles", "CA", "90012"), ("San Francisco", "CA", "94103"),
+          ("Chicago", "IL", "60601"), ("Austin", "TX", "78701"), ("Seattle", "WA", "98101"),
+          ("Boston", "MA", "02108"), ("Miami", "FL", "33130"), ("Denver", "CO", "80202")]
+PROPERTY_TYPES = ["Apartment", "House", "Condominium", "Loft", "Townhouse", "Bed & Breakfast", "Other"]
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room"]
+BED_TYPES = ["Real Bed", "Futon", "Pull-out Sofa", "Airbed", "Couch"]
+CANCELLATION_POLICIES = ["flexible", "moderate", "strict", "super_strict_30"]
+RESPONSE_TIMES = ["within an hour", "within a few hours", "within a day", "a few days or more"]
+AMENITIES = ["TV", "Wireless Internet", "Kitchen", "Heating", "Air conditioning", "Washer", "Dryer",
+             "Free parking on premises", "Family/kid friendly", "Smoke detector", "Essentials", "Shampoo"]
+FEATURES = ["Host Is Superhost", "Host Has Profile Pic", "Host Identity Verified", "Is Location Exact",
+            "Instant Bookable", "Requires License"]
+
+# Fields that are regularly absent in the exports
+OPTIONAL_LISTING_FIELDS = ["security_deposit", "cleaning_fee", "reviews_per_month", "first_review", "last_review",
+                           "host_response_rate", "host_response_time", "square_feet", "weekly_price",
+                           "monthly_price", "review_scores_rating", "review_scores_accuracy", "notes",
+                           "neighbourhood", "zipcode", "house_rules", "interaction", "access", "transit"]
+
+
+def _text(rng, words):
+    # Free text with the characters the cleaner strips or has to escape
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    roll = rng.random()
+    if roll < 0.1:
+        text += " | " + rng.choice(WORDS)
+    elif roll < 0.2:
+        text = '"{}" it\'s {}'.format(text, rng.choice(WORDS))
+    elif roll < 0.25:
+        text += "\n" + rng.choice(WORDS)
+    return text
+
+
+def _date(rng, first_year=2010, last_year=2017):
+    return "{}-{:02d}-{:02d}".format(rng.randint(first_year, last_year), rng.randint(1, 12), rng.randint(1, 28))
+
+
+def listing_record(rng, listing_id, country="United States"):
+    """
+    One listings export record
+    :param rng: random.Random instance
+    :param listing_id: Listing id, repeated ids produce duplicate records
+    :param country: Value of the country column
+    """
+    city, state, zipcode = rng.choice(CITIES)
+    host_id = rng.randint(1, 10 ** 8)
+    latitude, longitude = round(rng.uniform(25, 48), 6), round(rng.uniform(-122, -71), 6)
+    url = "https://www.airbnb.com/rooms/{}".format(listing_id)
+    picture = "https://a0.muscache.com/im/pictures/{}.jpg".format(rng.randint(1, 10 ** 9))
+    fields = {
+        # Kept columns
+        "id": str(listing_id),
+        "name": _text(rng, 4),
+        "minimum_nights": rng.randint(1, 5),
+        "maximum_nights": rng.choice([30, 90, 365, 1125]),
+        "availability_30": rng.randint(0, 30),
+        "availability_60": rng.randint(0, 60),
+        "availability_90": rng.randint(0, 90),
+        "availability_365": rng.randint(0, 365),
+        "number_of_reviews": rng.randint(0, 300),
+        "reviews_per_month": round(rng.uniform(0, 10), 2),
+        "first_review": _date(rng, 2010, 2014),
+        "last_review": _date(rng, 2015, 2017),
+        "host_id": str(host_id),
+        "host_url": "https://www.airbnb.com/users/show/{}".format(host_id),
+        "host_name": rng.choice(["Anna", "Ben", "Chloe", "D'Arcy", "Eve", "Fran"]),
+        "host_location": "{}, {}, {}".format(city, state, country),
+        "host_since": _date(rng, 2008, 2016),
+        "host_listings_count": rng.randint(1, 20),
+        "host_response_rate": rng.randint(50, 100),
+        "host_response_time": rng.choice(RESPONSE_TIMES),
+        "listing_url": url,
+        "neighbourhood": rng.choice(WORDS).title(),
+        "street": "{}, {}, {}".format(city, state, country),
+        "city": city,
+        "state": state,
+        "zipcode": zipcode,
+        "country": country,
+        "property_type": rng.choice(PROPERTY_TYPES),
+        "room_type": rng.choice(ROOM_TYPES),
+        "bed_type": rng.choice(BED_TYPES),
+        "price": rng.randint(20, 900),
+        "security_deposit": rng.choice([100, 200, 500]),
+        "cleaning_fee": rng.choice([10, 25, 50, 100]),
+        "amenities": ",".join(rng.sample(AMENITIES, rng.randint(1, len(AMENITIES)))),
+        "accommodates": rng.randint(1, 10),
+        "bedrooms": rng.randint(0, 5),
+        "bathrooms": rng.choice([1.0, 1.5, 2.0, 3.0]),
+        "beds": rng.randint(1, 6),
+        "cancellation_policy": rng.choice(CANCELLATION_POLICIES),
+        # Dropped columns
+        "review_scores_accuracy": rng.randint(2, 10),
+        "geolocation": [latitude, longitude],
+        "features": ",".join(rng.sample(FEATURES, 2)),
+        "transit": _text(rng, 12),
+        "calendar_last_scraped": "2017-04-02",
+        "review_scores_communication": rng.randint(2, 10),
+        "longitude": str(longitude),
+        "country_code": "US",
+        "review_scores_cleanliness": rng.randint(2, 10),
+        "neighborhood_overview": _text(rng, 30),
+        "market": city,
+        "space": _text(rng, 40),
+        "picture_url": picture,
+        "review_scores_value": rng.randint(2, 10),
+        "latitude": str(latitude),
+        "review_scores_checkin": rng.randint(2, 10),
+        "review_scores_location": rng.randint(2, 10),
+        "host_picture_url": picture,
+        "description": _text(rng, 80),
+        "experiences_offered": "none",
+        "extra_people": rng.choice([0, 10, 20]),
+        "smart_location": "{}, {}".format(city, state),
+        "xl_picture_url": picture,
+        "host_thumbnail_url": picture,
+        "scrape_id": "20170402075052",
+        "review_scores_rating": rng.randint(20, 100),
+        "calculated_host_listings_count": rng.randint(1, 20),
+        "medium_url": picture,
+        "calendar_updated": "{} weeks ago".format(rng.randint(1, 8)),
+        "summary": _text(rng, 40),
+        "thumbnail_url": picture,
+        "last_scraped": "2017-04-02",
+        "guests_included": rng.randint(1, 4),
+        "host_total_listings_count": rng.randint(1, 20),
+        "house_rules": _text(rng, 25),
+        "access": _text(rng, 20),
+        "host_about": _text(rng, 30),
+        "host_neighbourhood": rng.choice(WORDS).title(),
+        "interaction": _text(rng, 15),
+        "monthly_price": rng.randint(500, 9000),
+        "weekly_price": rng.randint(150, 3000),
+        "square_feet": rng.randint(200, 3000),
+        "neighbourhood_cleansed": rng.choice(WORDS).title(),
+        "notes": _text(rng, 20),
+    }
+    for field in OPTIONAL_LISTING_FIELDS:
+        if rng.random() < 0.15:
+            del fields[field]
+    return {
+        "datasetid": "airbnb-listings",
+        "recordid": "{:040x}".format(rng.getrandbits(160)),
+        "fields": fields,
+        "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+        "record_timestamp": "2017-04-02T08:05:52+00:00"
+    }
+
+
+def stay_record(rng, stay_id, listing_count, stay_date):
+    """
+    One reviews export record, each review stands for a stay
+    :param rng: random.Random instance
+    :param stay_id: Review id, repeated ids produce duplicate records
+    :param listing_count: Listing ids are drawn from 1..listing_count
+    :param stay_date: Value of the date column
+    """
+    fields = {
+        "listing_id": rng.randint(1, listing_count),
+        "id": stay_id,
+        "date": stay_date,
+        "reviewer_id": rng.randint(1, 10 ** 8),
+        "reviewer_name": rng.choice(["Anna", "Ben", "Chloe", "D'Arcy", "Eve", "Fran", "Jo \"JJ\""]),
+        "comments": _text(rng, 40)
+    }
+    if rng.random() < 0.02:
+        del fields["comments"]
+    return {
+        "datasetid": "airbnb-reviews",
+        "recordid": "{:040x}".format(rng.getrandbits(160)),
+        "fields": fields,
+        "record_timestamp": "2017-04-02T08:05:52+00:00"
+    }
+
+
+def _record_ids(rng, count, duplicate_share):
+    for record_id in range(1, count + 1):
+        # A duplicate repeats a recent id, like a record exported twice
+        if record_id > 10 and rng.random() < duplicate_share:
+            yield rng.randint(record_id - 10, record_id - 1)
+        else:
+            yield record_id
+
+
+def generate_listings(count, seed=0, duplicate_share=0.005, country="United States"):
+    """
+    Iterator over `count` listings records
+    :param count: Number of records
+    :param seed: Random seed
+    :param duplicate_share: Share of records that repeat an earlier id
+    :param country: Value of the country column
+    """
+    rng = random.Random(seed)
+    for listing_id in _record_ids(rng, count, duplicate_share):
+        yield listing_record(rng, listing_id, country)
+
+
+def generate_stays(count, listing_count, seed=0, duplicate_share=0.005, stay_date="2017-01-01"):
+    """
+    Iterator over `count` stays records
+    :param count: Number of records
+    :param listing_count: Number of listings the stays refer to
+    :param seed: Random seed
+    :param duplicate_share: Share of records that repeat an earlier id
+    :param stay_date: Value of the date column
+    """
+    rng = random.Random(seed)
+    for stay_id in _record_ids(rng, count, duplicate_share):
+        yield stay_record(rng, stay_id, listing_count, stay_date)
+
+
+def write_json_array(records, fileobj):
+    """
+    Write records as one JSON array without holding the serialized array in memory
+    :param records: Iterable of records
+    :param fileobj: Binary file object
+    :return: Number of records and bytes written
+    """
+    count = 0
+    size = fileobj.write(b"[")
+    for record in records:
+        size += fileobj.write((b",\n" if count else b"\n") + json.dumps(record).encode())
+        count += 1
+    size += fileobj.write(b"\n]")
+    return count, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["listings", "stays"])
+    parser.add_argument("count", type=int, help="Number of records")
+    parser.add_argument("path", help="Output file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--listing-count", type=int, default=None, help="Listings the stays refer to")
+    parser.add_argument("--date", default="2017-01-01", help="Stay date")
+    args = parser.parse_args()
+
+    if args.kind == "listings":
+        records = generate_listings(args.count, seed=args.seed)
+    else:
+        records = generate_stays(args.count, args.listing_count or max(args.count // 5, 1), seed=args.seed,
+                                 stay_date=args.date)
+    if os.path.dirname(args.path):
+        os.makedirs(os.path.dirname(args.path), exist_ok=True)
+    with open(args.path, "wb") as fileobj:
+        count, size = write_json_array(records, fileobj)
+    print(json.dumps({"records": count, "bytes": size, "path": args.path}))
+
+
+if __name__ == "__main__":
+    main()
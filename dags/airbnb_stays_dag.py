@@ -1,16 +1,39 @@
 from datetime import datetime, timedelta
 import os
+import re
 from airflow import DAG
 from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.operators.dummy_operator import DummyOperator
 from airflow.operators import (CheckSourceOperator, CleanSourceOperator, StageToRedshiftOperator, LoadFactOperator,
-                                LoadDimensionOperator, DataQualityOperator, PostgresOperator, PythonOperator, BashOperator)
+                                LoadDimensionOperator, LoadAggregateOperator, AssignSurrogateKeysOperator,
+                                DataQualityOperator, PostgresOperator, PythonOperator, BashOperator)
 from helpers import SqlQueries
 
-COUNTRY = "United-States"
+# Markets to ingest, as spelled in the listings' country column
+MARKETS = ["United States"]
 CLEAN_DATA_STORE = "s3a://airbnb-data-bucket/clean_data/"
 
+# Concurrency limits: tasks of one DAG run, S3 download/clean tasks and warehouse tasks.
+# Pools must exist under Admin -> Pools, None runs the tasks in the default pool.
+DAG_CONCURRENCY = 16
+CLEAN_POOL = None
+REDSHIFT_POOL = None
+# The clean stays tasks of the daily and the backfill DAG all update the seen stay index.
+# This pool must have a single slot, so they run one at a time across both DAGs
+SEEN_INDEX_POOL = "stays_seen_index"
+
+# Stays keys of one day, rendered with the run's (or in a backfill, each day's) execution_date
+STAYS_KEY = 'stays/{execution_date.year}/{execution_date.month:02d}/stays-{execution_date.year}-{execution_date.month:02d}-{execution_date.day:02d}.json'
+CLEAN_STAYS_KEY = 'stays/temp_store/clean-stays-for-{execution_date.year}-{execution_date.month:02d}-{execution_date.day:02d}.csv.gz'
+STAY_DATE = '{execution_date.year}-{execution_date.month:02d}-{execution_date.day:02d}'
+
+# A backfill run covers the dates passed on trigger, e.g.
+#   airflow trigger_dag AirBnB_Stays_17_Backfill -c '{"start": "2017-01-01", "end": "2017-01-31"}'
+BACKFILL_START = "{{ dag_run.conf['start'] }}"
+BACKFILL_END = "{{ dag_run.conf['end'] }}"
+CLEAN_STAYS_RANGE_KEY = "stays/temp_store/clean-stays-for-" + BACKFILL_START + "-to-" + BACKFILL_END + ".csv.gz"
+
 default_args = {
     'owner': 'shivam_gupta',
     'depends_on_past': False,
@@ -25,207 +48,479 @@ default_args = {
     'schedule_interval' : "@daily"
 }
 
-main_dag = DAG('AirBnB_Stays_17',
-                description="Datawarehouse for AirBnB's Data Enginnering Team",
-                default_args=default_args
-)
-
-start_operator = DummyOperator(
-                    task_id='Begin_Execution',
-                    dag=main_dag
-)
-
-check_listings_data_task = CheckSourceOperator(
-    task_id="Check_Listings_Data_Source",
-    dag=main_dag,
-    aws_credentials_id="aws_credentials",
-    s3_bucket="airbnb-data-bucket",
-    s3_key="listings/airbnb-listings-" + COUNTRY.lower() + ".json"
-)
-
-check_stays_data_task = CheckSourceOperator(
-    task_id="Check_Stays_Data_Source",
-    dag=main_dag,
-    aws_credentials_id="aws_credentials",
-    s3_bucket="airbnb-data-bucket",
-    s3_key=f'stays/{{execution_date.year}}/{{execution_date.month:02d}}/stays-{{execution_date.year}}-{{execution_date.month:02d}}-{{execution_date.day:02d}}.json'
-)
-
-clean_listings_data_task = CleanSourceOperator(
-    task_id="Clean_Listings_Data_Source",
-    dag=main_dag,
-    aws_credentials_id="aws_credentials",
-    s3_bucket="airbnb-data-bucket",
-    s3_key="listings/airbnb-listings-" + COUNTRY.lower() + ".json",
-    s3_temp_file_store="listings/temp_store/clean-listings-for-" + COUNTRY.lower() + ".csv"
-)
-
-clean_stays_data_task = CleanSourceOperator(
-    task_id="Clean_Stays_Data_Source",
-    dag=main_dag,
-    aws_credentials_id="aws_credentials",
-    redshift_conn_id="redshift",
-    s3_bucket="airbnb-data-bucket",
-    s3_key=f'stays/{{execution_date.year}}/{{execution_date.month:02d}}/stays-{{execution_date.year}}-{{execution_date.month:02d}}-{{execution_date.day:02d}}.json',
-    s3_temp_file_store=f'stays/temp_store/clean-stays-for-{{execution_date.year}}-{{execution_date.month:02d}}-{{execution_date.day:02d}}.csv'
-)
-
-create_listings_stage_table = PostgresOperator(
-    task_id="Create_Listings_Stage",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_staging_listings_table
-)
-
-create_stays_stage_table = PostgresOperator(
-    task_id="Create_Stays_Stage",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_staging_stays_table
-)
-
-copy_listings_to_redshift_task = StageToRedshiftOperator(
-    task_id="Stage_Listings",
-    dag=main_dag,
-    table_name="staging_listings",
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    s3_bucket="airbnb-data-bucket",
-    s3_key="listings/temp_store/clean-listings-for-" + COUNTRY.lower() + ".csv",
-    s3_format="csv"
-)
-
-copy_stays_to_redshift_task = StageToRedshiftOperator(
-    task_id="Stage_Stays",
-    dag=main_dag,
-    table_name="staging_stays",
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    s3_bucket="airbnb-data-bucket",
-    s3_key=f'stays/temp_store/clean-stays-for-{{execution_date.year}}-{{execution_date.month:02d}}-{{execution_date.day:02d}}.csv',
-    s3_format="csv"
-)
-
-create_guest_stays_fact_table = PostgresOperator(
-    task_id="Create_Guest_Stays_Fact_Table",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_guest_stays_fact_table
-)
-
-load_guest_stays_task = LoadFactOperator(
-    task_id="Load_Guest_Stays_Fact_Table",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    sql=SqlQueries.guest_stays_fact_insert
-)
-
-create_listings_dim_table_task = PostgresOperator(
-    task_id="Create_Listings_Dim_Table",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_listings_dim_table
-)
-
-create_availability_dim_table_task = PostgresOperator(
-    task_id="Create_Availability_Dim_Table",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_availability_dim_table
-)
-
-create_hosts_dim_table_task = PostgresOperator(
-    task_id="Create_Hosts_Dim_Table",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_hosts_dim_table
-)
-
-create_reviews_dim_table_task = PostgresOperator(
-    task_id="Create_Reviews_Dim_Table",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_reviews_dim_table
-)
-
-create_guests_dim_table_task = PostgresOperator(
-    task_id="Create_Guests_Dim_Table",
-    dag=main_dag,
-    postgres_conn_id="redshift",
-    sql=SqlQueries.create_guests_dim_table
-)
-
-load_listings_task = LoadDimensionOperator(
-    task_id="Load_Listings_Dim_Table",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    sql=SqlQueries.listings_dim_insert
-)
-
-load_guests_task = LoadDimensionOperator(
-    task_id="Load_Guests_Dim_Table",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    sql=SqlQueries.guests_dim_insert
-)
-
-load_reviews_task = LoadDimensionOperator(
-    task_id="Load_Reviews_Dim_Table",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    sql=SqlQueries.reviews_dim_insert
-)
-
-load_availability_task = LoadDimensionOperator(
-    task_id="Load_Availability_Dim_Table",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    sql=SqlQueries.availability_dim_insert
-)
-
-load_hosts_task = LoadDimensionOperator(
-    task_id="Load_Hosts_Dim_Table",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    sql=SqlQueries.hosts_dim_insert
-)
-
-dq_check_task = DataQualityOperator(
-    task_id="Run_Data_Quality_Checks",
-    dag=main_dag,
-    redshift_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    table_info_dict=[{"table_name": "listings", "not_null": "listing_id"},     \
-              {"table_name": "guests", "not_null": "guest_id"},                \
-              {"table_name": "availability", "not_null": "listing_id"},        \
-              {"table_name": "hosts", "not_null": "host_id"},                  \
-              {"table_name": "reviews", "not_null": "listing_id"}              \
-             ]
-)
-
-end_operator = DummyOperator(
-                    task_id='End_Execution',
-                    dag=main_dag
-)
-
-start_operator >> check_listings_data_task >> clean_listings_data_task >> create_listings_stage_table
-create_listings_stage_table >> copy_listings_to_redshift_task >> create_guest_stays_fact_table
-
-start_operator >> check_stays_data_task >> clean_stays_data_task >> create_stays_stage_table
-create_stays_stage_table >> copy_stays_to_redshift_task >> create_guest_stays_fact_table
-
-create_guest_stays_fact_table >> load_guest_stays_task 
-
-load_guest_stays_task >> create_listings_dim_table_task >> load_listings_task >> dq_check_task
-load_guest_stays_task >> create_availability_dim_table_task >> load_availability_task >> dq_check_task
-load_guest_stays_task >> create_hosts_dim_table_task >> load_hosts_task >> dq_check_task
-load_guest_stays_task >> create_reviews_dim_table_task >> load_reviews_task >> dq_check_task
-load_guest_stays_task >> create_guests_dim_table_task >> load_guests_task >> dq_check_task
-
-dq_check_task >> end_operator
+def create_stays_dag(dag_id, markets, concurrency=DAG_CONCURRENCY, clean_pool=CLEAN_POOL, redshift_pool=REDSHIFT_POOL,
+                     seen_index_pool=SEEN_INDEX_POOL, backfill=False):
+    """
+    Build the stays DAG with one check/clean/stage listings branch per market
+    :param dag_id: DAG ID
+    :param markets: Country names as spelled in the listings' country column
+    :param concurrency: Maximum number of running tasks per DAG
+    :param clean_pool: Pool for the S3 check and clean tasks
+    :param redshift_pool: Pool for every task that works on the warehouse
+    :param seen_index_pool: Single slot pool of the clean stays task, shared by every DAG updating the seen stay index
+    :param backfill: Build the manually triggered variant that loads the stays of a whole date range
+                     (dag_run.conf start and end) with one COPY, one fact load and one dimension load
+    """
+    if backfill:
+        dag = DAG(dag_id,
+                        description="Backfill of AirBnB's Datawarehouse for a range of dates",
+                        default_args=dict(default_args, pool=redshift_pool, end_date=None),
+                        schedule_interval=None,
+                        concurrency=concurrency
+        )
+    else:
+        dag = DAG(dag_id,
+                        description="Datawarehouse for AirBnB's Data Enginnering Team",
+                        default_args=dict(default_args, pool=redshift_pool),
+                        concurrency=concurrency
+        )
+
+    start_operator = DummyOperator(
+                        task_id='Begin_Execution',
+                        dag=dag
+    )
+
+    # A backfill cleans every day of the range in one task and skips the days without a source,
+    # so there is no check of a single day's key
+    check_stays_data_task = None
+    if not backfill:
+        check_stays_data_task = CheckSourceOperator(
+            task_id="Check_Stays_Data_Source",
+            dag=dag,
+            aws_credentials_id="aws_credentials",
+            s3_bucket="airbnb-data-bucket",
+            s3_key=STAYS_KEY,
+            check_mode="metadata",
+            pool=clean_pool
+        )
+
+    clean_stays_data_task = CleanSourceOperator(
+        task_id="Clean_Stays_Data_Source",
+        dag=dag,
+        aws_credentials_id="aws_credentials",
+        redshift_conn_id="redshift",
+        s3_bucket="airbnb-data-bucket",
+        s3_key=STAYS_KEY,
+        s3_temp_file_store=CLEAN_STAYS_KEY,
+        seen_index_prefix="stays/seen_index",
+        backfill_start_date=BACKFILL_START if backfill else "",
+        backfill_end_date=BACKFILL_END if backfill else "",
+        s3_range_file_store=CLEAN_STAYS_RANGE_KEY if backfill else "",
+        # Runs of different days, and the backfill, must not update the seen stay index at the same time
+        pool=seen_index_pool
+    )
+
+    create_listings_stage_table = PostgresOperator(
+        task_id="Create_Listings_Stage",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_staging_listings_table
+    )
+
+    create_listing_amenities_stage_table = PostgresOperator(
+        task_id="Create_Listing_Amenities_Stage",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_staging_listing_amenities_table
+    )
+
+    create_stays_stage_table = PostgresOperator(
+        task_id="Create_Stays_Stage",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_staging_stays_table
+    )
+
+    # One check -> clean -> stage branch per market, all loading into the shared staging table
+    clean_listings_task_ids = []
+    stage_listings_tasks = []
+    for market in markets:
+        market_slug = market.replace(" ", "-").lower()
+        task_suffix = re.sub(r"[^0-9a-z]+", "_", market_slug)
+        market_filter = "country = '{}'".format(market.replace("'", "''"))
+        
+        check_listings_data_task = CheckSourceOperator(
+            task_id="Check_Listings_Data_Source_" + task_suffix,
+            dag=dag,
+            aws_credentials_id="aws_credentials",
+            s3_bucket="airbnb-data-bucket",
+            s3_key="listings/airbnb-listings-" + market_slug + ".json",
+            check_mode="metadata",
+            estimate_count=True,
+            pool=clean_pool
+        )
+        
+        clean_listings_data_task = CleanSourceOperator(
+            task_id="Clean_Listings_Data_Source_" + task_suffix,
+            dag=dag,
+            aws_credentials_id="aws_credentials",
+            s3_bucket="airbnb-data-bucket",
+            s3_key="listings/airbnb-listings-" + market_slug + ".json",
+            s3_temp_file_store="listings/temp_store/clean-listings-for-" + market_slug + ".csv.gz",
+            streaming=True,
+            shards=None,
+            use_cache=True,
+            pool=clean_pool
+        )
+        
+        copy_listings_to_redshift_task = StageToRedshiftOperator(
+            task_id="Stage_Listings_" + task_suffix,
+            dag=dag,
+            table_name="staging_listings",
+            redshift_conn_id="redshift",
+            aws_credentials_id="aws_credentials",
+            s3_bucket="airbnb-data-bucket",
+            s3_key="listings/temp_store/clean-listings-for-" + market_slug + ".csv.gz",
+            s3_format="csv",
+            manifest=True,
+            replace_condition=market_filter
+        )
+        
+        # The cleaner writes the market's (listing, amenity) pairs next to its listings
+        copy_listing_amenities_to_redshift_task = StageToRedshiftOperator(
+            task_id="Stage_Listing_Amenities_" + task_suffix,
+            dag=dag,
+            table_name="staging_listing_amenities",
+            redshift_conn_id="redshift",
+            aws_credentials_id="aws_credentials",
+            s3_bucket="airbnb-data-bucket",
+            s3_key="listings/temp_store/clean-listings-for-" + market_slug + ".amenities.csv.gz",
+            s3_format="csv",
+            replace_condition=market_filter
+        )
+        
+        start_operator >> check_listings_data_task >> clean_listings_data_task >> copy_listings_to_redshift_task
+        create_listings_stage_table >> copy_listings_to_redshift_task
+        clean_listings_data_task >> copy_listing_amenities_to_redshift_task
+        create_listing_amenities_stage_table >> copy_listing_amenities_to_redshift_task
+        clean_listings_task_ids.append(clean_listings_data_task.task_id)
+        stage_listings_tasks += [copy_listings_to_redshift_task, copy_listing_amenities_to_redshift_task]
+
+    copy_stays_to_redshift_task = StageToRedshiftOperator(
+        task_id="Stage_Stays",
+        dag=dag,
+        table_name="staging_stays",
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        s3_bucket="airbnb-data-bucket",
+        s3_key=CLEAN_STAYS_RANGE_KEY if backfill else CLEAN_STAYS_KEY,
+        s3_format="csv",
+        manifest=backfill,
+        replace_condition=(f"stay_date BETWEEN '{BACKFILL_START}' AND '{BACKFILL_END}'" if backfill
+                           else f"stay_date = '{STAY_DATE}'")
+    )
+
+    # Surrogate keys of the staged listings, hosts and guests, assigned before the fact load resolves them
+    create_key_tables_task = PostgresOperator(
+        task_id="Create_Key_Tables",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=[SqlQueries.create_listing_keys_table,
+             SqlQueries.create_host_keys_table,
+             SqlQueries.create_guest_keys_table]
+    )
+
+    assign_listing_keys_task = AssignSurrogateKeysOperator(
+        task_id="Assign_Listing_Keys",
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=SqlQueries.listing_keys_select,
+        table_name="listing_keys",
+        natural_key="listing_id",
+        surrogate_key="listing_key"
+    )
+
+    assign_host_keys_task = AssignSurrogateKeysOperator(
+        task_id="Assign_Host_Keys",
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=SqlQueries.host_keys_select,
+        table_name="host_keys",
+        natural_key="host_id",
+        surrogate_key="host_key"
+    )
+
+    assign_guest_keys_task = AssignSurrogateKeysOperator(
+        task_id="Assign_Guest_Keys",
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=SqlQueries.guest_keys_select,
+        table_name="guest_keys",
+        natural_key="guest_id",
+        surrogate_key="guest_key"
+    )
+
+    create_guest_stays_fact_table = PostgresOperator(
+        task_id="Create_Guest_Stays_Fact_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_guest_stays_fact_table
+    )
+
+    create_fact_load_log_table = PostgresOperator(
+        task_id="Create_Fact_Load_Log_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_fact_load_log_table
+    )
+
+    load_guest_stays_task = LoadFactOperator(
+        task_id="Load_Guest_Stays_Fact_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.guest_stays_fact_select,
+        mode="partition",
+        table_name="guest_stays",
+        partition_column="stay_date",
+        partition_value=BACKFILL_START if backfill else STAY_DATE,
+        partition_end_value=BACKFILL_END if backfill else "",
+        # A new version of the cleaning rules reloads the slices cleaned under the old ones
+        source_version=("rules-{{ params.cleaning_rules_version }}/"
+                        "{{ ti.xcom_pull(task_ids=params.clean_task_ids) | join('/') }}"),
+        params={"clean_task_ids": ["Clean_Stays_Data_Source"] + clean_listings_task_ids,
+                "cleaning_rules_version": CleanSourceOperator.cleaning_rules_version}
+    )
+
+    create_listings_dim_table_task = PostgresOperator(
+        task_id="Create_Listings_Dim_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_listings_dim_table
+    )
+
+    create_availability_dim_table_task = PostgresOperator(
+        task_id="Create_Availability_Dim_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_availability_dim_table
+    )
+
+    create_hosts_dim_table_task = PostgresOperator(
+        task_id="Create_Hosts_Dim_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_hosts_dim_table
+    )
+
+    create_reviews_dim_table_task = PostgresOperator(
+        task_id="Create_Reviews_Dim_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_reviews_dim_table
+    )
+
+    create_amenity_tables_task = PostgresOperator(
+        task_id="Create_Amenity_Tables",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=[SqlQueries.create_amenities_dim_table,
+             SqlQueries.create_listing_amenities_table]
+    )
+
+    create_guests_dim_table_task = PostgresOperator(
+        task_id="Create_Guests_Dim_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_guests_dim_table
+    )
+
+    load_listings_task = LoadDimensionOperator(
+        task_id="Load_Listings_Dim_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.listings_dim_select,
+        mode="upsert",
+        table_name="listings",
+        primary_key="listing_id"
+    )
+
+    load_amenities_task = LoadDimensionOperator(
+        task_id="Load_Amenities_Dim_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.amenities_dim_insert
+    )
+
+    load_listing_amenities_task = LoadDimensionOperator(
+        task_id="Load_Listing_Amenities_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.listing_amenities_insert
+    )
+
+    load_guests_task = LoadDimensionOperator(
+        task_id="Load_Guests_Dim_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.guests_dim_select,
+        mode="upsert",
+        table_name="guests",
+        primary_key="guest_id",
+        order_by="stay_date DESC"
+    )
+
+    load_reviews_task = LoadDimensionOperator(
+        task_id="Load_Reviews_Dim_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.reviews_dim_select,
+        mode="upsert",
+        table_name="reviews",
+        primary_key="listing_id"
+    )
+
+    load_availability_task = LoadDimensionOperator(
+        task_id="Load_Availability_Dim_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.availability_dim_select,
+        mode="upsert",
+        table_name="availability",
+        primary_key="listing_id"
+    )
+
+    load_hosts_task = LoadDimensionOperator(
+        task_id="Load_Hosts_Dim_Table",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        sql=SqlQueries.hosts_dim_select,
+        mode="upsert",
+        table_name="hosts",
+        primary_key="host_id"
+    )
+
+    # Aggregates for the BI queries, refreshed from the fact partitions this run loaded
+    create_aggregate_tables_task = PostgresOperator(
+        task_id="Create_Aggregate_Tables",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=[SqlQueries.create_listing_stays_daily_table,
+             SqlQueries.create_city_guest_stays_daily_table,
+             SqlQueries.create_city_guest_stays_table,
+             SqlQueries.create_zipcode_price_histogram_table]
+    )
+
+    refresh_listing_stays_task = LoadAggregateOperator(
+        task_id="Refresh_Listing_Stays_Daily",
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=SqlQueries.listing_stays_daily_select,
+        table_name="listing_stays_daily",
+        partition_value=BACKFILL_START if backfill else STAY_DATE,
+        partition_end_value=BACKFILL_END if backfill else ""
+    )
+
+    refresh_city_guest_stays_task = LoadAggregateOperator(
+        task_id="Refresh_City_Guest_Stays",
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=SqlQueries.city_guest_stays_daily_select,
+        table_name="city_guest_stays_daily",
+        partition_value=BACKFILL_START if backfill else STAY_DATE,
+        partition_end_value=BACKFILL_END if backfill else "",
+        rollup_table="city_guest_stays",
+        rollup_keys=["city", "guest_id"],
+        measure="stay_count"
+    )
+
+    refresh_zipcode_price_histogram_task = LoadAggregateOperator(
+        task_id="Refresh_Zipcode_Price_Histogram",
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=SqlQueries.zipcode_price_histogram_select,
+        mode="keys",
+        table_name="zipcode_price_histogram",
+        key_column="zipcode",
+        delete_condition=SqlQueries.zipcode_price_histogram_stale
+    )
+
+    create_dq_results_table_task = PostgresOperator(
+        task_id="Create_DQ_Results_Table",
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=SqlQueries.create_dq_results_table
+    )
+
+    # The fact is checked only in the partitions this run loaded, the tables that grow with
+    # every day's guests use the approximate unique check
+    dq_check_task = DataQualityOperator(
+        task_id="Run_Data_Quality_Checks",
+        dag=dag,
+        redshift_conn_id="redshift",
+        aws_credentials_id="aws_credentials",
+        partition_value=BACKFILL_START if backfill else STAY_DATE,
+        partition_end_value=BACKFILL_END if backfill else "",
+        table_info_dict=[{"table_name": "guest_stays", "partition_column": "stay_date",                    \
+                   "not_null": ["stay_id", "listing_key"], "unique": "stay_id"},                           \
+                  {"table_name": "listing_stays_daily", "partition_column": "stay_date",                   \
+                   "not_null": "listing_id"},                                                              \
+                  {"table_name": "listings", "not_null": "listing_id", "unique": "listing_id"},            \
+                  {"table_name": "guests", "not_null": "guest_id", "unique": "guest_id",                   \
+                   "approximate": True},                                                                   \
+                  {"table_name": "availability", "not_null": "listing_id", "unique": "listing_id"},        \
+                  {"table_name": "hosts", "not_null": "host_id", "unique": "host_id"},                     \
+                  {"table_name": "reviews", "not_null": "listing_id", "unique": "listing_id"},             \
+                  {"table_name": "listing_keys", "not_null": "listing_key", "unique": "listing_key"},      \
+                  {"table_name": "host_keys", "not_null": "host_key", "unique": "host_key"},               \
+                  {"table_name": "guest_keys", "not_null": "guest_key", "unique": "guest_key",             \
+                   "approximate": True},                                                                   \
+                  {"table_name": "amenities", "not_null": "amenity_id", "unique": "amenity_id"},           \
+                  {"table_name": "listing_amenities", "not_null": ["amenity_id", "listing_key"]},          \
+                  {"table_name": "city_guest_stays", "not_null": ["city", "guest_id"]},                    \
+                  {"table_name": "zipcode_price_histogram", "not_null": "zipcode"}                         \
+                 ]
+    )
+
+    end_operator = DummyOperator(
+                        task_id='End_Execution',
+                        dag=dag
+    )
+
+    start_operator >> [create_listings_stage_table, create_listing_amenities_stage_table, create_key_tables_task,
+                       create_dq_results_table_task]
+    stage_listings_tasks >> create_guest_stays_fact_table
+    key_tasks = [assign_listing_keys_task, assign_host_keys_task, assign_guest_keys_task]
+    create_key_tables_task >> key_tasks
+    stage_listings_tasks >> assign_listing_keys_task
+    stage_listings_tasks >> assign_host_keys_task
+    copy_stays_to_redshift_task >> assign_guest_keys_task
+    key_tasks >> create_guest_stays_fact_table
+
+    if check_stays_data_task:
+        start_operator >> check_stays_data_task >> clean_stays_data_task
+    else:
+        start_operator >> clean_stays_data_task
+    clean_stays_data_task >> create_stays_stage_table
+    create_stays_stage_table >> copy_stays_to_redshift_task >> create_guest_stays_fact_table
+
+    create_guest_stays_fact_table >> create_fact_load_log_table >> load_guest_stays_task
+
+    load_guest_stays_task >> create_listings_dim_table_task >> load_listings_task >> dq_check_task
+    load_guest_stays_task >> create_availability_dim_table_task >> load_availability_task >> dq_check_task
+    load_guest_stays_task >> create_hosts_dim_table_task >> load_hosts_task >> dq_check_task
+    load_guest_stays_task >> create_reviews_dim_table_task >> load_reviews_task >> dq_check_task
+    load_guest_stays_task >> create_amenity_tables_task >> load_amenities_task >> load_listing_amenities_task
+    load_listing_amenities_task >> dq_check_task
+    load_guest_stays_task >> create_guests_dim_table_task >> load_guests_task >> dq_check_task
+
+    load_guest_stays_task >> create_aggregate_tables_task >> refresh_listing_stays_task >> dq_check_task
+    [create_aggregate_tables_task, load_listings_task] >> refresh_city_guest_stays_task >> dq_check_task
+    [create_aggregate_tables_task, load_listings_task, load_availability_task] >> refresh_zipcode_price_histogram_task
+    refresh_zipcode_price_histogram_task >> dq_check_task
+
+    create_dq_results_table_task >> dq_check_task
+    dq_check_task >> end_operator
+
+    return dag
+
+
+main_dag = create_stays_dag('AirBnB_Stays_17', MARKETS)
+backfill_dag = create_stays_dag('AirBnB_Stays_17_Backfill', MARKETS, backfill=True)
@@ -0,0 +1,57 @@
+from datetime import datetime
+from airflow import DAG
+from airflow.operators.dummy_operator import DummyOperator
+from airflow.operators import PostgresOperator, AssignSurrogateKeysOperator
+from helpers import SqlQueries, SURROGATE_KEY_MIGRATIONS
+
+# Adds the surrogate keys to tables created before the key maps existed. Trigger manually
+# once, while the stays DAGs are paused and before Migrate_Table_Design. The key maps are
+# filled from every natural id the tables hold, then each table is deep-copied with its keys
+# looked up in the maps, in its own transaction, so a failed task leaves that table untouched.
+dag = DAG('Migrate_Surrogate_Keys',
+                description="Add surrogate keys to warehouse tables created before the key maps",
+                start_date=datetime(2017, 1, 1),
+                schedule_interval=None,
+                catchup=False
+)
+
+start_operator = DummyOperator(task_id='Begin_Migration', dag=dag)
+keys_assigned = DummyOperator(task_id='Keys_Assigned', dag=dag)
+end_operator = DummyOperator(task_id='Stop_Migration', dag=dag)
+
+create_key_tables_task = PostgresOperator(
+    task_id="Create_Key_Tables",
+    dag=dag,
+    postgres_conn_id="redshift",
+    sql=[SqlQueries.create_listing_keys_table,
+         SqlQueries.create_host_keys_table,
+         SqlQueries.create_guest_keys_table]
+)
+start_operator >> create_key_tables_task
+
+key_maps = []
+for _, table_key_maps in SURROGATE_KEY_MIGRATIONS:
+    key_maps += [key_map for key_map in table_key_maps if key_map not in key_maps]
+
+for key_map in key_maps:
+    natural_key, surrogate_key = key_map.column_names()
+    sources = [spec.name for spec, table_key_maps in SURROGATE_KEY_MIGRATIONS if key_map in table_key_maps]
+    assign_keys_task = AssignSurrogateKeysOperator(
+        task_id="Assign_{}".format(key_map.name),
+        dag=dag,
+        redshift_conn_id="redshift",
+        sql=" UNION ".join("SELECT {} FROM {}".format(natural_key, source) for source in sources),
+        table_name=key_map.name,
+        natural_key=natural_key,
+        surrogate_key=surrogate_key
+    )
+    create_key_tables_task >> assign_keys_task >> keys_assigned
+
+for spec, table_key_maps in SURROGATE_KEY_MIGRATIONS:
+    migrate_task = PostgresOperator(
+        task_id="Migrate_{}".format(spec.name),
+        dag=dag,
+        postgres_conn_id="redshift",
+        sql=spec.migration_sql(key_maps=table_key_maps)
+    )
+    keys_assigned >> migrate_task >> end_operator
@@ -0,0 +1,36 @@
+from datetime import datetime
+from airflow import DAG
+from airflow.operators.dummy_operator import DummyOperator
+from airflow.operators import PythonOperator
+from helpers import TABLE_SPECS, get_redshift_hook
+
+# Rebuilds existing tables with the distribution, sort keys and encodings declared in
+# helpers.table_design. Trigger manually once, while the stays DAG is paused; every table
+# is deep-copied in its own transaction, so a failed task leaves that table untouched.
+# Tables created before the surrogate keys existed need Migrate_Surrogate_Keys first.
+dag = DAG('Migrate_Table_Design',
+                description="Deep copy existing warehouse tables into their current physical design",
+                start_date=datetime(2017, 1, 1),
+                schedule_interval=None,
+                catchup=False
+)
+
+def migrate_table(spec):
+    # Tables the warehouse doesn't have yet are created in the design instead
+    redshift = get_redshift_hook("redshift")
+    if redshift.get_records(spec.exists_sql()):
+        redshift.run(spec.migration_sql())
+    else:
+        redshift.run(spec.create_sql())
+
+start_operator = DummyOperator(task_id='Begin_Migration', dag=dag)
+end_operator = DummyOperator(task_id='Stop_Migration', dag=dag)
+
+for spec in TABLE_SPECS:
+    migrate_task = PythonOperator(
+        task_id="Migrate_{}".format(spec.name),
+        dag=dag,
+        python_callable=migrate_table,
+        op_kwargs={"spec": spec}
+    )
+    start_operator >> migrate_task >> end_operator
@@ -14,6 +14,8 @@ class AirbnbPlugin(AirflowPlugin):
         operators.StageToRedshiftOperator,
         operators.LoadFactOperator,
         operators.LoadDimensionOperator,
+        operators.LoadAggregateOperator,
+        operators.AssignSurrogateKeysOperator,
         operators.DataQualityOperator
     ]
     helpers = [
@@ -1,5 +1,55 @@
 from helpers.sql_queries import SqlQueries
+from helpers.table_design import TableSpec, TABLE_SPECS, SURROGATE_KEY_MIGRATIONS
+from helpers.json_stream import iter_json_array, batched
+from helpers.compression import (compression_for_key, resolve_compression, compress_bytes, decompress_bytes,
+                                 stream_compressor, copy_compression_clause)
+from helpers.serialization import to_parquet_bytes, parquet_rows
+from helpers.multipart import MultipartUploadWriter
+from helpers.ranged_download import RangedDownload
+from helpers.manifest import MANIFEST_SUFFIX, manifest_key, companion_key, shard_key, build_copy_manifest
+from helpers.warehouse import (get_aws_credentials, get_s3_client, missing_object, get_redshift_hook,
+                               PooledRedshiftHook)
+from helpers.instrumentation import TaskMetrics, instrumented
+from helpers.local_mode import LOCAL_MODE, FilesystemS3Client, LocalRedshiftHook
+from helpers.seen_index import SeenKeyIndex, hash_keys, date_number
+from helpers.frame_schema import compact_column, compact_frame, concat_frames
 
 __all__ = [
     'SqlQueries',
+    'TableSpec',
+    'TABLE_SPECS',
+    'SURROGATE_KEY_MIGRATIONS',
+    'iter_json_array',
+    'batched',
+    'compression_for_key',
+    'resolve_compression',
+    'compress_bytes',
+    'decompress_bytes',
+    'stream_compressor',
+    'copy_compression_clause',
+    'to_parquet_bytes',
+    'parquet_rows',
+    'MultipartUploadWriter',
+    'RangedDownload',
+    'MANIFEST_SUFFIX',
+    'manifest_key',
+    'companion_key',
+    'shard_key',
+    'build_copy_manifest',
+    'get_aws_credentials',
+    'get_s3_client',
+    'missing_object',
+    'get_redshift_hook',
+    'PooledRedshiftHook',
+    'TaskMetrics',
+    'instrumented',
+    'LOCAL_MODE',
+    'FilesystemS3Client',
+    'LocalRedshiftHook',
+    'SeenKeyIndex',
+    'hash_keys',
+    'date_number',
+    'compact_column',
+    'compact_frame',
+    'concat_frames',
 ]
\ No newline at end of file
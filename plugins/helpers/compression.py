@@ -0,0 +1,118 @@
+import bz2
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression name -> (file extension, Redshift COPY keyword)
+COMPRESSION_FORMATS = {
+    "gzip":  (".gz",  "GZIP"),
+    "zstd":  (".zst", "ZSTD"),
+    "bzip2": (".bz2", "BZIP2"),
+}
+
+
+def compression_for_key(key):
+    """
+    Infer the compression of an S3 object from its key extension
+    :param key: S3 key, e.g. stays/temp_store/clean-stays.csv.gz
+    :return: gzip, zstd, bzip2 or None for uncompressed objects
+    """
+    for compression, (extension, _) in COMPRESSION_FORMATS.items():
+        if key.endswith(extension):
+            return compression
+    return None
+
+
+def resolve_compression(compression, key):
+    """
+    Return the compression to use for `key`, "auto" infers it from the extension
+    :param compression: auto, None, gzip, zstd or bzip2
+    :param key: S3 key the compression applies to
+    """
+    if compression == "auto":
+        return compression_for_key(key)
+    if compression is not None and compression not in COMPRESSION_FORMATS:
+        raise ValueError("Unsupported compression {}, expected one of {}".format(
+            compression, ", ".join(COMPRESSION_FORMATS)))
+    return compression
+
+
+def compress_bytes(data, compression):
+    """
+    Compress `data` with the given compression, None returns it unchanged
+    :param data: bytes to compress
+    :param compression: None, gzip, zstd or bzip2
+    """
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "bzip2":
+        return bz2.compress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError("Unsupported compression {}".format(compression))
+
+
+class _Uncompressed:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def stream_compressor(compression):
+    """
+    Incremental compressor for output written in pieces, compress() each piece and flush() at the end.
+    The concatenated output decompresses like compress_bytes of the whole input.
+    :param compression: None, gzip, zstd or bzip2
+    """
+    if compression is None:
+        return _Uncompressed()
+    if compression == "gzip":
+        # wbits 31 writes the gzip header and trailer around the deflate stream
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "bzip2":
+        return bz2.BZ2Compressor()
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("Unsupported compression {}".format(compression))
+
+
+def decompress_bytes(data, compression):
+    """
+    Reverse of compress_bytes
+    :param data: bytes to decompress
+    :param compression: None, gzip, zstd or bzip2
+    """
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "bzip2":
+        return bz2.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        # Streamed frames carry no content size, a decompressobj handles both kinds
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError("Unsupported compression {}".format(compression))
+
+
+def copy_compression_clause(compression):
+    """
+    Redshift COPY option matching `compression`, empty for uncompressed input
+    :param compression: None, gzip, zstd or bzip2
+    """
+    if compression is None:
+        return ""
+    return COMPRESSION_FORMATS[compression][1]
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# Integral floats up to this size are exact in float32 and print the same as in float64
+FLOAT32_EXACT_LIMIT = 2 ** 24
+
+
+def _holds_none(values):
+    return values.dtype == object and any(value is None for value in values.values)
+
+
+def compact_column(values, kind):
+    """
+    Smaller representation of one parsed column, the values themselves are unchanged
+    :param values: Series as built by pd.DataFrame from the parsed records
+    :param kind: category (low-cardinality strings) or numeric
+    """
+    if kind == "category":
+        # Object columns, or the string dtype newer pandas versions infer. None and NaN would
+        # become the same missing category but are cleaned differently, so columns holding None stay
+        if pd.api.types.is_string_dtype(values.dtype) and not isinstance(values.dtype, pd.CategoricalDtype):
+            if _holds_none(values):
+                return values
+            return values.astype("category")
+        return values
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return pd.to_numeric(values, downcast="integer")
+    if pd.api.types.is_float_dtype(values.dtype):
+        # Counts with missing values arrive as float64, they only shrink when float32 holds them exactly
+        present = values.dropna()
+        if (present == present.round()).all() and (present.abs() <= FLOAT32_EXACT_LIMIT).all():
+            return values.astype(np.float32)
+    return values
+
+
+def compact_frame(df, schema):
+    """
+    Apply a declared schema to a freshly parsed frame, columns it does not name are kept as they are
+    :param df: DataFrame of parsed records
+    :param schema: Dict of column name to kind, see compact_column
+    :return: (compacted DataFrame, bytes saved on the compacted columns)
+    """
+    saved = 0
+    compacted = {}
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        before = df[column].memory_usage(deep=True, index=False)
+        compacted[column] = compact_column(df[column], kind)
+        saved += before - compacted[column].memory_usage(deep=True, index=False)
+    if compacted:
+        df = df.assign(**compacted)
+    return df, saved
+
+
+def concat_frames(frames):
+    """
+    pd.concat of compacted frames. Categorical columns of frames parsed separately have
+    different categories, which pd.concat would turn back into object columns.
+    :param frames: List of DataFrames
+    """
+    categorical_columns = set()
+    for frame in frames:
+        categorical_columns.update(column for column in frame.columns
+                                   if isinstance(frame[column].dtype, pd.CategoricalDtype))
+    for column in categorical_columns:
+        # A frame that kept the column as objects because it holds None turns it back into objects
+        # in every frame, the categorical frames only had NaN for missing values
+        if any(column in frame.columns and _holds_none(frame[column]) for frame in frames):
+            for index, frame in enumerate(frames):
+                if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype):
+                    frames[index] = frame.assign(**{column: frame[column].astype(object)})
+            continue
+        parts = []
+        for frame in frames:
+            if column in frame.columns:
+                values = frame[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    parts.append(np.asarray(values.cat.categories, dtype=object))
+                else:
+                    parts.append(np.asarray(values.dropna().unique(), dtype=object))
+        dtype = pd.CategoricalDtype(pd.unique(np.concatenate(parts)))
+        for index, frame in enumerate(frames):
+            if column in frame.columns:
+                frames[index] = frame.assign(**{column: frame[column].astype(dtype)})
+    return pd.concat(frames, ignore_index=True, sort=False)
@@ -0,0 +1,174 @@
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Directory scraped by the Prometheus node_exporter textfile collector, unset disables the files
+METRICS_TEXTFILE_DIR = os.environ.get("AIRBNB_METRICS_TEXTFILE_DIR")
+METRICS_PREFIX = "airbnb_task"
+XCOM_KEY = "metrics"
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of this process or its largest finished child process. Every
+    Airflow task runs in its own process, so this is the task's peak
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+class TaskMetrics:
+    """
+    Wall time per phase, bytes moved and rows handled by one task execution.
+    Phases may be entered repeatedly and from several threads, their times add up.
+    """
+
+    def __init__(self, dag_id, task_id):
+        """
+        :param dag_id: DAG ID, used as a label
+        :param task_id: Task ID, used as a label
+        """
+        self.dag_id   = dag_id
+        self.task_id  = task_id
+        self.phases   = {}
+        self.bytes    = {}
+        self.rows     = 0
+        self._start   = time.perf_counter()
+        self._elapsed = None
+        self._lock    = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed block as phase `name`, e.g. download, parse, clean, serialize, upload, copy or insert
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add_bytes(self, direction, count):
+        """
+        :param direction: download or upload
+        :param count: Number of bytes moved
+        """
+        with self._lock:
+            self.bytes[direction] = self.bytes.get(direction, 0) + count
+
+    def add_rows(self, count):
+        with self._lock:
+            self.rows += count
+
+    def stop(self):
+        if self._elapsed is None:
+            self._elapsed = time.perf_counter() - self._start
+
+    def as_dict(self):
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._start
+        return {
+            "dag_id": self.dag_id,
+            "task_id": self.task_id,
+            "seconds": elapsed,
+            "phases": dict(self.phases),
+            "bytes": dict(self.bytes),
+            "rows": self.rows,
+            "rows_per_second": self.rows / elapsed if self.rows and elapsed else None,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def prometheus_text(self):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        metrics = self.as_dict()
+        labels = 'dag_id="{}",task_id="{}"'.format(self.dag_id, self.task_id)
+        lines = []
+
+        def gauge(name, help_text, samples):
+            if not samples:
+                return
+            lines.append("# HELP {}_{} {}".format(METRICS_PREFIX, name, help_text))
+            lines.append("# TYPE {}_{} gauge".format(METRICS_PREFIX, name))
+            for extra_labels, value in samples:
+                lines.append("{}_{}{{{}{}}} {}".format(METRICS_PREFIX, name, labels, extra_labels, value))
+
+        gauge("seconds", "Wall time of the task execution", [("", metrics["seconds"])])
+        gauge("phase_seconds", "Wall time per task phase",
+              [(',phase="{}"'.format(name), value) for name, value in sorted(metrics["phases"].items())])
+        gauge("bytes", "Bytes moved by the task",
+              [(',direction="{}"'.format(name), value) for name, value in sorted(metrics["bytes"].items())])
+        gauge("rows", "Rows handled by the task", [("", metrics["rows"])])
+        if metrics["rows_per_second"] is not None:
+            gauge("rows_per_second", "Rows handled per second of wall time", [("", metrics["rows_per_second"])])
+        gauge("peak_rss_bytes", "Peak resident memory of the task process", [("", metrics["peak_rss_bytes"])])
+        gauge("last_run_timestamp_seconds", "Unix time the metrics were written", [("", int(time.time()))])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, directory):
+        # Written to a temporary name first so the collector never reads a partial file
+        path = os.path.join(directory, "{}__{}.prom".format(self.dag_id, self.task_id))
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as fileobj:
+            fileobj.write(self.prometheus_text())
+        os.replace(temp_path, path)
+        return path
+
+    def send_statsd(self):
+        # Airflow's StatsD client, a no-op unless statsd_on is set in airflow.cfg
+        try:
+            from airflow.stats import Stats
+        except ImportError:
+            from airflow.settings import Stats
+        metrics = self.as_dict()
+        prefix = "{}.{}.{}".format(METRICS_PREFIX, self.dag_id, self.task_id)
+        for name, seconds in metrics["phases"].items():
+            Stats.timing("{}.phase.{}".format(prefix, name), seconds * 1000)
+        for direction, count in metrics["bytes"].items():
+            Stats.gauge("{}.bytes.{}".format(prefix, direction), count)
+        Stats.gauge("{}.rows".format(prefix), metrics["rows"])
+        Stats.gauge("{}.peak_rss_bytes".format(prefix), metrics["peak_rss_bytes"])
+
+    def publish(self, context, log):
+        """
+        Push the metrics to XCom, StatsD and the textfile directory. Publishing never fails the task
+        :param context: Airflow task context
+        :param log: Logger of the task
+        """
+        self.stop()
+        metrics = self.as_dict()
+        log.info("Task metrics: {}".format(metrics))
+        sinks = [self.send_statsd]
+        if context.get("ti") is not None:
+            sinks.append(lambda: context["ti"].xcom_push(key=XCOM_KEY, value=metrics))
+        if METRICS_TEXTFILE_DIR:
+            sinks.append(lambda: self.write_textfile(METRICS_TEXTFILE_DIR))
+        for sink in sinks:
+            try:
+                sink()
+            except Exception as e:
+                log.warning("Could not publish task metrics: {}".format(e))
+
+
+def instrumented(execute):
+    """
+    Decorator for BaseOperator.execute, exposes a TaskMetrics as self.metrics during the
+    execution and publishes it afterwards, whether the task succeeded or failed
+    """
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        dag = context.get("dag")
+        self.metrics = TaskMetrics(dag.dag_id if dag is not None else "adhoc", self.task_id)
+        try:
+            return execute(self, context)
+        finally:
+            self.metrics.publish(context, self.log)
+    return wrapper
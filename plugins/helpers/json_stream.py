@@ -0,0 +1,88 @@
+import codecs
+import json
+import re
+from itertools import islice
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+_START, _FIRST_VALUE, _VALUE, _SEPARATOR = range(4)
+
+
+def iter_json_array(stream, read_size=1024 * 1024, strip_chars=""):
+    """
+    Yield the elements of a top-level JSON array one at a time, reading the
+    stream incrementally so the whole document never has to sit in memory.
+    :param stream: File-like object with a read(n) method (e.g. boto3 StreamingBody)
+    :param read_size: Number of bytes pulled from the stream per read
+    :param strip_chars: Characters removed from the text before it is parsed
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    strip_table = str.maketrans("", "", strip_chars)
+    buffer = ""
+    pos = 0
+    eof = False
+    state = _START
+
+    while True:
+        pos = _whitespace.match(buffer, pos).end()
+        need_more = pos >= len(buffer)
+
+        if not need_more:
+            if state == _START:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array at offset {}".format(pos))
+                pos += 1
+                state = _FIRST_VALUE
+                continue
+            if state == _SEPARATOR:
+                if buffer[pos] == ",":
+                    pos += 1
+                    state = _VALUE
+                    continue
+                if buffer[pos] == "]":
+                    return
+                raise ValueError("Expected ',' or ']' in JSON array, got {!r}".format(buffer[pos]))
+            if state == _FIRST_VALUE and buffer[pos] == "]":
+                return
+            try:
+                item, end = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise
+                need_more = True
+            else:
+                # A scalar cut at a read boundary can still decode (e.g. "2." of "2.5"),
+                # so only accept a value once its trailing separator has arrived
+                following = _whitespace.match(buffer, end).end()
+                if eof or (following < len(buffer) and buffer[following] in ",]"):
+                    pos = end
+                    state = _SEPARATOR
+                    yield item
+                    continue
+                need_more = True
+
+        if eof:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = stream.read(read_size)
+        if chunk:
+            text = utf8.decode(chunk)
+        else:
+            eof = True
+            text = utf8.decode(b"", final=True)
+        buffer = buffer[pos:] + text.translate(strip_table)
+        pos = 0
+
+
+def batched(iterable, size):
+    """
+    Yield lists of at most `size` items from `iterable`
+    :param iterable: Any iterable
+    :param size: Maximum number of items per batch
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
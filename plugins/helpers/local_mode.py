@@ -0,0 +1,279 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+from helpers.compression import decompress_bytes
+from helpers.manifest import MANIFEST_SUFFIX
+from helpers.serialization import parquet_rows
+from helpers.warehouse import PooledRedshiftHook
+
+# Local mode swaps S3 and Redshift for stand-ins on the same machine:
+#   AIRBNB_LOCAL_MODE=1                   turn it on
+#   AIRBNB_LOCAL_S3_ROOT=<directory>      filesystem S3, objects live in <directory>/<bucket>/<key>
+#   AIRBNB_LOCAL_S3_ENDPOINT=<url>        or an S3 compatible endpoint, e.g. a moto server
+# The PostgreSQL standing in for Redshift is the Airflow connection of the tasks, e.g.
+#   AIRFLOW_CONN_REDSHIFT=postgres://localhost/airbnb
+LOCAL_MODE = os.environ.get("AIRBNB_LOCAL_MODE", "") not in ("", "0", "false", "False")
+LOCAL_S3_ROOT = os.environ.get("AIRBNB_LOCAL_S3_ROOT", os.path.join(os.path.expanduser("~"), "airbnb-local-s3"))
+LOCAL_S3_ENDPOINT = os.environ.get("AIRBNB_LOCAL_S3_ENDPOINT")
+
+LocalCredentials = namedtuple("LocalCredentials", ["access_key", "secret_key", "token"])
+LOCAL_CREDENTIALS = LocalCredentials("local", "local", None)
+
+
+def local_s3_client():
+    """
+    S3 client of the local mode, an S3 compatible endpoint if one is configured, else the filesystem
+    """
+    if LOCAL_S3_ENDPOINT:
+        return boto3.client('s3',
+                            endpoint_url=LOCAL_S3_ENDPOINT,
+                            aws_access_key_id=LOCAL_CREDENTIALS.access_key,
+                            aws_secret_access_key=LOCAL_CREDENTIALS.secret_key,
+                            region_name="us-east-1"
+                           )
+    return FilesystemS3Client(LOCAL_S3_ROOT)
+
+
+class _NoSuchKey(ClientError):
+    pass
+
+
+class FilesystemS3Client:
+    """
+    Stand-in for the part of the boto3 S3 client the operators use, backed by a directory.
+    Missing objects raise the same ClientError codes as S3.
+    """
+
+    class exceptions:
+        NoSuchKey = _NoSuchKey
+        ClientError = ClientError
+
+    def __init__(self, root):
+        """
+        :param root: Directory holding one sub-directory per bucket
+        """
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def _stat(self, bucket, key, operation):
+        path = self._path(bucket, key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            code = "404" if operation == "HeadObject" else "NoSuchKey"
+            raise _NoSuchKey({"Error": {"Code": code, "Message": "Not Found", "Key": key}}, operation)
+        # Changes whenever the object is rewritten, which is what the ETag is used for here
+        etag = '"{}"'.format(hashlib.md5("{}-{}".format(stat.st_size, stat.st_mtime_ns).encode()).hexdigest())
+        return path, {"ContentLength": stat.st_size,
+                      "ETag": etag,
+                      "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc)}
+
+    def create_bucket(self, Bucket, **kwargs):
+        os.makedirs(os.path.join(self.root, Bucket), exist_ok=True)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return self._stat(Bucket, Key, "HeadObject")[1]
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path, response = self._stat(Bucket, Key, "GetObject")
+        body = open(path, "rb")
+        if Range is None:
+            response["Body"] = body
+            return response
+        size = response["ContentLength"]
+        start, _, end = Range[len("bytes="):].partition("-")
+        if start == "":
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        with body:
+            body.seek(start)
+            data = body.read(end - start + 1)
+        response.update(Body=io.BytesIO(data), ContentLength=len(data),
+                        ContentRange="bytes {}-{}/{}".format(start, end, size))
+        return response
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode()
+        # Readers never see a partially written object
+        temp_path = path + ".uploading"
+        with open(temp_path, "wb") as fileobj:
+            if isinstance(Body, bytes):
+                fileobj.write(Body)
+            else:
+                for chunk in iter(lambda: Body.read(1 << 20), b""):
+                    fileobj.write(chunk)
+        os.replace(temp_path, path)
+        return {"ETag": self.head_object(Bucket, Key)["ETag"]}
+
+    def _upload_path(self, upload_id, part_number=None):
+        # Parts wait outside the bucket directories, so listings never see them
+        path = os.path.join(self.root, ".multipart", upload_id)
+        return path if part_number is None else os.path.join(path, "{:05d}".format(part_number))
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_path(upload_id))
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Body, Bucket, Key, PartNumber, UploadId, **kwargs):
+        with open(self._upload_path(UploadId, PartNumber), "wb") as fileobj:
+            fileobj.write(Body)
+        return {"ETag": '"{}"'.format(hashlib.md5(Body).hexdigest())}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".uploading"
+        with open(temp_path, "wb") as fileobj:
+            for part in sorted(MultipartUpload["Parts"], key=lambda part: part["PartNumber"]):
+                with open(self._upload_path(UploadId, part["PartNumber"]), "rb") as part_file:
+                    shutil.copyfileobj(part_file, fileobj)
+        os.replace(temp_path, path)
+        shutil.rmtree(self._upload_path(UploadId))
+        return {"Bucket": Bucket, "Key": Key, "ETag": self.head_object(Bucket, Key)["ETag"]}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        shutil.rmtree(self._upload_path(UploadId), ignore_errors=True)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, names in os.walk(bucket_root):
+            for name in names:
+                if name.endswith(".uploading"):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    contents.append({"Key": key, "Size": os.path.getsize(os.path.join(directory, name))})
+        contents.sort(key=lambda entry: entry["Key"])
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+
+_COPY_RE = re.compile(r"^\s*COPY\s+(?P<table>[\w.]+)\s+FROM\s+'s3://(?P<bucket>[^/']+)/(?P<key>[^']*)'(?P<options>.*)$",
+                      re.IGNORECASE | re.DOTALL)
+
+
+class LocalRedshiftHook(PooledRedshiftHook):
+    """
+    PooledRedshiftHook on a PostgreSQL database standing in for Redshift. COPY from S3
+    becomes a COPY FROM STDIN of the objects read through an S3 client, and the few
+    Redshift-only functions the operators use are rewritten.
+    """
+
+    def __init__(self, redshift_conn_id, s3_client, max_connections=8, dsn=None):
+        """
+        :param redshift_conn_id: Connection ID of the local database
+        :param s3_client: S3 client the COPY sources are read with
+        :param max_connections: Upper bound of open connections in the pool
+        :param dsn: libpq connection string used instead of the connection, for tests and benchmarks
+        """
+        super(LocalRedshiftHook, self).__init__(redshift_conn_id, max_connections)
+        self.s3_client = s3_client
+        self.dsn       = dsn
+
+    def _connection_kwargs(self):
+        if self.dsn:
+            return {"dsn": self.dsn}
+        return PooledRedshiftHook._connection_kwargs(self)
+
+    def translate_sql(self, sql):
+        sql = re.sub(r"\bGETDATE\(\)", "LOCALTIMESTAMP", sql, flags=re.IGNORECASE)
+        # PostgreSQL only has the exact COUNT(DISTINCT)
+        return re.sub(r"\bAPPROXIMATE\s+(?=COUNT\s*\()", "", sql, flags=re.IGNORECASE)
+
+    def run(self, sql, parameters=None):
+        statements = [sql] if isinstance(sql, str) else list(sql)
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                for statement in statements:
+                    copy = _COPY_RE.match(statement)
+                    if copy:
+                        LocalRedshiftHook.copy_from_s3(self, cursor, **copy.groupdict())
+                    else:
+                        cursor.execute(LocalRedshiftHook.translate_sql(self, statement), parameters)
+
+    def get_records(self, sql, parameters=None):
+        return super(LocalRedshiftHook, self).get_records(LocalRedshiftHook.translate_sql(self, sql), parameters)
+
+    def copy_sources(self, bucket, key, manifest):
+        # A manifest lists the objects, otherwise COPY loads every object under the key prefix
+        if manifest:
+            entries = json.loads(self.s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())["entries"]
+            return [tuple(entry["url"][len("s3://"):].split("/", 1)) for entry in entries]
+        listing = self.s3_client.list_objects_v2(Bucket=bucket, Prefix=key)
+        return [(bucket, entry["Key"]) for entry in listing.get("Contents", [])]
+
+    def copy_from_s3(self, cursor, table, bucket, key, options):
+        ignore_header = re.search(r"\bIGNOREHEADER\s+(\d+)", options, re.IGNORECASE)
+        delimiter = re.search(r"\bDELIMITER\s+'([^']*)'", options, re.IGNORECASE)
+        data_format = re.search(r"\bFORMAT\s+AS\s+(\w+)(?:\s+'([^']*)')?", options, re.IGNORECASE)
+        compression = re.search(r"\b(GZIP|ZSTD|BZIP2)\b", options, re.IGNORECASE)
+        manifest = re.search(r"\bMANIFEST\b", options, re.IGNORECASE) is not None
+        data_format = data_format.group(1).lower() if data_format else "text"
+        if manifest and not key.endswith(MANIFEST_SUFFIX):
+            raise ValueError("MANIFEST COPY from {} does not name a manifest".format(key))
+
+        for source_bucket, source_key in LocalRedshiftHook.copy_sources(self, bucket, key, manifest):
+            body = self.s3_client.get_object(Bucket=source_bucket, Key=source_key)["Body"].read()
+            if compression and data_format != "parquet":
+                # The COPY keywords are the upper-case compression names
+                body = decompress_bytes(body, compression.group(1).lower())
+            if data_format == "parquet":
+                _, rows = parquet_rows(body)
+                LocalRedshiftHook.copy_rows(self, cursor, table, rows)
+            elif data_format == "json":
+                LocalRedshiftHook.copy_json(self, cursor, table, body)
+            else:
+                # Plain delimited text: quotes and backslashes are data, like a Redshift COPY without CSV
+                for _ in range(int(ignore_header.group(1)) if ignore_header else 0):
+                    body = body.split(b"\n", 1)[1] if b"\n" in body else b""
+                cursor.copy_expert("COPY {} FROM STDIN WITH (FORMAT csv, DELIMITER '{}', QUOTE E'\\x01')".format(
+                    table, delimiter.group(1) if delimiter else "|"), io.BytesIO(body))
+
+    def copy_rows(self, cursor, table, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for row in rows:
+            writer.writerow(["\\N" if value is None else value for value in row])
+        buffer.seek(0)
+        cursor.copy_expert("COPY {} FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(table), buffer)
+
+    def copy_json(self, cursor, table, body):
+        # JSON 'auto': one object per record, keys matched to column names case-insensitively
+        schema, _, name = table.rpartition(".")
+        cursor.execute("SELECT column_name FROM information_schema.columns "
+                       "WHERE table_name = %s AND table_schema = %s ORDER BY ordinal_position",
+                       (name.lower(), (schema or "public").lower()))
+        columns = [column for column, in cursor.fetchall()]
+        decoder = json.JSONDecoder()
+        text = body.decode()
+        rows = []
+        position = 0
+        while True:
+            while position < len(text) and text[position].isspace():
+                position += 1
+            if position >= len(text):
+                break
+            record, position = decoder.raw_decode(text, position)
+            record = {field.lower(): value for field, value in record.items()}
+            values = [record.get(column) for column in columns]
+            rows.append([json.dumps(value) if isinstance(value, (dict, list)) else value for value in values])
+        LocalRedshiftHook.copy_rows(self, cursor, table, rows)
@@ -0,0 +1,46 @@
+import json
+
+MANIFEST_SUFFIX = ".manifest"
+
+
+def manifest_key(key):
+    """
+    Key of the COPY manifest that lists the objects written for `key`
+    :param key: S3 key the manifest stands for
+    """
+    return key + MANIFEST_SUFFIX
+
+
+def companion_key(key, name):
+    """
+    Key of an object written alongside `key`, the name goes before the extensions so
+    compression can still be inferred, e.g. clean.csv.gz -> clean.amenities.csv.gz
+    :param key: S3 key of the main object
+    :param name: Name of the companion object
+    """
+    directory, _, base = key.rpartition("/")
+    stem, dot, extensions = base.partition(".")
+    base = "{}.{}{}{}".format(stem, name, dot, extensions)
+    return "{}/{}".format(directory, base) if directory else base
+
+
+def shard_key(key, index):
+    """
+    Key of one shard of `key`, e.g. clean.csv.gz -> clean.part-0003.csv.gz
+    :param key: S3 key of the unsharded object
+    :param index: Shard number
+    """
+    return companion_key(key, "part-{:04d}".format(index))
+
+
+def build_copy_manifest(bucket, objects):
+    """
+    Redshift COPY manifest for a list of objects
+    :param bucket: Name of the S3 Bucket
+    :param objects: List of (key, content_length) tuples
+    """
+    entries = [{"url": "s3://{}/{}".format(bucket, key),
+                "mandatory": True,
+                "meta": {"content_length": content_length}}
+               for key, content_length in objects]
+    return json.dumps({"entries": entries})
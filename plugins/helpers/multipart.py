@@ -0,0 +1,120 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 rejects multipart parts smaller than this, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class MultipartUploadWriter:
+    """
+    File-like writer streaming into one S3 object. Written bytes are cut into parts that
+    upload on a thread pool while the caller keeps writing. At most `concurrency` parts
+    are queued or in flight, a write waits for a free slot, so memory stays around
+    part_size * (concurrency + 1) whatever the object size. An object smaller than one
+    part is stored with a single put_object. Used as a context manager the upload is
+    completed on exit, or aborted if the block raised.
+    """
+
+    def __init__(self, client, bucket, key, part_size=16 * 1024 * 1024, concurrency=4):
+        """
+        :param client: boto3 S3 client, shared by the upload threads
+        :param bucket: Name of the S3 Bucket
+        :param key: Key of the object written
+        :param part_size: Bytes per part, at least 5 MB
+        :param concurrency: Number of parts uploading at the same time
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError("Multipart parts must be at least {} bytes, got {}".format(MIN_PART_SIZE, part_size))
+        self.client        = client
+        self.bucket        = bucket
+        self.key           = key
+        self.part_size     = part_size
+        self.concurrency   = max(1, concurrency)
+        self.bytes_written = 0
+        self._buffer       = bytearray()
+        self._futures      = []
+        self._upload_id    = None
+        self._executor     = None
+        self._slots        = threading.BoundedSemaphore(self.concurrency)
+        self._closed       = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        # Fail fast instead of serializing the rest of the object after a part failed
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self._slots.acquire()
+        future = self._executor.submit(self._upload_part, len(self._futures) + 1, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, number, data):
+        response = self.client.upload_part(Body=data, Bucket=self.bucket, Key=self.key,
+                                           PartNumber=number, UploadId=self._upload_id)
+        return {"ETag": response["ETag"], "PartNumber": number}
+
+    def close(self):
+        """
+        Upload what is left and complete the object
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._upload_id is None:
+                self.client.put_object(Body=bytes(self._buffer), Bucket=self.bucket, Key=self.key)
+                return
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+            parts = [future.result() for future in self._futures]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                  MultipartUpload={"Parts": parts})
+        except Exception:
+            # Parts still in flight finish first, an abort before them would leave them stored
+            self._shutdown()
+            self._abort_upload()
+            raise
+        finally:
+            self._buffer = bytearray()
+        self._shutdown()
+
+    def abort(self):
+        """
+        Drop the upload, the parts sent so far are deleted and the object is left unchanged
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer = bytearray()
+        self._shutdown()
+        self._abort_upload()
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _abort_upload(self):
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
@@ -0,0 +1,139 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+# Bytes copied from a response into the buffer per read
+_READ_SIZE = 1024 * 1024
+
+
+def _retryable(error):
+    # Throttling, server errors and broken connections are worth another try, a missing
+    # object, denied access or an object changed since the download began are not
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        code = error.response.get("Error", {}).get("Code")
+        return status == 429 or status >= 500 or code in ("SlowDown", "RequestTimeout", "InternalError")
+    return True
+
+
+class RangedDownload:
+    """
+    Download of one S3 object as byte ranges fetched concurrently on a thread pool, one
+    connection per range. Every range is retried on its own and resumes at the first
+    byte it has not received yet, so a slow or broken connection never restarts the
+    object. All ranges are requested with the ETag of the object, a change while it
+    downloads fails instead of mixing versions.
+    """
+
+    def __init__(self, client, bucket, key, part_size=16 * 1024 * 1024, concurrency=8, max_attempts=4,
+                 head=None):
+        """
+        :param client: boto3 S3 client, shared by the download threads
+        :param bucket: Name of the S3 Bucket
+        :param key: Key of the object
+        :param part_size: Bytes per range
+        :param concurrency: Number of ranges downloading at the same time
+        :param max_attempts: Attempts per range before the download fails
+        :param head: head_object response of the object, requested if not given
+        """
+        self.client       = client
+        self.bucket       = bucket
+        self.key          = key
+        self.part_size    = max(1, part_size)
+        self.concurrency  = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.head         = head if head is not None else client.head_object(Bucket=bucket, Key=key)
+        self.size         = self.head["ContentLength"]
+        self.etag         = self.head.get("ETag")
+
+    def ranges(self):
+        return [(start, min(start + self.part_size, self.size) - 1) for start in range(0, self.size, self.part_size)]
+
+    def _fetch_into(self, view, start, end):
+        # view covers bytes start..end of the object
+        position = start
+        attempt = 1
+        while position <= end:
+            try:
+                kwargs = {"IfMatch": self.etag} if self.etag else {}
+                body = self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                              Range="bytes={}-{}".format(position, end), **kwargs)["Body"]
+                while position <= end:
+                    chunk = body.read(min(_READ_SIZE, end - position + 1))
+                    if not chunk:
+                        raise IOError("Connection closed at byte {} of range {}-{}".format(position, start, end))
+                    view[position - start:position - start + len(chunk)] = chunk
+                    position += len(chunk)
+            except Exception as e:
+                if attempt >= self.max_attempts or not _retryable(e):
+                    raise
+                time.sleep(min(0.1 * 2 ** attempt, 5))
+                attempt += 1
+
+    def _fetch(self, start, end):
+        part = bytearray(end - start + 1)
+        self._fetch_into(memoryview(part), start, end)
+        return part
+
+    def read_all(self):
+        """
+        The whole object in one preallocated buffer, every range is written straight into its slice
+        :return: bytearray
+        """
+        buffer = bytearray(self.size)
+        view = memoryview(buffer)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._fetch_into, view[start:end + 1], start, end)
+                       for start, end in self.ranges()]
+            for future in futures:
+                future.result()
+        return buffer
+
+    def iter_parts(self):
+        """
+        The object's ranges in order, downloading up to `concurrency` ranges ahead of the
+        consumer, so memory stays at that many parts however large the object is
+        """
+        pending = deque(self.ranges())
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            in_flight = deque()
+            try:
+                while pending or in_flight:
+                    while pending and len(in_flight) < self.concurrency:
+                        start, end = pending.popleft()
+                        in_flight.append(executor.submit(self._fetch, start, end))
+                    yield in_flight.popleft().result()
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def stream(self):
+        """
+        File-like object reading the object in order, e.g. for iter_json_array
+        """
+        return _PartStream(self.iter_parts())
+
+
+class _PartStream:
+
+    def __init__(self, parts):
+        self._parts  = parts
+        self._buffer = b""
+        self._offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            rest = [self._buffer[self._offset:]] + list(self._parts)
+            self._buffer, self._offset = b"", 0
+            return b"".join(rest)
+        while len(self._buffer) - self._offset < size:
+            part = next(self._parts, None)
+            if part is None:
+                break
+            self._buffer = self._buffer[self._offset:] + part
+            self._offset = 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
@@ -0,0 +1,124 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from helpers.warehouse import missing_object
+
+# Fixed so key hashes stay comparable across runs and pandas versions
+HASH_KEY = "airbnb-stay-ids."
+ENTRY_DTYPE = np.dtype([("key", "<u8"), ("date", "<u4")])
+
+
+def hash_keys(values):
+    """
+    64-bit hashes of record ids, ids are compared by their string form
+    :param values: Series of ids
+    """
+    return pd.util.hash_pandas_object(values.astype(str), index=False, hash_key=HASH_KEY).values
+
+
+def date_number(date):
+    """
+    YYYY-MM-DD as the integer YYYYMMDD, which orders like the dates
+    """
+    return int(str(date).replace("-", "")[:8])
+
+
+class SeenKeyIndex:
+    """
+    Persistent set of record ids already delivered, with the date each was first seen.
+    Stored in S3 as hash partitions, each a sorted array of (64-bit id hash, date) entries.
+    Partitions are read, merged and written back one at a time, so memory stays at one
+    partition (12 bytes per id) however long the history grows. Updates must not run
+    concurrently, the last writer of a partition wins.
+    """
+
+    def __init__(self, client, bucket, prefix, partitions=64):
+        """
+        :param client: boto3 S3 client
+        :param bucket: Name of the S3 Bucket
+        :param prefix: Key prefix of the index objects
+        :param partitions: Number of partitions of a new index, an existing index keeps its own
+        """
+        self.client     = client
+        self.bucket     = bucket
+        self.prefix     = prefix.rstrip("/")
+        self.partitions = partitions
+
+    def _meta_key(self):
+        return "{}/_index.json".format(self.prefix)
+
+    def _partition_key(self, partition):
+        return "{}/part-{:04d}.npy".format(self.prefix, partition)
+
+    def _load_meta(self):
+        try:
+            meta = json.loads(self.client.get_object(Bucket=self.bucket, Key=self._meta_key())["Body"].read())
+        except ClientError as e:
+            if not missing_object(e):
+                raise
+            self.client.put_object(Body=json.dumps({"partitions": self.partitions}), Bucket=self.bucket,
+                                   Key=self._meta_key())
+            return
+        self.partitions = meta["partitions"]
+
+    def _load_partition(self, partition):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._partition_key(partition))["Body"].read()
+        except ClientError as e:
+            if not missing_object(e):
+                raise
+            return np.empty(0, dtype=ENTRY_DTYPE)
+        return np.load(io.BytesIO(body), allow_pickle=False)
+
+    def _store_partition(self, partition, entries):
+        buffer = io.BytesIO()
+        np.save(buffer, entries, allow_pickle=False)
+        self.client.put_object(Body=buffer.getvalue(), Bucket=self.bucket, Key=self._partition_key(partition))
+
+    def filter_and_update(self, keys, date, record):
+        """
+        Find the ids first seen before `date` and record the new ones
+        :param keys: Array of id hashes (see hash_keys)
+        :param date: Date of this delivery as YYYYMMDD (see date_number)
+        :param record: Boolean array, ids to add to the index if they are new
+        :return: Boolean array, True for ids not seen before `date`. Ids first seen on
+                 `date` itself stay True, so rerunning a day keeps its records
+        """
+        self._load_meta()
+        keys = np.asarray(keys, dtype=np.uint64)
+        record = np.asarray(record, dtype=bool)
+        keep = np.ones(len(keys), dtype=bool)
+        partition_of = keys % np.uint64(self.partitions)
+        for partition in np.unique(partition_of):
+            rows = np.flatnonzero(partition_of == partition)
+            entries = self._load_partition(int(partition))
+
+            # Ids already in the index, sorted search over the partition
+            positions = np.searchsorted(entries["key"], keys[rows])
+            found = positions < len(entries)
+            found[found] = entries["key"][positions[found]] == keys[rows][found]
+            seen_dates = np.zeros(len(rows), dtype=np.uint32)
+            seen_dates[found] = entries["date"][positions[found]]
+            keep[rows] = ~found | (seen_dates >= date)
+
+            # An earlier delivery of an indexed id, e.g. from a backfill, moves its date back
+            changed = False
+            earlier = found & (seen_dates > date) & record[rows]
+            if earlier.any():
+                entries["date"][positions[earlier]] = date
+                changed = True
+            new_keys = np.unique(keys[rows][~found & record[rows]])
+            if len(new_keys):
+                additions = np.empty(len(new_keys), dtype=ENTRY_DTYPE)
+                additions["key"] = new_keys
+                additions["date"] = date
+                entries = np.concatenate([entries, additions])
+                entries = entries[np.argsort(entries["key"], kind="stable")]
+                changed = True
+            if changed:
+                self._store_partition(int(partition), entries)
+        return keep
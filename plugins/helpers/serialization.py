@@ -0,0 +1,37 @@
+import io
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def to_parquet_bytes(df, compression="snappy"):
+    """
+    Serialize a cleaned DataFrame to Parquet with every column typed as a string,
+    matching the VARCHAR columns of the staging tables. Missing values are written
+    as real nulls rather than placeholder strings.
+    :param df: DataFrame to serialize
+    :param compression: Parquet codec (snappy, gzip, zstd, brotli or None)
+    """
+    if pa is None:
+        raise ValueError("Parquet output requires the pyarrow package")
+    schema = pa.schema([(str(column), pa.string()) for column in df.columns])
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=compression)
+    return buffer.getvalue()
+
+
+def parquet_rows(data):
+    """
+    Column names and rows of a Parquet file, nulls come back as None
+    :param data: Parquet file content
+    """
+    if pa is None:
+        raise ValueError("Reading Parquet requires the pyarrow package")
+    table = pq.read_table(io.BytesIO(data))
+    columns = table.column_names
+    return columns, [tuple(row[column] for column in columns) for row in table.to_pylist()]
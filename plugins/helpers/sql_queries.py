@@ -1,231 +1,246 @@
+from helpers import table_design
+from helpers.local_mode import LOCAL_MODE
+
+
 class SqlQueries:
-    create_staging_listings_table = ("""
-         CREATE TABLE IF NOT EXISTS public.staging_listings
-         ( 
-            listing_id              VARCHAR,         
-            minimum_nights          VARCHAR,     
-            maximum_nights          VARCHAR,     
-            availability_30         VARCHAR,    
-            availability_60         VARCHAR,    
-            availability_90         VARCHAR,    
-            availability_365        VARCHAR,   
-            number_of_reviews       VARCHAR,  
-            reviews_per_month       VARCHAR,  
-            first_review            VARCHAR,       
-            last_review             VARCHAR,        
-            host_id                 VARCHAR,            
-            host_url                VARCHAR,           
-            host_name               VARCHAR,          
-            host_location           VARCHAR,      
-            host_since              VARCHAR,         
-            host_listings_count     VARCHAR,
-            host_response_rate      VARCHAR, 
-            host_response_time      VARCHAR, 
-            listing_title           VARCHAR,      
-            listing_url             VARCHAR,        
-            neighbourhood           VARCHAR,      
-            street                  VARCHAR,             
-            city                    VARCHAR,               
-            state                   VARCHAR,              
-            zipcode                 VARCHAR,            
-            country                 VARCHAR,            
-            property_type           VARCHAR,      
-            room_type               VARCHAR,          
-            bed_type                VARCHAR,           
-            price                   VARCHAR,              
-            security_deposit        VARCHAR,   
-            cleaning_fee            VARCHAR,
-            amenities               VARCHAR(10240),
-            accommodates            VARCHAR,       
-            bedrooms                VARCHAR,           
-            bathrooms               VARCHAR,          
-            beds                    VARCHAR,               
-            cancellation_policy     VARCHAR 
-        );
-    """)
+    # Table definitions, including distribution, sort keys and encodings, live in helpers.table_design.
+    # The local PostgreSQL standing in for Redshift gets them without the physical design
+    create_staging_listings_table = table_design.STAGING_LISTINGS.create_sql(physical=not LOCAL_MODE)
+    create_staging_listing_amenities_table = table_design.STAGING_LISTING_AMENITIES.create_sql(physical=not LOCAL_MODE)
+    create_staging_stays_table = table_design.STAGING_STAYS.create_sql(physical=not LOCAL_MODE)
+    create_listing_keys_table = table_design.LISTING_KEYS.create_sql(physical=not LOCAL_MODE)
+    create_host_keys_table = table_design.HOST_KEYS.create_sql(physical=not LOCAL_MODE)
+    create_guest_keys_table = table_design.GUEST_KEYS.create_sql(physical=not LOCAL_MODE)
+    create_listings_dim_table = table_design.LISTINGS.create_sql(physical=not LOCAL_MODE)
+    create_amenities_dim_table = table_design.AMENITIES.create_sql(physical=not LOCAL_MODE)
+    create_listing_amenities_table = table_design.LISTING_AMENITIES.create_sql(physical=not LOCAL_MODE)
+    create_guests_dim_table = table_design.GUESTS.create_sql(physical=not LOCAL_MODE)
+    create_reviews_dim_table = table_design.REVIEWS.create_sql(physical=not LOCAL_MODE)
+    create_availability_dim_table = table_design.AVAILABILITY.create_sql(physical=not LOCAL_MODE)
+    create_hosts_dim_table = table_design.HOSTS.create_sql(physical=not LOCAL_MODE)
+    create_guest_stays_fact_table = table_design.GUEST_STAYS.create_sql(physical=not LOCAL_MODE)
+    create_fact_load_log_table = table_design.FACT_LOAD_LOG.create_sql(physical=not LOCAL_MODE)
+    create_dq_results_table = table_design.DQ_RESULTS.create_sql(physical=not LOCAL_MODE)
+    create_listing_stays_daily_table = table_design.LISTING_STAYS_DAILY.create_sql(physical=not LOCAL_MODE)
+    create_city_guest_stays_daily_table = table_design.CITY_GUEST_STAYS_DAILY.create_sql(physical=not LOCAL_MODE)
+    create_city_guest_stays_table = table_design.CITY_GUEST_STAYS.create_sql(physical=not LOCAL_MODE)
+    create_zipcode_price_histogram_table = table_design.ZIPCODE_PRICE_HISTOGRAM.create_sql(physical=not LOCAL_MODE)
+        
+    # Natural ids that get surrogate keys, see AssignSurrogateKeysOperator
+    listing_keys_select = ("SELECT listing_id FROM staging_listings")
+    host_keys_select = ("SELECT host_id FROM staging_listings")
+    guest_keys_select = ("SELECT guest_id FROM staging_stays")
     
-    create_staging_stays_table = ("""
-         CREATE TABLE IF NOT EXISTS public.staging_stays
-         ( 
-            listing_id      VARCHAR,
-            guest_id        VARCHAR,  
-            guest_name      VARCHAR,
-            stay_id         VARCHAR,   
-            stay_date       VARCHAR                     
-        );
+    listings_dim_select = ("""
+        SELECT
+                    listing_key,
+                    listing_id,
+                    listing_url,
+                    listing_title,
+                    neighbourhood,
+                    street,
+                    city,
+                    zipcode,
+                    state,
+                    country,
+                    price::FLOAT4 AS price,
+                    bedrooms::FLOAT4 AS bedrooms,
+                    bathrooms::FLOAT4 AS bathrooms,
+                    cancellation_policy,
+                    accommodates::FLOAT4 AS accommodates,
+                    beds::FLOAT4 AS beds,
+                    bed_type,
+                    room_type,
+                    property_type
+        FROM staging_listings
+        JOIN listing_keys USING (listing_id)
     """)
     
-    create_listings_dim_table = ("""
-        CREATE TABLE IF NOT EXISTS public.listings (
-            listing_id          VARCHAR,
-            listing_url         VARCHAR,
-            listing_title       VARCHAR,
-            neighbourhood       VARCHAR,
-            street              VARCHAR,
-            city                VARCHAR,
-            zipcode             VARCHAR,
-            state               VARCHAR,
-            country             VARCHAR,
-            amenities           VARCHAR,
-            price               REAL,
-            bedrooms            REAL,
-            bathrooms           REAL,
-            cancellation_policy VARCHAR,
-            accommodates        REAL,
-            beds                REAL,
-            bed_type            VARCHAR,
-            room_type           VARCHAR,
-            property_type       VARCHAR,
-            CONSTRAINT listings_pkey PRIMARY KEY (listing_id)
-        );
+    listings_dim_insert = ("INSERT INTO listings (" + listings_dim_select + ")")
+    
+    # New amenity names get the next free ids, names already in the dictionary keep theirs.
+    # The lock makes concurrent runs number their new names one after the other
+    amenities_dim_insert = ("""
+        BEGIN;
+        LOCK amenities;
+        INSERT INTO amenities
+        SELECT
+                    numbered.max_id + ROW_NUMBER() OVER (ORDER BY new_amenities.amenity) AS amenity_id,
+                    new_amenities.amenity
+        FROM (
+            SELECT DISTINCT amenity
+            FROM staging_listing_amenities
+            WHERE NOT EXISTS (SELECT 1 FROM amenities WHERE amenities.amenity = staging_listing_amenities.amenity)
+        ) AS new_amenities
+        CROSS JOIN (SELECT COALESCE(MAX(amenity_id), 0) AS max_id FROM amenities) AS numbered;
+        END;
     """)
     
-    create_guests_dim_table = ("""
-        CREATE TABLE IF NOT EXISTS public.guests (
-            guest_id        VARCHAR,
-            guest_name      VARCHAR,
-            CONSTRAINT guests_pkey PRIMARY KEY (guest_id)
-        );
+    # The amenities of every staged listing are replaced, so removed amenities disappear too
+    listing_amenities_insert = ("""
+        BEGIN;
+        DELETE FROM listing_amenities
+            USING staging_listings, listing_keys
+            WHERE listing_keys.listing_id = staging_listings.listing_id
+            AND listing_amenities.listing_key = listing_keys.listing_key;
+        INSERT INTO listing_amenities
+        SELECT
+                    amenities.amenity_id,
+                    listing_keys.listing_key
+        FROM staging_listing_amenities staged
+        JOIN amenities
+        ON amenities.amenity = staged.amenity
+        JOIN listing_keys
+        ON listing_keys.listing_id = staged.listing_id;
+        END;
     """)
-
-    create_reviews_dim_table = ("""
-        CREATE TABLE IF NOT EXISTS public.reviews (
-            listing_id              VARCHAR,
-            number_of_reviews       VARCHAR,
-            reviews_per_month       VARCHAR,
-            first_review            VARCHAR,
-            last_review             VARCHAR,
-            CONSTRAINT reviews_pkey PRIMARY KEY (listing_id)
-        );
+    
+    # Every staged stay of a guest, stay_date ranks them so the latest name wins
+    guests_dim_select = ("""
+        SELECT
+                guest_key,
+                guest_id,
+                guest_name,
+                stay_date
+        FROM staging_stays
+        JOIN guest_keys USING (guest_id)
     """)
-
-    create_availability_dim_table = ("""
-        CREATE TABLE IF NOT EXISTS public.availability (
-            listing_id              VARCHAR,
-            minimum_nights          INT,
-            maximum_nights          INT,
-            availability_30         INT,
-            availability_60         INT,
-            availability_90         INT,
-            availability_365        INT,
-            CONSTRAINT availability_pkey PRIMARY KEY (listing_id)
-        );
+    
+    guests_dim_insert = ("INSERT INTO guests (SELECT guest_key, guest_id, guest_name FROM (" + guests_dim_select + ") AS stays)")
+    
+    reviews_dim_select = ("""
+        SELECT
+                listing_key,
+                listing_id,
+                number_of_reviews,
+                reviews_per_month,
+                first_review,
+                last_review
+        FROM staging_listings
+        JOIN listing_keys USING (listing_id)
     """)
-
-    create_hosts_dim_table = ("""
-        CREATE TABLE IF NOT EXISTS public.hosts (
-            host_id                 VARCHAR,
-            host_url                VARCHAR,
-            host_name               VARCHAR,
-            host_location           VARCHAR,
-            host_since              VARCHAR,
-            host_listings_count     VARCHAR,
-            host_response_rate      VARCHAR,
-            host_response_time      VARCHAR,
-            CONSTRAINT hosts_pkey PRIMARY KEY (host_id)
-        );
+    
+    reviews_dim_insert = ("INSERT INTO reviews (" + reviews_dim_select + ")")
+    
+    availability_dim_select = ("""
+        SELECT
+                    listing_key,
+                    listing_id,
+                    minimum_nights::INT AS minimum_nights,
+                    maximum_nights::INT AS maximum_nights,
+                    availability_30::INT AS availability_30,
+                    availability_60::INT AS availability_60,
+                    availability_90::INT AS availability_90,
+                    availability_365::INT AS availability_365
+        FROM staging_listings
+        JOIN listing_keys USING (listing_id)
     """)
-
-    create_guest_stays_fact_table = ("""
-        CREATE TABLE IF NOT EXISTS public.guest_stays (
-            stay_date   VARCHAR,
-            stay_id     VARCHAR,
-            guest_id    VARCHAR,
-            listing_id  VARCHAR,
-            host_id     VARCHAR,
-            price       REAL,
-            CONSTRAINT gueststays_pkey PRIMARY KEY (stay_id)
-        );
+    
+    availability_dim_insert = ("INSERT INTO availability (" + availability_dim_select + ")")
+    
+    hosts_dim_select = ("""
+        SELECT
+                    host_key,
+                    host_id,
+                    host_url,
+                    host_name,
+                    host_location,
+                    host_since,
+                    host_listings_count,
+                    host_response_rate,
+                    host_response_time
+        FROM staging_listings
+        JOIN host_keys USING (host_id)
     """)
-        
-    listings_dim_insert = ("""
-        INSERT INTO listings 
-        (   SELECT
-                        listing_id,
-                        listing_url,
-                        listing_title,
-                        neighbourhood,
-                        street,
-                        city,
-                        zipcode,
-                        state,
-                        country,
-                        amenities,
-                        price::FLOAT4 AS price,
-                        bedrooms::FLOAT4 AS bedrooms,
-                        bathrooms::FLOAT4 AS bathrooms,
-                        cancellation_policy,
-                        accommodates::FLOAT4 AS accommodates,
-                        beds::FLOAT4 AS beds,
-                        bed_type,
-                        room_type,
-                        property_type
-            FROM staging_listings
-        )
+    
+    hosts_dim_insert = ("INSERT INTO hosts (" + hosts_dim_select + ")")
+    
+    # Natural ids resolve to the surrogate keys assigned before the load
+    guest_stays_fact_source = ("""
+        SELECT
+                stays.stay_date AS stay_date,
+                stays.stay_id AS stay_id,
+                guest_keys.guest_key AS guest_key,
+                listing_keys.listing_key AS listing_key,
+                host_keys.host_key AS host_key,
+                listings.price::FLOAT4 AS price
+        FROM staging_listings listings
+        JOIN staging_stays stays
+        ON listings.listing_id = stays.listing_id
+        JOIN listing_keys
+        ON listing_keys.listing_id = listings.listing_id
+        LEFT JOIN host_keys
+        ON host_keys.host_id = listings.host_id
+        LEFT JOIN guest_keys
+        ON guest_keys.guest_id = stays.guest_id
     """)
     
-    guests_dim_insert = ("""
-        INSERT INTO guests 
-        (   SELECT
-                    guest_id,
-                    guest_name
-            FROM staging_stays
-        )
+    # The partition load fills in {start} and {end}, the first and last stay_date it replaces,
+    # so only the staged stays of the replaced slices are read and joined
+    guest_stays_fact_select = (guest_stays_fact_source + """
+        WHERE stays.stay_date BETWEEN '{start}' AND '{end}'
     """)
     
-    reviews_dim_insert = ("""
-        INSERT INTO reviews 
-        (   SELECT
-                    listing_id,
-                    number_of_reviews,
-                    reviews_per_month,
-                    first_review,
-                    last_review
-            FROM staging_listings
-        )
+    guest_stays_fact_insert = ("INSERT INTO guest_stays (" + guest_stays_fact_source + ")")
+    
+    
+    # Aggregate refreshes, {start} and {end} bound the fact partitions being refreshed.
+    # Counts are grouped on the surrogate keys, the natural ids are looked up for the result rows only
+    listing_stays_daily_select = ("""
+        SELECT
+                daily.stay_date AS stay_date,
+                listing_keys.listing_id AS listing_id,
+                daily.stay_count AS stay_count
+        FROM (
+            SELECT
+                    stay_date,
+                    listing_key,
+                    COUNT(*)::INT AS stay_count
+            FROM guest_stays
+            WHERE stay_date BETWEEN '{start}' AND '{end}'
+            GROUP BY stay_date, listing_key
+        ) AS daily
+        JOIN listing_keys
+        ON listing_keys.listing_key = daily.listing_key
     """)
     
-    availability_dim_insert = ("""
-        INSERT INTO availability 
-        (   SELECT
-                        listing_id,
-                        minimum_nights::INT AS minimum_nights,
-                        maximum_nights::INT AS maximum_nights,
-                        availability_30::INT AS availability_30,
-                        availability_60::INT AS availability_60,
-                        availability_90::INT AS availability_90,
-                        availability_365::INT AS availability_365
-            FROM staging_listings
-        )
+    city_guest_stays_daily_select = ("""
+        SELECT
+                daily.stay_date AS stay_date,
+                daily.city AS city,
+                COALESCE(guest_keys.guest_id, '') AS guest_id,
+                daily.stay_count AS stay_count
+        FROM (
+            SELECT
+                    stays.stay_date AS stay_date,
+                    COALESCE(listings.city, '') AS city,
+                    stays.guest_key AS guest_key,
+                    COUNT(*)::INT AS stay_count
+            FROM guest_stays stays
+            JOIN listings
+            ON listings.listing_key = stays.listing_key
+            WHERE stays.stay_date BETWEEN '{start}' AND '{end}'
+            GROUP BY stays.stay_date, COALESCE(listings.city, ''), stays.guest_key
+        ) AS daily
+        LEFT JOIN guest_keys
+        ON guest_keys.guest_key = daily.guest_key
     """)
     
-    hosts_dim_insert = ("""
-        INSERT INTO hosts 
-        (   SELECT
-                        host_id,
-                        host_url,
-                        host_name,
-                        host_location,
-                        host_since,
-                        host_listings_count,
-                        host_response_rate,
-                        host_response_time
-            FROM staging_listings
-        )
+    # Prices in buckets of 50, only the zipcodes of the listings staged by this run change
+    zipcode_price_histogram_select = ("""
+        SELECT
+                COALESCE(listings.zipcode, '') AS zipcode,
+                (FLOOR(listings.price / 50) * 50)::INT AS price_bucket,
+                COUNT(*)::INT AS listing_count,
+                SUM(CASE WHEN availability.availability_365 = 0 THEN 1 ELSE 0 END)::INT AS unavailable_count
+        FROM listings
+        LEFT JOIN availability
+        ON availability.listing_key = listings.listing_key
+        WHERE COALESCE(listings.zipcode, '') IN (SELECT DISTINCT COALESCE(zipcode, '') FROM staging_listings)
+        GROUP BY COALESCE(listings.zipcode, ''), (FLOOR(listings.price / 50) * 50)::INT
     """)
     
-    guest_stays_fact_insert = ("""
-        INSERT INTO guest_stays 
-        (   SELECT
-                    stays.stay_date AS stay_date,
-                    stays.stay_id AS stay_id,
-                    stays.guest_id AS guest_id,
-                    listings.listing_id AS listing_id,
-                    listings.host_id AS host_id,
-                    listings.price::FLOAT4 AS price
-            FROM staging_listings listings
-            JOIN staging_stays stays
-            ON listings.listing_id = stays.listing_id
-        )
+    # Zipcodes no listing has any more, their histogram rows are removed by the same refresh
+    zipcode_price_histogram_stale = ("""
+        NOT EXISTS (SELECT 1 FROM listings WHERE COALESCE(listings.zipcode, '') = zipcode_price_histogram.zipcode)
     """)
-    
\ No newline at end of file
@@ -0,0 +1,456 @@
+class TableSpec:
+    """
+    Declarative description of a Redshift table: columns with their compression
+    encoding plus the distribution and sort keys. The CREATE TABLE statements in
+    SqlQueries and the migrations of existing tables are generated from these.
+    """
+
+    def __init__(self, name, columns, primary_key=None, constraint_name=None,
+                 diststyle="AUTO", distkey=None, sortkey=()):
+        """
+        :param name: Table name in the public schema
+        :param columns: List of (column name, type, encoding) tuples
+        :param primary_key: Primary key column(s), informational only on Redshift
+        :param constraint_name: Name of the primary key constraint
+        :param diststyle: KEY, ALL, EVEN or AUTO
+        :param distkey: Distribution column, implies DISTSTYLE KEY
+        :param sortkey: Sort key column(s)
+        """
+        self.name            = name
+        self.columns         = columns
+        self.primary_key     = primary_key
+        self.constraint_name = constraint_name
+        self.diststyle       = "KEY" if distkey else diststyle
+        self.distkey         = distkey
+        self.sortkey         = tuple(sortkey)
+
+    def column_names(self):
+        return [column for column, _, _ in self.columns]
+
+    def table_attributes(self):
+        attributes = ["DISTSTYLE {}".format(self.diststyle)]
+        if self.distkey:
+            attributes.append("DISTKEY ({})".format(self.distkey))
+        if self.sortkey:
+            attributes.append("SORTKEY ({})".format(", ".join(self.sortkey)))
+        return "\n        ".join(attributes)
+
+    def create_sql(self, table_name=None, if_not_exists=True, physical=True):
+        """
+        CREATE TABLE statement for the spec
+        :param table_name: Create the table under another name (used by migrations)
+        :param if_not_exists: Add IF NOT EXISTS
+        :param physical: Include encodings, distribution and sort keys, False gives plain PostgreSQL DDL
+        """
+        definitions = [("{:<24}{:<16}ENCODE {}" if physical else "{:<24}{}").format(column, data_type, encoding)
+                       for column, data_type, encoding in self.columns]
+        # Redshift never enforces primary keys, the plain DDL leaves them out so a local
+        # PostgreSQL accepts and rejects the same rows
+        if self.primary_key and physical:
+            # Constraint names must be unique, so a copy created for a migration stays unnamed
+            constraint = "CONSTRAINT {} ".format(self.constraint_name) if self.constraint_name and not table_name else ""
+            definitions.append("{}PRIMARY KEY ({})".format(constraint, self.primary_key))
+        return """
+        CREATE TABLE {}public.{} (
+            {}
+        )
+        {};
+    """.format("IF NOT EXISTS " if if_not_exists else "",
+               table_name or self.name,
+               ",\n            ".join(definitions),
+               self.table_attributes() if physical else "")
+
+    def exists_sql(self):
+        """
+        Query returning a row if the table exists in the public schema
+        """
+        return ("SELECT 1 FROM information_schema.tables "
+                "WHERE table_schema = 'public' AND table_name = '{}'".format(self.name))
+
+    def migration_sql(self, key_maps=()):
+        """
+        Deep copy of an existing table into the spec's physical design. Rows are copied
+        into a new table built from the spec, which then takes over the name, all in one
+        transaction. Columns copy by name, columns the spec no longer has are dropped.
+        :param key_maps: Key map specs of surrogate key columns the existing table doesn't have yet.
+                         The keys are looked up by the natural ids the table holds, ids missing from
+                         a map get a NULL key
+        """
+        new_name = "{}_redesign".format(self.name)
+        old_name = "{}_predesign".format(self.name)
+        columns = ", ".join(self.column_names())
+        sources = {}
+        joins = ""
+        for key_map in key_maps:
+            natural_key, surrogate_key = key_map.column_names()
+            sources[surrogate_key] = key_map.name
+            joins += "\n        LEFT JOIN public.{map} ON {map}.{natural} = {table}.{natural}".format(
+                map=key_map.name, natural=natural_key, table=self.name)
+        select = ", ".join("{}.{}".format(sources.get(column, self.name), column) for column in self.column_names())
+        return """
+        BEGIN;
+        {create}
+        INSERT INTO public.{new} ({columns})
+        SELECT {select} FROM public.{table}{joins};
+        ALTER TABLE public.{table} RENAME TO {old};
+        ALTER TABLE public.{new} RENAME TO {table};
+        DROP TABLE public.{old};
+        END;
+    """.format(create=self.create_sql(table_name=new_name, if_not_exists=False).strip(),
+               new=new_name, old=old_name, table=self.name, columns=columns, select=select, joins=joins)
+
+
+# Staging tables are distributed on listing_id so the fact join is collocated
+STAGING_LISTINGS = TableSpec(
+    "staging_listings",
+    [
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("minimum_nights",      "VARCHAR",          "ZSTD"),
+        ("maximum_nights",      "VARCHAR",          "ZSTD"),
+        ("availability_30",     "VARCHAR",          "ZSTD"),
+        ("availability_60",     "VARCHAR",          "ZSTD"),
+        ("availability_90",     "VARCHAR",          "ZSTD"),
+        ("availability_365",    "VARCHAR",          "ZSTD"),
+        ("number_of_reviews",   "VARCHAR",          "ZSTD"),
+        ("reviews_per_month",   "VARCHAR",          "ZSTD"),
+        ("first_review",        "VARCHAR",          "ZSTD"),
+        ("last_review",         "VARCHAR",          "ZSTD"),
+        ("host_id",             "VARCHAR",          "ZSTD"),
+        ("host_url",            "VARCHAR",          "ZSTD"),
+        ("host_name",           "VARCHAR",          "ZSTD"),
+        ("host_location",       "VARCHAR",          "ZSTD"),
+        ("host_since",          "VARCHAR",          "ZSTD"),
+        ("host_listings_count", "VARCHAR",          "ZSTD"),
+        ("host_response_rate",  "VARCHAR",          "ZSTD"),
+        ("host_response_time",  "VARCHAR",          "BYTEDICT"),
+        ("listing_title",       "VARCHAR",          "ZSTD"),
+        ("listing_url",         "VARCHAR",          "ZSTD"),
+        ("neighbourhood",       "VARCHAR",          "ZSTD"),
+        ("street",              "VARCHAR",          "ZSTD"),
+        ("city",                "VARCHAR",          "ZSTD"),
+        ("state",               "VARCHAR",          "ZSTD"),
+        ("zipcode",             "VARCHAR",          "ZSTD"),
+        ("country",             "VARCHAR",          "BYTEDICT"),
+        ("property_type",       "VARCHAR",          "BYTEDICT"),
+        ("room_type",           "VARCHAR",          "BYTEDICT"),
+        ("bed_type",            "VARCHAR",          "BYTEDICT"),
+        ("price",               "VARCHAR",          "ZSTD"),
+        ("security_deposit",    "VARCHAR",          "ZSTD"),
+        ("cleaning_fee",        "VARCHAR",          "ZSTD"),
+        ("accommodates",        "VARCHAR",          "ZSTD"),
+        ("bedrooms",            "VARCHAR",          "ZSTD"),
+        ("bathrooms",           "VARCHAR",          "ZSTD"),
+        ("beds",                "VARCHAR",          "ZSTD"),
+        ("cancellation_policy", "VARCHAR",          "BYTEDICT"),
+    ],
+    distkey="listing_id"
+)
+
+# (listing, amenity name) pairs parsed from the listings by the cleaner
+STAGING_LISTING_AMENITIES = TableSpec(
+    "staging_listing_amenities",
+    [
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("country",             "VARCHAR",          "BYTEDICT"),
+        ("amenity",             "VARCHAR(256)",     "ZSTD"),
+    ],
+    distkey="listing_id"
+)
+
+STAGING_STAYS = TableSpec(
+    "staging_stays",
+    [
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("guest_id",            "VARCHAR",          "ZSTD"),
+        ("guest_name",          "VARCHAR",          "ZSTD"),
+        ("stay_id",             "VARCHAR",          "ZSTD"),
+        ("stay_date",           "VARCHAR",          "RAW"),
+    ],
+    distkey="listing_id",
+    sortkey=["stay_date"]
+)
+
+# Surrogate key maps: every natural id gets a BIGINT key once and keeps it
+LISTING_KEYS = TableSpec(
+    "listing_keys",
+    [
+        ("listing_id",          "VARCHAR",          "RAW"),
+        ("listing_key",         "BIGINT",           "AZ64"),
+    ],
+    primary_key="listing_id",
+    constraint_name="listingkeys_pkey",
+    distkey="listing_id",
+    sortkey=["listing_id"]
+)
+
+HOST_KEYS = TableSpec(
+    "host_keys",
+    [
+        ("host_id",             "VARCHAR",          "RAW"),
+        ("host_key",            "BIGINT",           "AZ64"),
+    ],
+    primary_key="host_id",
+    constraint_name="hostkeys_pkey",
+    diststyle="ALL",
+    sortkey=["host_id"]
+)
+
+GUEST_KEYS = TableSpec(
+    "guest_keys",
+    [
+        ("guest_id",            "VARCHAR",          "RAW"),
+        ("guest_key",           "BIGINT",           "AZ64"),
+    ],
+    primary_key="guest_id",
+    constraint_name="guestkeys_pkey",
+    distkey="guest_id",
+    sortkey=["guest_id"]
+)
+
+# Listing-keyed dimensions share the fact table's distribution key
+LISTINGS = TableSpec(
+    "listings",
+    [
+        ("listing_key",         "BIGINT",           "RAW"),
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("listing_url",         "VARCHAR",          "ZSTD"),
+        ("listing_title",       "VARCHAR",          "ZSTD"),
+        ("neighbourhood",       "VARCHAR",          "ZSTD"),
+        ("street",              "VARCHAR",          "ZSTD"),
+        ("city",                "VARCHAR",          "ZSTD"),
+        ("zipcode",             "VARCHAR",          "ZSTD"),
+        ("state",               "VARCHAR",          "ZSTD"),
+        ("country",             "VARCHAR",          "BYTEDICT"),
+        ("price",               "REAL",             "ZSTD"),
+        ("bedrooms",            "REAL",             "ZSTD"),
+        ("bathrooms",           "REAL",             "ZSTD"),
+        ("cancellation_policy", "VARCHAR",          "BYTEDICT"),
+        ("accommodates",        "REAL",             "ZSTD"),
+        ("beds",                "REAL",             "ZSTD"),
+        ("bed_type",            "VARCHAR",          "BYTEDICT"),
+        ("room_type",           "VARCHAR",          "BYTEDICT"),
+        ("property_type",       "VARCHAR",          "BYTEDICT"),
+    ],
+    primary_key="listing_id",
+    constraint_name="listings_pkey",
+    distkey="listing_key",
+    sortkey=["listing_key"]
+)
+
+# Dictionary of amenity names, small enough to be copied to every node
+AMENITIES = TableSpec(
+    "amenities",
+    [
+        ("amenity_id",          "INT",              "RAW"),
+        ("amenity",             "VARCHAR(256)",     "ZSTD"),
+    ],
+    primary_key="amenity_id",
+    constraint_name="amenities_pkey",
+    diststyle="ALL",
+    sortkey=["amenity_id"]
+)
+
+# Listing <-> amenity bridge, sorted on the amenity so an amenity filter reads a narrow range
+LISTING_AMENITIES = TableSpec(
+    "listing_amenities",
+    [
+        ("amenity_id",          "INT",              "RAW"),
+        ("listing_key",         "BIGINT",           "AZ64"),
+    ],
+    primary_key="amenity_id, listing_key",
+    constraint_name="listingamenities_pkey",
+    distkey="listing_key",
+    sortkey=["amenity_id", "listing_key"]
+)
+
+GUESTS = TableSpec(
+    "guests",
+    [
+        ("guest_key",           "BIGINT",           "RAW"),
+        ("guest_id",            "VARCHAR",          "ZSTD"),
+        ("guest_name",          "VARCHAR",          "ZSTD"),
+    ],
+    primary_key="guest_id",
+    constraint_name="guests_pkey",
+    distkey="guest_key",
+    sortkey=["guest_key"]
+)
+
+REVIEWS = TableSpec(
+    "reviews",
+    [
+        ("listing_key",         "BIGINT",           "RAW"),
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("number_of_reviews",   "VARCHAR",          "ZSTD"),
+        ("reviews_per_month",   "VARCHAR",          "ZSTD"),
+        ("first_review",        "VARCHAR",          "ZSTD"),
+        ("last_review",         "VARCHAR",          "ZSTD"),
+    ],
+    primary_key="listing_id",
+    constraint_name="reviews_pkey",
+    distkey="listing_key",
+    sortkey=["listing_key"]
+)
+
+AVAILABILITY = TableSpec(
+    "availability",
+    [
+        ("listing_key",         "BIGINT",           "RAW"),
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("minimum_nights",      "INT",              "AZ64"),
+        ("maximum_nights",      "INT",              "AZ64"),
+        ("availability_30",     "INT",              "AZ64"),
+        ("availability_60",     "INT",              "AZ64"),
+        ("availability_90",     "INT",              "AZ64"),
+        ("availability_365",    "INT",              "AZ64"),
+    ],
+    primary_key="listing_id",
+    constraint_name="availability_pkey",
+    distkey="listing_key",
+    sortkey=["listing_key"]
+)
+
+# Small enough to keep a full copy on every node
+HOSTS = TableSpec(
+    "hosts",
+    [
+        ("host_key",            "BIGINT",           "RAW"),
+        ("host_id",             "VARCHAR",          "ZSTD"),
+        ("host_url",            "VARCHAR",          "ZSTD"),
+        ("host_name",           "VARCHAR",          "ZSTD"),
+        ("host_location",       "VARCHAR",          "ZSTD"),
+        ("host_since",          "VARCHAR",          "ZSTD"),
+        ("host_listings_count", "VARCHAR",          "ZSTD"),
+        ("host_response_rate",  "VARCHAR",          "ZSTD"),
+        ("host_response_time",  "VARCHAR",          "BYTEDICT"),
+    ],
+    primary_key="host_id",
+    constraint_name="hosts_pkey",
+    diststyle="ALL",
+    sortkey=["host_key"]
+)
+
+# Date-range queries prune on the sort key, joins to listings stay node-local.
+# Listings, hosts and guests are referenced by their surrogate keys
+GUEST_STAYS = TableSpec(
+    "guest_stays",
+    [
+        ("stay_date",           "VARCHAR",          "RAW"),
+        ("stay_id",             "VARCHAR",          "ZSTD"),
+        ("guest_key",           "BIGINT",           "AZ64"),
+        ("listing_key",         "BIGINT",           "AZ64"),
+        ("host_key",            "BIGINT",           "AZ64"),
+        ("price",               "REAL",             "ZSTD"),
+    ],
+    primary_key="stay_id",
+    constraint_name="gueststays_pkey",
+    distkey="listing_key",
+    sortkey=["stay_date"]
+)
+
+FACT_LOAD_LOG = TableSpec(
+    "fact_load_log",
+    [
+        ("table_name",          "VARCHAR",          "ZSTD"),
+        ("partition_value",     "VARCHAR",          "ZSTD"),
+        ("source_version",      "VARCHAR",          "ZSTD"),
+        ("loaded_at",           "TIMESTAMP",        "AZ64"),
+    ],
+    primary_key="table_name, partition_value",
+    constraint_name="factloadlog_pkey",
+    diststyle="ALL"
+)
+
+# Data quality results per checked partition, whole-table figures are summed from them
+DQ_RESULTS = TableSpec(
+    "dq_results",
+    [
+        ("table_name",          "VARCHAR",          "ZSTD"),
+        ("partition_value",     "VARCHAR",          "ZSTD"),
+        ("row_count",           "BIGINT",           "AZ64"),
+        ("null_count",          "BIGINT",           "AZ64"),
+        ("duplicate_count",     "BIGINT",           "AZ64"),
+        ("approximate",         "BOOLEAN",          "ZSTD"),
+        ("checked_at",          "TIMESTAMP",        "AZ64"),
+    ],
+    primary_key="table_name, partition_value",
+    constraint_name="dqresults_pkey",
+    diststyle="ALL",
+    sortkey=["table_name", "partition_value"]
+)
+
+# Aggregates behind the BI queries, refreshed from each newly loaded fact partition.
+# Stays per listing and day: most popular listings on a given date
+LISTING_STAYS_DAILY = TableSpec(
+    "listing_stays_daily",
+    [
+        ("stay_date",           "VARCHAR",          "RAW"),
+        ("listing_id",          "VARCHAR",          "ZSTD"),
+        ("stay_count",          "INT",              "AZ64"),
+    ],
+    primary_key="stay_date, listing_id",
+    constraint_name="listingstaysdaily_pkey",
+    distkey="listing_id",
+    sortkey=["stay_date"]
+)
+
+# Stays per city, guest and day, the slices the city_guest_stays totals are adjusted from
+CITY_GUEST_STAYS_DAILY = TableSpec(
+    "city_guest_stays_daily",
+    [
+        ("stay_date",           "VARCHAR",          "RAW"),
+        ("city",                "VARCHAR",          "BYTEDICT"),
+        ("guest_id",            "VARCHAR",          "ZSTD"),
+        ("stay_count",          "INT",              "AZ64"),
+    ],
+    primary_key="stay_date, city, guest_id",
+    constraint_name="cityguestsstaysdaily_pkey",
+    distkey="guest_id",
+    sortkey=["stay_date"]
+)
+
+# Stays per city and guest over all loaded days: most frequent guests in a city
+CITY_GUEST_STAYS = TableSpec(
+    "city_guest_stays",
+    [
+        ("city",                "VARCHAR",          "RAW"),
+        ("guest_id",            "VARCHAR",          "ZSTD"),
+        ("stay_count",          "INT",              "AZ64"),
+    ],
+    primary_key="city, guest_id",
+    constraint_name="cityguestsstays_pkey",
+    distkey="guest_id",
+    sortkey=["city"]
+)
+
+# Listings per zipcode and price bucket, with how many have no availability for a year
+ZIPCODE_PRICE_HISTOGRAM = TableSpec(
+    "zipcode_price_histogram",
+    [
+        ("zipcode",             "VARCHAR",          "RAW"),
+        ("price_bucket",        "INT",              "AZ64"),
+        ("listing_count",       "INT",              "AZ64"),
+        ("unavailable_count",   "INT",              "AZ64"),
+    ],
+    primary_key="zipcode, price_bucket",
+    constraint_name="zipcodepricehistogram_pkey",
+    diststyle="ALL",
+    sortkey=["zipcode", "price_bucket"]
+)
+
+TABLE_SPECS = [STAGING_LISTINGS, STAGING_LISTING_AMENITIES, STAGING_STAYS, LISTING_KEYS, HOST_KEYS, GUEST_KEYS,
+               LISTINGS, AMENITIES, LISTING_AMENITIES, GUESTS, REVIEWS, AVAILABILITY, HOSTS, GUEST_STAYS,
+               FACT_LOAD_LOG, DQ_RESULTS, LISTING_STAYS_DAILY, CITY_GUEST_STAYS_DAILY, CITY_GUEST_STAYS,
+               ZIPCODE_PRICE_HISTOGRAM]
+
+# Tables created before the surrogate keys existed, with the key maps their key columns are
+# looked up in. The natural ids they still hold fill the maps before the tables are copied.
+# listing_amenities came with the keys, the next listings load creates and fills it
+SURROGATE_KEY_MIGRATIONS = [
+    (LISTINGS, [LISTING_KEYS]),
+    (GUESTS, [GUEST_KEYS]),
+    (REVIEWS, [LISTING_KEYS]),
+    (AVAILABILITY, [LISTING_KEYS]),
+    (HOSTS, [HOST_KEYS]),
+    (GUEST_STAYS, [GUEST_KEYS, LISTING_KEYS, HOST_KEYS]),
+]
@@ -0,0 +1,168 @@
+import threading
+from contextlib import contextmanager
+
+import boto3
+from airflow.contrib.hooks.aws_hook import AwsHook
+from airflow.hooks.postgres_hook import PostgresHook
+from psycopg2.pool import ThreadedConnectionPool
+
+# Per-process caches, shared by every operator executed in the same task process
+_lock = threading.Lock()
+_pools = {}
+_credentials = {}
+_s3_clients = {}
+
+
+def _local_mode():
+    # Imported late, helpers.local_mode builds on PooledRedshiftHook below
+    from helpers import local_mode
+    return local_mode if local_mode.LOCAL_MODE else None
+
+
+def get_aws_credentials(aws_credentials_id):
+    """
+    AWS credentials for a connection id, looked up once per process
+    :param aws_credentials_id: AWS Credentials ID
+    """
+    with _lock:
+        if aws_credentials_id not in _credentials:
+            local_mode = _local_mode()
+            if local_mode:
+                _credentials[aws_credentials_id] = local_mode.LOCAL_CREDENTIALS
+            else:
+                _credentials[aws_credentials_id] = AwsHook(aws_credentials_id).get_credentials()
+        return _credentials[aws_credentials_id]
+
+
+def get_s3_client(aws_credentials_id):
+    """
+    boto3 S3 client for a connection id, created once per process
+    :param aws_credentials_id: AWS Credentials ID
+    """
+    credentials = get_aws_credentials(aws_credentials_id)
+    with _lock:
+        if aws_credentials_id not in _s3_clients:
+            local_mode = _local_mode()
+            if local_mode:
+                _s3_clients[aws_credentials_id] = local_mode.local_s3_client()
+                return _s3_clients[aws_credentials_id]
+            _s3_clients[aws_credentials_id] = boto3.client('s3',
+                                                           aws_access_key_id=credentials.access_key,
+                                                           aws_secret_access_key=credentials.secret_key
+                                                          )
+        return _s3_clients[aws_credentials_id]
+
+
+def missing_object(error):
+    """
+    Whether an S3 ClientError means the object does not exist. Throttling, server errors,
+    denied access and expired credentials are not, they must fail the task
+    :param error: botocore ClientError
+    """
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+
+
+def get_redshift_hook(redshift_conn_id, max_connections=8):
+    """
+    Pooled hook for a connection id, the pool is created once per process
+    :param redshift_conn_id: RedShift Connection ID
+    :param max_connections: Upper bound of open connections in the pool
+    """
+    with _lock:
+        if redshift_conn_id not in _pools:
+            local_mode = _local_mode()
+            if local_mode:
+                _pools[redshift_conn_id] = local_mode.LocalRedshiftHook(redshift_conn_id,
+                                                                        local_mode.local_s3_client(),
+                                                                        max_connections)
+            else:
+                _pools[redshift_conn_id] = PooledRedshiftHook(redshift_conn_id, max_connections)
+        return _pools[redshift_conn_id]
+
+
+class PooledRedshiftHook:
+    """
+    Drop-in for the run/get_records part of PostgresHook that hands out connections
+    from a thread-safe pool instead of opening a new one per call.
+    """
+
+    def __init__(self, redshift_conn_id, max_connections=8):
+        """
+        :param redshift_conn_id: RedShift Connection ID
+        :param max_connections: Upper bound of open connections in the pool
+        """
+        self.redshift_conn_id = redshift_conn_id
+        self.max_connections  = max_connections
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _connection_kwargs(self):
+        conn = PostgresHook.get_connection(self.redshift_conn_id)
+        kwargs = dict(host=conn.host,
+                      user=conn.login,
+                      password=conn.password,
+                      dbname=conn.schema,
+                      port=conn.port)
+        for name, value in conn.extra_dejson.items():
+            if name in ('sslmode', 'sslcert', 'sslkey', 'sslrootcert', 'sslcrl',
+                        'application_name', 'keepalives_idle', 'connect_timeout'):
+                kwargs[name] = value
+        return kwargs
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(1, self.max_connections, **self._connection_kwargs())
+            return self._pool
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection, commit on success and roll back on error
+        """
+        pool = self._get_pool()
+        conn = pool.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            broken = conn.closed != 0
+            if not broken:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=broken)
+
+    def run(self, sql, parameters=None):
+        """
+        Execute one statement or a list of statements in a single transaction on one connection
+        :param sql: SQL string or list of SQL strings
+        :param parameters: Parameters applied to every statement
+        """
+        statements = [sql] if isinstance(sql, str) else list(sql)
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                # Each statement is sent on its own, as PostgresHook.run does
+                for statement in statements:
+                    cursor.execute(statement, parameters)
+
+    def get_records(self, sql, parameters=None):
+        """
+        Execute a query and return all rows
+        :param sql: SQL string
+        :param parameters: Query parameters
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, parameters)
+                return cursor.fetchall()
+
+    def close(self):
+        """
+        Close every pooled connection
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
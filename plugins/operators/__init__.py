@@ -3,6 +3,8 @@ from operators.clean_source_data import CleanSourceOperator
 from operators.stage_redshift import StageToRedshiftOperator
 from operators.load_fact import LoadFactOperator
 from operators.load_dimension import LoadDimensionOperator
+from operators.load_aggregate import LoadAggregateOperator
+from operators.assign_surrogate_keys import AssignSurrogateKeysOperator
 from operators.data_quality import DataQualityOperator
 
 __all__ = [
@@ -11,5 +13,7 @@ __all__ = [
     'StageToRedshiftOperator',
     'LoadFactOperator',
     'LoadDimensionOperator',
+    'LoadAggregateOperator',
+    'AssignSurrogateKeysOperator',
     'DataQualityOperator'
 ]
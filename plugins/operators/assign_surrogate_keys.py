@@ -0,0 +1,64 @@
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from helpers import get_redshift_hook, instrumented
+
+class AssignSurrogateKeysOperator(BaseOperator):
+
+    ui_color = '#B5E48C'
+
+    # New natural ids get the next keys in id order, ids already in the map keep theirs,
+    # so a rerun assigns nothing. The lock makes concurrent runs assign one after the other
+    assign_keys_sql = """
+        BEGIN;
+        LOCK {table};
+        INSERT INTO {table} ({natural_key}, {surrogate_key})
+        SELECT
+                new_ids.{natural_key},
+                numbered.max_key + ROW_NUMBER() OVER (ORDER BY new_ids.{natural_key})
+        FROM (
+            SELECT DISTINCT source.{natural_key}
+            FROM ({select}) AS source
+            WHERE source.{natural_key} IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.{natural_key} = source.{natural_key})
+        ) AS new_ids
+        CROSS JOIN (SELECT COALESCE(MAX({surrogate_key}), 0) AS max_key FROM {table}) AS numbered;
+        END;
+    """
+
+    @apply_defaults
+    def __init__(self,
+                 redshift_conn_id="",
+                 sql="",
+                 table_name="",
+                 natural_key="",
+                 surrogate_key="",
+                 *args, **kwargs):
+        """
+        :param redshift_conn_id: RedShift Connection ID
+        :param sql: SELECT returning the natural ids to map, in a column named natural_key
+        :param table_name: Key map table, holding natural_key and surrogate_key
+        :param natural_key: Column of the natural id, e.g. listing_id
+        :param surrogate_key: BIGINT column of the assigned key, e.g. listing_key
+        """
+        super(AssignSurrogateKeysOperator, self).__init__(*args, **kwargs)
+        self.redshift_conn_id = redshift_conn_id
+        self.sql              = sql
+        self.table_name       = table_name
+        self.natural_key      = natural_key
+        self.surrogate_key    = surrogate_key
+
+    @instrumented
+    def execute(self, context):
+        if not self.table_name or not self.natural_key or not self.surrogate_key:
+            raise ValueError("AssignSurrogateKeysOperator requires table_name, natural_key and surrogate_key")
+        # RedShift Hook
+        redshift = get_redshift_hook(self.redshift_conn_id)
+        formatted_sql = AssignSurrogateKeysOperator.assign_keys_sql.format(
+            table=self.table_name,
+            select=self.sql,
+            natural_key=self.natural_key,
+            surrogate_key=self.surrogate_key
+        )
+        with self.metrics.phase("insert"):
+            redshift.run(formatted_sql)
+        self.log.info(f"Assigned {self.surrogate_key} to the new {self.natural_key} values in {self.table_name}")
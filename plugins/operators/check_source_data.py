@@ -1,9 +1,10 @@
-import boto3
+import io
 import json
 import pandas as pd
-from airflow.contrib.hooks.aws_hook import AwsHook
+from botocore.exceptions import ClientError
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers import get_s3_client, missing_object, iter_json_array, instrumented, RangedDownload
 
 
 class CheckSourceOperator(BaseOperator):
@@ -17,41 +18,109 @@ class CheckSourceOperator(BaseOperator):
                  aws_credentials_id="",
                  s3_bucket="",
                  s3_key="",
+                 check_mode="full",
+                 probe_bytes=65536,
+                 estimate_count=False,
+                 download_part_size=16 * 1024 * 1024,
+                 download_concurrency=8,
                  *args, **kwargs):
         """
         :param aws_credentials_id: AWS Credentials ID
         :param s3_bucket: Name of the S3 Bucket
         :param s3_key: Key for partitioning
+        :param check_mode: full (download and parse the object) or metadata (HEAD plus ranged reads)
+        :param probe_bytes: Number of bytes read from each end of the object in metadata mode
+        :param estimate_count: Estimate the number of records from the head sample in metadata mode
+        :param download_part_size: Bytes per byte range of the download in full mode
+        :param download_concurrency: Number of byte ranges downloading at the same time in full mode
         """
 
         super(CheckSourceOperator, self).__init__(*args, **kwargs)
-        self.aws_credentials_id = aws_credentials_id
-        self.s3_bucket          = s3_bucket
-        self.s3_key             = s3_key
+        self.aws_credentials_id   = aws_credentials_id
+        self.s3_bucket            = s3_bucket
+        self.s3_key               = s3_key
+        self.check_mode           = check_mode
+        self.probe_bytes          = probe_bytes
+        self.estimate_count       = estimate_count
+        self.download_part_size   = download_part_size
+        self.download_concurrency = download_concurrency
             
             
+    @instrumented
     def execute(self, context):
-        # AWS Hook
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
-        
         rendered_key = self.s3_key.format(**context)
         s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
         
         self.log.info("Checking if {} exists".format(s3_path))
        
         # Get the Data
-        client = boto3.client('s3',
-                       aws_access_key_id=credentials.access_key,
-                       aws_secret_access_key=credentials.secret_key
-                     )
-        result = client.get_object(Bucket=self.s3_bucket, Key=rendered_key) 
-        text = result["Body"].read().decode()
-        data = json.loads(text)
+        client = get_s3_client(self.aws_credentials_id)
+        if self.check_mode == "metadata":
+            CheckSourceOperator.check_metadata(self, client, rendered_key, s3_path)
+            return
         
-        # Make a DataFrame with the received data
-        df = pd.DataFrame(data)
+        # Byte ranges download in parallel into one buffer
+        with self.metrics.phase("download"):
+            download = RangedDownload(client, self.s3_bucket, rendered_key, self.download_part_size,
+                                      self.download_concurrency)
+            body = download.read_all()
+        self.metrics.add_bytes("download", download.size)
+        with self.metrics.phase("parse"):
+            data = json.loads(body)
+            
+            # Make a DataFrame with the received data
+            df = pd.DataFrame(data)
+        self.metrics.add_rows(df.shape[0])
         
         # Print number of records in the DataFrame
         self.log.info("Found {} records in {}".format(df.shape[0], s3_path))
-        
\ No newline at end of file
+        
+    def check_metadata(self, client, rendered_key, s3_path):
+        # Existence and size from a HEAD request
+        try:
+            with self.metrics.phase("download"):
+                head = client.head_object(Bucket=self.s3_bucket, Key=rendered_key)
+        except ClientError as e:
+            # Throttling or denied access is not a missing source
+            if not missing_object(e):
+                raise
+            raise ValueError("Source check failed. {} could not be found: {}".format(s3_path, e))
+        size = head["ContentLength"]
+        if size == 0:
+            raise ValueError("Source check failed. {} is empty".format(s3_path))
+        self.log.info("Found {} ({} bytes, ETag {})".format(s3_path, size, head.get("ETag")))
+        
+        # The object must open and close a JSON array of records
+        probe = min(self.probe_bytes, size)
+        first_bytes = CheckSourceOperator.read_range(self, client, rendered_key, "bytes=0-{}".format(probe - 1))
+        last_bytes = CheckSourceOperator.read_range(self, client, rendered_key, "bytes=-{}".format(probe))
+        head_text = first_bytes.decode(errors="ignore").strip()
+        tail_text = last_bytes.decode(errors="ignore").strip()
+        if head_text[:1] != "[" or head_text[1:].lstrip()[:1] not in ("{", "]"):
+            raise ValueError("Source check failed. {} does not start with a JSON array of records".format(s3_path))
+        if tail_text[-1:] != "]" or tail_text[:-1].rstrip()[-1:] not in ("}", "["):
+            raise ValueError("Source check failed. {} does not end with a JSON array of records".format(s3_path))
+        
+        if self.estimate_count:
+            # Records that parse completely within the head sample give the average record size
+            sampled_records = 0
+            with self.metrics.phase("parse"):
+                try:
+                    for _ in iter_json_array(io.BytesIO(first_bytes)):
+                        sampled_records += 1
+                except ValueError:
+                    pass
+            if probe == size:
+                self.log.info("Found {} records in {}".format(sampled_records, s3_path))
+            elif sampled_records > 0:
+                estimate = int(size * sampled_records / probe)
+                self.log.info("Estimated ~{} records in {} from a {} byte sample".format(estimate, s3_path, probe))
+            else:
+                self.log.info("No complete record in the first {} bytes of {}, skipping estimate".format(probe, s3_path))
+        
+    def read_range(self, client, rendered_key, byte_range):
+        with self.metrics.phase("download"):
+            result = client.get_object(Bucket=self.s3_bucket, Key=rendered_key, Range=byte_range)
+            body = result["Body"].read()
+        self.metrics.add_bytes("download", len(body))
+        return body
@@ -1,16 +1,116 @@
-import boto3
+import hashlib
 import json
+import logging
+import os
+import numpy as np
 import pandas as pd
-from airflow.contrib.hooks.aws_hook import AwsHook
+from botocore.exceptions import ClientError
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers import (get_s3_client, missing_object, iter_json_array, batched, resolve_compression, compress_bytes, stream_compressor,
+                     to_parquet_bytes, MultipartUploadWriter, RangedDownload,
+                     manifest_key, companion_key, shard_key, build_copy_manifest, MANIFEST_SUFFIX, instrumented, SeenKeyIndex,
+                     hash_keys, date_number, compact_frame, concat_frames)
 
 
 class CleanSourceOperator(BaseOperator):
     
     ui_color = '#1CA9FF'
     
-    template_fields = ("s3_key",)
+    template_fields = ("s3_key", "backfill_start_date", "backfill_end_date", "s3_range_file_store")
+    
+    # Bump whenever the cleaning rules change, it invalidates every cached output
+    cleaning_rules_version = 2
+    
+    listings_dropped_columns = [                    \
+        'review_scores_accuracy',                   \
+        'geolocation',                              \
+        'features',                                 \
+        'transit',                                  \
+        'calendar_last_scraped',                    \
+        'review_scores_communication',              \
+        'longitude',                                \
+        'country_code',                             \
+        'review_scores_cleanliness',                \
+        'neighborhood_overview',                    \
+        'market',                                   \
+        'space',                                    \
+        'picture_url',                              \
+        'review_scores_value',                      \
+        'latitude',                                 \
+        'review_scores_checkin',                    \
+        'review_scores_location',                   \
+        'host_picture_url',                         \
+        'description',                              \
+        'experiences_offered',                      \
+        'extra_people',                             \
+        'smart_location',                           \
+        'xl_picture_url',                           \
+        'host_thumbnail_url',                       \
+        'scrape_id',                                \
+        'review_scores_rating',                     \
+        'calculated_host_listings_count',           \
+        'medium_url',                               \
+        'calendar_updated',                         \
+        'summary',                                  \
+        'thumbnail_url',                            \
+        'last_scraped',                             \
+        'guests_included',                          \
+        'host_total_listings_count',                \
+        'house_rules',                              \
+        'access',                                   \
+        'host_about',                               \
+        'host_neighbourhood',                       \
+        'interaction',                              \
+        'monthly_price',                            \
+        'weekly_price',                             \
+        'square_feet',                              \
+        'neighbourhood_cleansed',                   \
+        'notes'                                     \
+    ]
+    
+    stays_dropped_columns = ['comments']
+    
+    # Characters around and inside the amenity names of a listing's amenities list,
+    # e.g. {TV,"Wireless Internet"} or TV,Wireless Internet
+    amenity_strip_pattern = '[{}\'\"\n\r]'
+    
+    # Declared types of the parsed records, everything else stays as pandas infers it.
+    # Low-cardinality strings become categoricals and counts the smallest exact numeric type
+    listings_schema = {
+        'room_type': 'category',
+        'bed_type': 'category',
+        'property_type': 'category',
+        'cancellation_policy': 'category',
+        'host_response_time': 'category',
+        'city': 'category',
+        'state': 'category',
+        'zipcode': 'category',
+        'country': 'category',
+        'minimum_nights': 'numeric',
+        'maximum_nights': 'numeric',
+        'availability_30': 'numeric',
+        'availability_60': 'numeric',
+        'availability_90': 'numeric',
+        'availability_365': 'numeric',
+        'number_of_reviews': 'numeric',
+        'host_listings_count': 'numeric',
+        'host_response_rate': 'numeric',
+        'price': 'numeric',
+        'security_deposit': 'numeric',
+        'cleaning_fee': 'numeric',
+        'accommodates': 'numeric',
+        'bedrooms': 'numeric',
+        'bathrooms': 'numeric',
+        'beds': 'numeric'
+    }
+    
+    stays_schema = {
+        'date': 'category',
+        'reviewer_name': 'category'
+    }
     
     @apply_defaults
     def __init__(self,
@@ -18,62 +118,384 @@ class CleanSourceOperator(BaseOperator):
                  s3_bucket="",
                  s3_key="",
                  s3_temp_file_store="",
+                 streaming=False,
+                 chunk_size=50000,
+                 compression="auto",
+                 output_format="csv",
+                 shards=1,
+                 use_cache=False,
+                 seen_index_prefix="",
+                 seen_index_partitions=64,
+                 seen_index_date="{ds}",
+                 backfill_start_date="",
+                 backfill_end_date="",
+                 s3_range_file_store="",
+                 upload_part_size=16 * 1024 * 1024,
+                 upload_concurrency=4,
+                 download_part_size=16 * 1024 * 1024,
+                 download_concurrency=8,
                  *args, **kwargs):
         """
         :param aws_credentials_id: AWS Credentials ID
         :param s3_bucket: Name of the S3 Bucket
         :param s3_key: Key for partitioning
         :param s3_temp_file_store: Path to temperory data store after cleaning
+        :param streaming: Parse the source incrementally instead of loading it whole
+        :param chunk_size: Number of records per DataFrame chunk in streaming mode, and per CSV chunk uploaded
+        :param compression: auto (from the s3_temp_file_store extension), None, gzip, zstd or bzip2
+        :param output_format: csv or parquet
+        :param shards: Number of row shards cleaned in parallel processes, None for one per core.
+                       Anything but 1 writes one object per shard plus a COPY manifest
+        :param use_cache: Reuse the existing output when the source object and cleaning rules are unchanged
+        :param seen_index_prefix: S3 prefix of a persistent index of delivered stay ids. Stays first delivered
+                                  on an earlier date are dropped and new ones recorded, empty disables it
+        :param seen_index_partitions: Number of partitions of a new index, bounds the memory used per partition
+        :param seen_index_date: Delivery date of the source (YYYY-MM-DD), templated with the context
+        :param backfill_start_date: First day (YYYY-MM-DD) of a backfill range, empty cleans the run's own key.
+                                    In a range s3_key and s3_temp_file_store are rendered once per day
+        :param backfill_end_date: Last day (YYYY-MM-DD) of the backfill range, inclusive
+        :param s3_range_file_store: Key a backfill range is stored under, a COPY manifest listing the cleaned
+                                    objects of every day is written next to it for one load of the whole range
+        :param upload_part_size: Bytes per part of the multipart upload of CSV output, at least 5 MB
+        :param upload_concurrency: Number of parts of the CSV output uploading at the same time
+        :param download_part_size: Bytes per byte range of the source download
+        :param download_concurrency: Number of byte ranges of the source downloading at the same time
         """
 
         super(CleanSourceOperator, self).__init__(*args, **kwargs)
-        self.aws_credentials_id = aws_credentials_id
-        self.s3_bucket          = s3_bucket
-        self.s3_key             = s3_key
-        self.s3_temp_file_store = s3_temp_file_store
+        self.aws_credentials_id    = aws_credentials_id
+        self.s3_bucket             = s3_bucket
+        self.s3_key                = s3_key
+        self.s3_temp_file_store    = s3_temp_file_store
+        self.streaming             = streaming
+        self.chunk_size            = chunk_size
+        self.compression           = compression
+        self.output_format         = output_format
+        self.shards                = shards
+        self.use_cache             = use_cache
+        self.seen_index_prefix     = seen_index_prefix
+        self.seen_index_partitions = seen_index_partitions
+        self.seen_index_date       = seen_index_date
+        self.backfill_start_date   = backfill_start_date
+        self.backfill_end_date     = backfill_end_date
+        self.s3_range_file_store   = s3_range_file_store
+        self.upload_part_size      = upload_part_size
+        self.upload_concurrency    = upload_concurrency
+        self.download_part_size    = download_part_size
+        self.download_concurrency  = download_concurrency
             
             
+    @instrumented
     def execute(self, context):
-        # AWS Hook
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
+        client = get_s3_client(self.aws_credentials_id)
+        if self.backfill_start_date:
+            return CleanSourceOperator.clean_date_range(self, client, context)
+        # The source ETag identifies this version of the data for downstream loads
+        return CleanSourceOperator.clean_source(self, client, context)[0]
+    
+    def clean_date_range(self, client, context):
+        if not self.backfill_end_date or not self.s3_range_file_store:
+            raise ValueError("A backfill range requires backfill_end_date and s3_range_file_store")
+        start_date = datetime.strptime(self.backfill_start_date.format(**context), "%Y-%m-%d")
+        end_date = datetime.strptime(self.backfill_end_date.format(**context), "%Y-%m-%d")
+        if end_date < start_date:
+            raise ValueError("Backfill range ends on {:%Y-%m-%d} before it starts on {:%Y-%m-%d}".format(
+                end_date, start_date))
+        rendered_range_store = self.s3_range_file_store.format(**context)
+        
+        # Days run in order, so the seen stay index sees the deliveries as they happened
+        etags = []
+        objects = []
+        for offset in range((end_date - start_date).days + 1):
+            day = start_date + timedelta(days=offset)
+            day_context = dict(context, execution_date=day, ds=day.strftime("%Y-%m-%d"),
+                               ds_nodash=day.strftime("%Y%m%d"))
+            rendered_key = self.s3_key.format(**day_context)
+            try:
+                client.head_object(Bucket=self.s3_bucket, Key=rendered_key)
+            except ClientError as e:
+                # Only a day without a source is skipped, throttling or denied access fails the backfill
+                if not missing_object(e):
+                    raise
+                self.log.warning("No source in s3://{}/{}, skipping {:%Y-%m-%d}".format(
+                    self.s3_bucket, rendered_key, day))
+                continue
+            etag, outputs = CleanSourceOperator.clean_source(self, client, day_context)
+            etags.append(etag)
+            amenities_key = companion_key(self.s3_temp_file_store.format(**day_context), "amenities")
+            for key in outputs:
+                if not key.endswith(MANIFEST_SUFFIX) and key != amenities_key:
+                    objects.append((key, client.head_object(Bucket=self.s3_bucket, Key=key)["ContentLength"]))
+        if not etags:
+            raise ValueError("No source found between {:%Y-%m-%d} and {:%Y-%m-%d}".format(start_date, end_date))
+        
+        # One manifest over every day, so the whole range loads with a single COPY
+        manifest = build_copy_manifest(self.s3_bucket, objects)
+        with self.metrics.phase("upload"):
+            client.put_object(Body=manifest, Bucket=self.s3_bucket, Key=manifest_key(rendered_range_store))
+        self.log.info("Stored COPY manifest for {} objects of {} days in s3://{}/{}".format(
+            len(objects), len(etags), self.s3_bucket, manifest_key(rendered_range_store)))
         
+        # Changes whenever any day of the range changes
+        return '"{}"'.format(hashlib.md5("/".join(etags).encode()).hexdigest())
+    
+    def clean_source(self, client, context):
         rendered_key = self.s3_key.format(**context)
         s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
         self.log.info("Cleaning data of {}".format(s3_path))
        
-        # Get the Data
-        client = boto3.client('s3',
-                       aws_access_key_id=credentials.access_key,
-                       aws_secret_access_key=credentials.secret_key
-                     )
-        result = client.get_object(Bucket=self.s3_bucket, Key=rendered_key) 
-        text = result["Body"].read().decode()
-        text = text.replace('|', '')
-        data = json.loads(text)
-        
-        raw_data = []
-        for row in data:
-            raw_data.append(row["fields"])
-        
-        # Make a DataFrame with the received data
-        df = pd.DataFrame(raw_data)
-        self.log.info("Found {} records in {}".format(df.shape[0], s3_path))
-        
-        # Clean the Data
-        if 'listings' in rendered_key:
-            clean_df = CleanSourceOperator.clean_listings_data(self, df)
-        if 'stays' in rendered_key:
-            clean_df = CleanSourceOperator.clean_stays_data(self, df)
-            
-        # Save the cleaned DataFrame to S3
         rendered_s3_temp_file_store = self.s3_temp_file_store.format(**context)
         s3_temp_file_path = "s3://{}/{}".format(self.s3_bucket, rendered_s3_temp_file_store)
         
-        self.log.info("Storing cleaned data in {}".format(s3_temp_file_path))
-        client.put_object(Body=clean_df.to_csv(index=False, sep='|'), Bucket=self.s3_bucket, Key=rendered_s3_temp_file_store)
-        self.log.info("Stored cleaned data in {}".format(s3_temp_file_path))
-            
+        # Skip everything if this exact source was already cleaned with the current rules
+        source = None
+        if self.use_cache:
+            with self.metrics.phase("cache"):
+                source = client.head_object(Bucket=self.s3_bucket, Key=rendered_key)
+                cached_outputs = CleanSourceOperator.cached_outputs(self, client, source, rendered_s3_temp_file_store)
+            if cached_outputs:
+                self.log.info("{} is unchanged, reusing cleaned data in {}".format(s3_path, s3_temp_file_path))
+                return source["ETag"], cached_outputs
+        
+        # Get the Data, as byte ranges downloading in parallel
+        with self.metrics.phase("download"):
+            download = RangedDownload(client, self.s3_bucket, rendered_key, self.download_part_size,
+                                      self.download_concurrency, head=source)
+            source = download.head
+        self.metrics.add_bytes("download", source["ContentLength"])
+        if self.streaming:
+            # The body downloads while it is parsed, so both count as parse time
+            with self.metrics.phase("parse"):
+                df, saved = CleanSourceOperator.read_streamed_frame(self, download.stream(), rendered_key)
+        else:
+            with self.metrics.phase("download"):
+                text = download.read_all().decode()
+            with self.metrics.phase("parse"):
+                if self.output_format == "csv":
+                    text = text.replace('|', '')
+                data = json.loads(text)
+                
+                raw_data = []
+                for row in data:
+                    raw_data.append(row["fields"])
+                
+                # Make a DataFrame with the received data
+                df, saved = CleanSourceOperator.compact_records(self, pd.DataFrame(raw_data), rendered_key)
+        self.metrics.add_rows(df.shape[0])
+        self.log.info("Found {} records in {}, compact column types saved {:.1f} MB".format(
+            df.shape[0], s3_path, saved / 2 ** 20))
+        
+        # Drop stays that were already delivered on an earlier day
+        if self.seen_index_prefix and 'stays' in rendered_key:
+            with self.metrics.phase("index"):
+                df = CleanSourceOperator.drop_seen_stays(self, client, df, context)
+        
+        compression = resolve_compression(self.compression, rendered_s3_temp_file_store)
+        
+        # Amenities leave the listings as (listing, amenity) pairs for the amenity bridge table
+        amenity_outputs = []
+        if 'listings' in rendered_key:
+            with self.metrics.phase("clean"):
+                amenities_df = CleanSourceOperator.listing_amenities(self, df)
+            df = df.drop('amenities', axis=1, errors="ignore")
+            amenities_key = companion_key(rendered_s3_temp_file_store, "amenities")
+            uploaded = CleanSourceOperator.store_frame(self, client, amenities_df, compression, amenities_key)
+            self.metrics.add_bytes("upload", uploaded)
+            self.log.info("Stored {} listing amenities in s3://{}/{}".format(
+                amenities_df.shape[0], self.s3_bucket, amenities_key))
+            amenity_outputs.append(amenities_key)
+            del amenities_df
+        
+        # Sharded output always comes with a manifest, even if the worker only has one core
+        if self.shards != 1:
+            shards = self.shards or os.cpu_count() or 1
+            outputs = CleanSourceOperator.clean_shards(self, client, df, rendered_key, rendered_s3_temp_file_store,
+                                                       compression, shards)
+        else:
+            # Clean the Data
+            with self.metrics.phase("clean"):
+                if 'listings' in rendered_key:
+                    clean_df = CleanSourceOperator.clean_listings_data(self, df)
+                if 'stays' in rendered_key:
+                    clean_df = CleanSourceOperator.clean_stays_data(self, df)
+                
+            # Save the cleaned DataFrame to S3
+            self.log.info("Storing cleaned data in {}".format(s3_temp_file_path))
+            uploaded = CleanSourceOperator.store_frame(self, client, clean_df, compression, rendered_s3_temp_file_store)
+            self.metrics.add_bytes("upload", uploaded)
+            self.log.info("Stored cleaned data in {}".format(s3_temp_file_path))
+            outputs = [rendered_s3_temp_file_store]
+        # The main output stays last, it is the key the cache checks
+        outputs = amenity_outputs + outputs
+        
+        if self.use_cache:
+            with self.metrics.phase("cache"):
+                CleanSourceOperator.store_cache_entry(self, client, source, rendered_s3_temp_file_store, outputs)
+        
+        return source["ETag"], outputs
+    
+    def drop_seen_stays(self, client, df, context):
+        if df.empty:
+            return df
+        index = SeenKeyIndex(client, self.s3_bucket, self.seen_index_prefix.format(**context),
+                             self.seen_index_partitions)
+        # Only ids that survive the in-file dedup are recorded, the rest never get loaded
+        ids = df['id']
+        record = (ids.notna() & ~ids.duplicated(keep=False)).values
+        keep = index.filter_and_update(hash_keys(ids), date_number(self.seen_index_date.format(**context)), record)
+        keep |= ids.isna().values
+        self.log.info("Dropped {} stays delivered on an earlier day".format(int((~keep).sum())))
+        return df[keep]
+    
+    def cache_entry_key(self, rendered_s3_temp_file_store):
+        # Kept in a sub-directory so a COPY from the output key prefix never picks it up
+        directory, _, name = rendered_s3_temp_file_store.rpartition("/")
+        return "{}/_clean_cache/{}.json".format(directory, name) if directory else "_clean_cache/{}.json".format(name)
+    
+    def cache_fingerprint(self, etag, size):
+        # Everything that decides what the cleaned output looks like
+        return {
+            "source_etag": etag,
+            "source_size": size,
+            "cleaning_rules_version": CleanSourceOperator.cleaning_rules_version,
+            "output_format": self.output_format,
+            "compression": self.compression,
+            "shards": self.shards
+        }
+    
+    def cached_outputs(self, client, source, rendered_s3_temp_file_store):
+        # The keys written for an unchanged source, None if it has to be cleaned again
+        try:
+            cached = client.get_object(Bucket=self.s3_bucket,
+                                       Key=CleanSourceOperator.cache_entry_key(self, rendered_s3_temp_file_store))
+            entry = json.loads(cached["Body"].read())
+        except ClientError:
+            return None
+        fingerprint = CleanSourceOperator.cache_fingerprint(self, source["ETag"], source["ContentLength"])
+        if entry.get("fingerprint") != fingerprint:
+            return None
+        # The outputs may have been expired or deleted since the entry was written
+        try:
+            client.head_object(Bucket=self.s3_bucket, Key=entry["outputs"][-1])
+        except ClientError:
+            return None
+        return entry["outputs"]
+    
+    def store_cache_entry(self, client, source, rendered_s3_temp_file_store, outputs):
+        entry = {
+            "fingerprint": CleanSourceOperator.cache_fingerprint(self, source["ETag"], source["ContentLength"]),
+            "outputs": outputs
+        }
+        client.put_object(Body=json.dumps(entry), Bucket=self.s3_bucket,
+                          Key=CleanSourceOperator.cache_entry_key(self, rendered_s3_temp_file_store))
+    
+    def serialize_frame(self, clean_df, compression):
+        if self.output_format == "parquet":
+            # Parquet compresses column chunks internally
+            return to_parquet_bytes(clean_df, compression=compression or "snappy")
+        body = clean_df.to_csv(index=False, sep='|')
+        if compression is not None:
+            body = compress_bytes(body.encode(), compression)
+            self.log.info("Compressed cleaned data with {} to {} bytes".format(compression, len(body)))
+        return body
+    
+    def store_frame(self, client, clean_df, compression, key):
+        # Returns the bytes stored
+        if self.output_format == "csv":
+            return CleanSourceOperator.upload_csv(self, client, clean_df, compression, key)
+        with self.metrics.phase("serialize"):
+            body = CleanSourceOperator.serialize_frame(self, clean_df, compression)
+        with self.metrics.phase("upload"):
+            client.put_object(Body=body, Bucket=self.s3_bucket, Key=key)
+        return len(body)
+    
+    def upload_csv(self, client, clean_df, compression, rendered_s3_temp_file_store):
+        # Serialize chunk_size rows at a time straight into a multipart upload, parts go up
+        # while the next rows are serialized and the whole CSV never exists at once
+        compressor = stream_compressor(compression)
+        with MultipartUploadWriter(client, self.s3_bucket, rendered_s3_temp_file_store,
+                                   self.upload_part_size, self.upload_concurrency) as writer:
+            for start in range(0, max(clean_df.shape[0], 1), self.chunk_size):
+                with self.metrics.phase("serialize"):
+                    text = clean_df.iloc[start:start + self.chunk_size].to_csv(index=False, sep='|',
+                                                                               header=start == 0)
+                    data = compressor.compress(text.encode())
+                # Only waits when every upload slot is busy
+                with self.metrics.phase("upload"):
+                    writer.write(data)
+            with self.metrics.phase("upload"):
+                writer.write(compressor.flush())
+                writer.close()
+        return writer.bytes_written
+    
+    def clean_shards(self, client, df, rendered_key, rendered_s3_temp_file_store, compression, shards):
+        # Rows are sharded on a hash of the record id, so every duplicate of an id lands
+        # in the same shard and the per-shard dedup drops exactly what a global one would
+        source_type = 'listings' if 'listings' in rendered_key else 'stays'
+        with self.metrics.phase("shard"):
+            if df.empty:
+                # Every stay seen before, or an empty source: one empty shard keeps the manifest COPY valid
+                shard_frames = [df]
+            else:
+                shard_ids = pd.util.hash_pandas_object(df['id'], index=False) % shards
+                shard_frames = [shard_df for _, shard_df in df.groupby(shard_ids.values, sort=True)]
+        del df
+        
+        processes = min(len(shard_frames), os.cpu_count() or 1)
+        self.log.info("Cleaning {} shards on {} processes".format(len(shard_frames), processes))
+        objects = []
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_clean_shard, source_type, self.output_format, compression, shard_df)
+                       for shard_df in shard_frames]
+            for index, future in enumerate(futures):
+                # Workers clean and serialize their shard, this is the wait for both
+                with self.metrics.phase("clean"):
+                    row_count, body = future.result()
+                key = shard_key(rendered_s3_temp_file_store, index)
+                with self.metrics.phase("upload"):
+                    client.put_object(Body=body, Bucket=self.s3_bucket, Key=key)
+                self.metrics.add_bytes("upload", len(body))
+                objects.append((key, len(body)))
+                self.log.info("Stored {} cleaned records in s3://{}/{}".format(row_count, self.s3_bucket, key))
+        
+        # The manifest lets a single COPY load every shard in parallel
+        manifest = build_copy_manifest(self.s3_bucket, objects)
+        with self.metrics.phase("upload"):
+            client.put_object(Body=manifest, Bucket=self.s3_bucket, Key=manifest_key(rendered_s3_temp_file_store))
+        self.log.info("Stored COPY manifest for {} shards in s3://{}/{}".format(
+            len(objects), self.s3_bucket, manifest_key(rendered_s3_temp_file_store)))
+        return [key for key, _ in objects] + [manifest_key(rendered_s3_temp_file_store)]
+    
+    def read_streamed_frame(self, body, rendered_key):
+        # Parse one record at a time and build the DataFrame chunk by chunk, dropping
+        # the columns we never keep before the chunks are stitched together
+        
+        # Pipes only need stripping when they would collide with the CSV delimiter
+        strip_chars = '|' if self.output_format == "csv" else ''
+        records = (row["fields"] for row in iter_json_array(body, strip_chars=strip_chars))
+        chunks = []
+        parsed_count = 0
+        saved = 0
+        for batch in batched(records, self.chunk_size):
+            chunk, chunk_saved = CleanSourceOperator.compact_records(self, pd.DataFrame(batch), rendered_key)
+            chunks.append(chunk)
+            saved += chunk_saved
+            parsed_count += len(batch)
+            self.log.info("Parsed {} records".format(parsed_count))
+        
+        if not chunks:
+            return pd.DataFrame(), 0
+        return concat_frames(chunks), saved
+    
+    def compact_records(self, df, rendered_key):
+        # Applied right after parsing, so only one chunk at a time is held with every column
+        # and object strings. The memory saved counts the declared columns only
+        if 'listings' in rendered_key:
+            df = df.drop(CleanSourceOperator.listings_dropped_columns, axis=1, errors="ignore")
+            return compact_frame(df, CleanSourceOperator.listings_schema)
+        df = df.drop(CleanSourceOperator.stays_dropped_columns, axis=1, errors="ignore")
+        return compact_frame(df, CleanSourceOperator.stays_schema)
+    
     def clean_listings_data(self, listings_df):
         # Rename desired columns
         df = listings_df.rename(columns= {"id": "listing_id", "name": "listing_title"})
@@ -91,52 +513,7 @@ class CleanSourceOperator(BaseOperator):
         self.log.info("Dropped {} null records".format(count_after_drop-count_after_cleansing))
         
         # Drop columns not of our interest
-        df = df.drop([                                  \
-                    'review_scores_accuracy',           \
-                    'geolocation',                      \
-                    'features',                         \
-                    'transit',                          \
-                    'calendar_last_scraped',            \
-                    'review_scores_communication',      \
-                    'longitude',                        \
-                    'country_code',                     \
-                    'review_scores_cleanliness',        \
-                    'neighborhood_overview',            \
-                    'market',                           \
-                    'space',                            \
-                    'picture_url',                      \
-                    'review_scores_value',              \
-                    'latitude',                         \
-                    'review_scores_checkin',            \
-                    'review_scores_location',           \
-                    'host_picture_url',                 \
-                    'description',                      \
-                    'experiences_offered',              \
-                    'extra_people',                     \
-                    'smart_location',                   \
-                    'xl_picture_url',                   \
-                    'host_thumbnail_url',               \
-                    'scrape_id',                        \
-                    'review_scores_rating',             \
-                    'calculated_host_listings_count',   \
-                    'medium_url',                       \
-                    'calendar_updated',                 \
-                    'summary',                          \
-                    'thumbnail_url',                    \
-                    'last_scraped',                     \
-                    'guests_included',                  \
-                    'host_total_listings_count',        \
-                    'house_rules',                      \
-                    'access',                           \
-                    'host_about',                       \
-                    'host_neighbourhood',               \
-                    'interaction',                      \
-                    'monthly_price',                    \
-                    'weekly_price',                     \
-                    'square_feet',                      \
-                    'neighbourhood_cleansed',           \
-                    'notes'                             \
-                ], axis=1)
+        df = df.drop(CleanSourceOperator.listings_dropped_columns, axis=1, errors="ignore")
        
         # Arrange columns in an intuitive order
         df = df[[                                       \
@@ -173,7 +550,6 @@ class CleanSourceOperator(BaseOperator):
                     'price',                            \
                     'security_deposit',                 \
                     'cleaning_fee',                     \
-                    'amenities',                        \
                     'accommodates',                     \
                     'bedrooms',                         \
                     'bathrooms',                        \
@@ -181,10 +557,36 @@ class CleanSourceOperator(BaseOperator):
                     'cancellation_policy'               \
         ]]
         # Remove unnecessary characters
-        df = df.applymap(CleanSourceOperator.clean_values)
+        if self.output_format == "parquet":
+            return CleanSourceOperator.typed_columns(df)
+        df = CleanSourceOperator.clean_columns(df)
         df = df.fillna(0)
         return df
             
+    def listing_amenities(self, listings_df):
+        # One row per listing and amenity name. Listings with a duplicated id are dropped
+        # by the cleaning, so are their amenities, and ids and countries are cleaned like
+        # the staged listings so the pairs match them
+        columns = ['listing_id', 'country', 'amenity']
+        if listings_df.empty or 'amenities' not in listings_df.columns:
+            return pd.DataFrame(columns=columns)
+        df = listings_df.loc[~listings_df['id'].duplicated(keep=False), ['id', 'country', 'amenities']]
+        df = df.rename(columns={"id": "listing_id"}).reset_index(drop=True)
+        
+        names = df['amenities'].dropna().map(str)
+        names = names.str.replace(CleanSourceOperator.amenity_strip_pattern, '', regex=True).str.split(',').explode()
+        names = names.str.strip().str.slice(0, 250)
+        names = names[names.notna() & (names != '')]
+        
+        pairs = df.loc[names.index, ['listing_id', 'country']]
+        # A few hundred distinct names repeat over every listing
+        pairs = pairs.assign(amenity=names.values.astype(object)).drop_duplicates(['listing_id', 'amenity'])
+        pairs = pairs.assign(amenity=pairs['amenity'].astype('category')).reset_index(drop=True)
+        if self.output_format == "parquet":
+            return CleanSourceOperator.typed_columns(pairs)
+        ids = CleanSourceOperator.clean_columns(pairs[['listing_id', 'country']])
+        return pairs.assign(listing_id=ids['listing_id'], country=ids['country'])[columns]
+    
     def clean_values(value):
         value = str(value)
         value = value.replace('nan', '0')
@@ -194,6 +596,43 @@ class CleanSourceOperator(BaseOperator):
         value = value[:250]
         return value
     
+    def clean_columns(df):
+        # Column-wise equivalent of df.applymap(clean_values). The 'nan' replacement has
+        # to run before the character removal to give the same result, the removals
+        # themselves are order independent and are folded into a single pass.
+        cleaned = {}
+        for column in df.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Clean each category once, missing values (code -1) pick the cleaned NaN at the end
+                lookup = CleanSourceOperator.clean_strings(pd.Series(list(values.cat.categories) + [np.nan],
+                                                                     dtype=object))
+                cleaned[column] = pd.Series(lookup.values[values.cat.codes.values], index=df.index)
+            else:
+                cleaned[column] = CleanSourceOperator.clean_strings(values)
+        return pd.DataFrame(cleaned, index=df.index, columns=df.columns)
+    
+    def clean_strings(values):
+        values = values.map(str)
+        values = values.str.replace('nan', '0', regex=False)
+        values = values.str.replace('[\'\"\n]', '', regex=True)
+        return values.str.slice(0, 250)
+    
+    def typed_columns(df):
+        # Parquet keeps nulls and arbitrary characters intact, so values are only cast to
+        # strings for the VARCHAR staging columns and truncated to fit them
+        typed = {}
+        for column in df.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Cast each category once, missing values (code -1) pick the NaN at the end
+                lookup = pd.Series(list(values.cat.categories) + [np.nan], dtype=object)
+                lookup = lookup.map(str, na_action='ignore').str.slice(0, 250)
+                typed[column] = pd.Series(lookup.values[values.cat.codes.values], index=df.index)
+            else:
+                typed[column] = values.map(str, na_action='ignore').str.slice(0, 250)
+        return pd.DataFrame(typed, index=df.index, columns=df.columns)
+    
     def clean_stays_data(self, stays_df):
         # Rename desired columns
         df = stays_df.rename(columns= {"reviewer_id"    : "guest_id",       \
@@ -214,7 +653,7 @@ class CleanSourceOperator(BaseOperator):
         self.log.info("Dropped {} null records".format(count_after_drop-count_after_cleansing))
         
         # Drop columns not of our interest
-        df = df.drop(['comments'], axis=1)
+        df = df.drop(CleanSourceOperator.stays_dropped_columns, axis=1, errors="ignore")
         
         # Arrange columns in an intuitive order
         df = df[[                                       \
@@ -224,5 +663,22 @@ class CleanSourceOperator(BaseOperator):
                     'stay_id',                          \
                     'stay_date'                         \
         ]]
+        if self.output_format == "parquet":
+            return CleanSourceOperator.typed_columns(df)
         return df
-    
\ No newline at end of file
+
+
+class _ShardContext:
+    # Stands in for the operator inside pool workers, the cleaning methods only use these
+    def __init__(self, output_format):
+        self.output_format = output_format
+        self.log = logging.getLogger(__name__)
+
+
+def _clean_shard(source_type, output_format, compression, shard_df):
+    shard_context = _ShardContext(output_format)
+    if source_type == 'listings':
+        clean_df = CleanSourceOperator.clean_listings_data(shard_context, shard_df)
+    else:
+        clean_df = CleanSourceOperator.clean_stays_data(shard_context, shard_df)
+    return clean_df.shape[0], CleanSourceOperator.serialize_frame(shard_context, clean_df, compression)
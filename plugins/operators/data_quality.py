@@ -1,54 +1,187 @@
-from airflow.hooks.postgres_hook import PostgresHook
-from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers import get_redshift_hook, instrumented
 from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 
 class DataQualityOperator(BaseOperator):
 
     ui_color = '#89DA59'
 
+    template_fields = ("partition_value", "partition_end_value")
+
+    # APPROXIMATE COUNT(DISTINCT) is within about 2% of the exact count, so an approximate
+    # uniqueness check only fails when the estimated duplicates exceed this share of the rows
+    approximate_tolerance = 0.02
+
+    # The results of the checked range replace those of its previous check, partitions
+    # since emptied lose theirs
+    store_results_sql = """
+        BEGIN;
+        DELETE FROM {results} WHERE table_name = '{table}' AND partition_value BETWEEN '{start}' AND '{end}';
+        {insert}
+        END;
+    """
+
+    # Whole-table figures from the stored partition results, without scanning the table
+    results_totals_sql = """
+        SELECT COUNT(*), SUM(row_count), SUM(null_count), SUM(duplicate_count)
+        FROM {results}
+        WHERE table_name = '{table}'
+    """
+
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
                  aws_credentials_id="",
                  table_info_dict=[""],
+                 max_workers=4,
+                 partition_value="",
+                 partition_end_value="",
+                 results_table="dq_results",
                  *args, **kwargs):
         """
         :param redshift_conn_id: RedShift Connection ID
         :param aws_credentials_id: AWS Credentials ID
-        :param table_info_dict: dict with table name and column that should never be NULL in the table
+        :param table_info_dict: dict with table name, column(s) that should never be NULL in the table
+                                and optionally a "unique" column that should hold no duplicates.
+                                Optional keys: "partition_column" checks only the partitions this run
+                                loaded, "approximate" estimates the unique check with APPROXIMATE
+                                COUNT(DISTINCT) ("tolerance" is the duplicate share it accepts) and
+                                "require_rows" fails a partitioned check that finds no rows in the
+                                loaded partitions, which is valid by default as every stay of a day
+                                may have been loaded before
+        :param max_workers: Maximum number of tables checked concurrently
+        :param partition_value: First partition loaded by the run, e.g. the run's date.
+                                Empty checks every table in full
+        :param partition_end_value: Last partition of a backfill range, empty checks partition_value alone
+        :param results_table: Table the results of every checked partition are stored in, empty disables it
         """
 
         super(DataQualityOperator, self).__init__(*args, **kwargs)
-        self.redshift_conn_id   = redshift_conn_id
-        self.aws_credentials_id = aws_credentials_id
-        self.table_info_dict    = table_info_dict
+        self.redshift_conn_id    = redshift_conn_id
+        self.aws_credentials_id  = aws_credentials_id
+        self.table_info_dict     = table_info_dict
+        self.max_workers         = max_workers
+        self.partition_value     = partition_value
+        self.partition_end_value = partition_end_value
+        self.results_table       = results_table
 
+    @instrumented
     def execute(self, context):
-        # AWS Hook
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
         # RedShift Hook
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
-        
-        # Test each table
-        for table_dict in self.table_info_dict:
-            table_name = table_dict["table_name"]
-            column_that_should_not_be_null = table_dict["not_null"]
-            # Check number of records (pass if > 0, else fail)
-            records = redshift.get_records(f"SELECT COUNT(*) FROM {table_name}")
-            if len(records) < 1 or len(records[0]) < 1:
+        redshift = get_redshift_hook(self.redshift_conn_id)
+        start_value = self.partition_value.format(**context) if self.partition_value else ""
+        end_value = self.partition_end_value.format(**context) if self.partition_end_value else start_value
+
+        # Test the tables concurrently, each with a single scan
+        failures = []
+        workers = max(1, min(self.max_workers, len(self.table_info_dict)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(DataQualityOperator.check_table, self, redshift, table_dict,
+                                       start_value, end_value)
+                       for table_dict in self.table_info_dict]
+            for future in as_completed(futures):
+                try:
+                    self.log.info(future.result())
+                except ValueError as e:
+                    failures.append(str(e))
+        if failures:
+            raise ValueError("\n".join(failures))
+
+    def check_table(self, redshift, table_dict, start_value="", end_value=""):
+        table_name = table_dict["table_name"]
+        not_null_columns = table_dict.get("not_null", [])
+        if isinstance(not_null_columns, str):
+            not_null_columns = [not_null_columns]
+        unique_column = table_dict.get("unique")
+        approximate = table_dict.get("approximate", False)
+        # Without a partition to check the table is checked in full
+        partition_column = table_dict.get("partition_column") if start_value else None
+
+        # Row count, NULL count per column and duplicate key count in one pass
+        aggregates = ["COUNT(*)"]
+        aggregates += [f"COUNT(*) - COUNT({col})" for col in not_null_columns]
+        if unique_column:
+            distinct = "APPROXIMATE COUNT(DISTINCT {})" if approximate else "COUNT(DISTINCT {})"
+            aggregates.append(f"COUNT({unique_column}) - " + distinct.format(unique_column))
+        if partition_column:
+            # The sort key skips every block outside the range, so the cost stays at one partition
+            query = (f"SELECT {partition_column}, {', '.join(aggregates)} FROM {table_name} "
+                     f"WHERE {partition_column} BETWEEN '{start_value}' AND '{end_value}' "
+                     f"GROUP BY {partition_column} ORDER BY {partition_column}")
+        else:
+            query = f"SELECT {', '.join(aggregates)} FROM {table_name}"
+        with self.metrics.phase("check"):
+            records = redshift.get_records(query)
+
+        # Check number of records (pass if > 0, else fail)
+        if partition_column:
+            if len(records) < 1 and table_dict.get("require_rows", False):
+                raise ValueError(f"Data quality check failed. {table_name} contained 0 rows for "
+                                 f"{partition_column} {start_value} to {end_value}")
+            partitions = [(record[0], record[1:]) for record in records]
+        else:
+            if len(records) < 1 or len(records[0]) < len(aggregates):
                 raise ValueError(f"Data quality check failed. {table_name} returned no results")
-            elif records[0][0] < 1:
-                raise ValueError(f"Data quality check failed. {table_name} contained 0 rows")
-            else:
-                # Now check is NOT NULL columns contain NULL
-                null_records = redshift.get_records(f"SELECT COUNT(*) FROM {table_name} WHERE {column_that_should_not_be_null} IS NULL")
-                if null_records[0][0] > 0:
-                    col = column_that_should_not_be_null
-                    raise ValueError(f"Data quality check failed. {table_name} contained {null_records[0][0]} null records for {col}")
-                else:
-                    self.log.info(f"Data quality on table {table_name} check passed with {records[0][0]} records")
-                    
\ No newline at end of file
+            partitions = [(None, records[0])]
+
+        problems = []
+        results = []
+        row_count = 0
+        for partition, counts in partitions:
+            scope = table_name if partition is None else f"{table_name} {partition_column} {partition}"
+            partition_rows = counts[0]
+            row_count += partition_rows
+            if partition_rows < 1:
+                problems.append(f"Data quality check failed. {scope} contained 0 rows")
+
+            # Now check is NOT NULL columns contain NULL
+            for col, null_count in zip(not_null_columns, counts[1:]):
+                if null_count > 0:
+                    problems.append(f"Data quality check failed. {scope} contained {null_count} null records "
+                                    f"for {col}")
+
+            # And that the unique column holds no duplicates
+            duplicate_count = counts[-1] if unique_column else 0
+            if unique_column:
+                tolerance = table_dict.get("tolerance", DataQualityOperator.approximate_tolerance) if approximate else 0
+                if duplicate_count > tolerance * counts[0]:
+                    estimated = "an estimated " if approximate else ""
+                    problems.append(f"Data quality check failed. {scope} contained {estimated}{duplicate_count} "
+                                    f"duplicate records for {unique_column}")
+            results.append((partition, partition_rows, sum(counts[1:1 + len(not_null_columns)]),
+                            max(duplicate_count, 0)))
+        self.metrics.add_rows(row_count)
+
+        # Results are stored before failing, so failed partitions are on record too
+        if partition_column and self.results_table:
+            with self.metrics.phase("results"):
+                DataQualityOperator.store_results(self, redshift, table_name, start_value, end_value, results,
+                                                  approximate)
+        if problems:
+            raise ValueError("\n".join(problems))
+
+        if partition_column and self.results_table:
+            checked, total_rows, total_nulls, total_duplicates = redshift.get_records(
+                DataQualityOperator.results_totals_sql.format(results=self.results_table, table=table_name))[0]
+            return (f"Data quality on table {table_name} check passed with {row_count} records in "
+                    f"{len(results)} partitions, {total_rows} records in the {checked} partitions checked so far")
+        return f"Data quality on table {table_name} check passed with {row_count} records"
+
+    def store_results(self, redshift, table_name, start_value, end_value, results, approximate):
+        def quoted(value):
+            return "'{}'".format(str(value).replace("'", "''"))
+        rows = ", ".join(f"({quoted(table_name)}, {quoted(partition)}, {row_count}, {null_count}, "
+                         f"{duplicate_count}, {'TRUE' if approximate else 'FALSE'}, GETDATE())"
+                         for partition, row_count, null_count, duplicate_count in results)
+        # An empty range only clears the results of its earlier checks
+        insert = f"INSERT INTO {self.results_table} VALUES {rows};" if rows else ""
+        redshift.run(DataQualityOperator.store_results_sql.format(
+            results=self.results_table,
+            table=table_name.replace("'", "''"),
+            start=start_value,
+            end=end_value,
+            insert=insert
+        ))
@@ -0,0 +1,158 @@
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from helpers import get_redshift_hook, instrumented
+
+class LoadAggregateOperator(BaseOperator):
+
+    ui_color = '#F9C74F'
+
+    template_fields = ("partition_value", "partition_end_value")
+
+    # Swap the slice of the refreshed fact partitions, like the fact load itself
+    replace_partition_sql = """
+        BEGIN;
+        DELETE FROM {table} WHERE {column} BETWEEN '{start}' AND '{end}';
+        INSERT INTO {table} {select};
+        END;
+    """
+
+    # Same swap, and the totals move by the difference between the new and the old slice,
+    # so a reloaded partition is never counted twice and no other partition is read
+    replace_partition_rollup_sql = """
+        BEGIN;
+        CREATE TEMP TABLE {table}_slice AS {select};
+        CREATE TEMP TABLE {rollup}_delta AS
+            SELECT {keys}, SUM({measure}) AS {measure}
+            FROM (
+                SELECT {keys}, {measure} FROM {table}_slice
+                UNION ALL
+                SELECT {keys}, -{measure} FROM {table} WHERE {column} BETWEEN '{start}' AND '{end}'
+            ) AS changes
+            GROUP BY {keys}
+            HAVING SUM({measure}) <> 0;
+        DELETE FROM {table} WHERE {column} BETWEEN '{start}' AND '{end}';
+        INSERT INTO {table} SELECT * FROM {table}_slice;
+        UPDATE {rollup} SET {measure} = {rollup}.{measure} + delta.{measure}
+            FROM {rollup}_delta delta
+            WHERE {rollup_match};
+        INSERT INTO {rollup}
+            SELECT delta.* FROM {rollup}_delta delta
+            WHERE NOT EXISTS (SELECT 1 FROM {rollup} WHERE {rollup_match});
+        DELETE FROM {rollup} WHERE {measure} <= 0;
+        DROP TABLE {table}_slice;
+        DROP TABLE {rollup}_delta;
+        END;
+    """
+
+    # Rows of the keys the SELECT returns are replaced, every other key is left as it is
+    # unless it matches the delete condition
+    replace_keys_sql = """
+        BEGIN;
+        CREATE TEMP TABLE {table}_changes AS {select};
+        DELETE FROM {table} USING {table}_changes
+            WHERE {table}.{key} = {table}_changes.{key};
+        {prune}
+        INSERT INTO {table} SELECT * FROM {table}_changes;
+        DROP TABLE {table}_changes;
+        END;
+    """
+
+    @apply_defaults
+    def __init__(self,
+                 redshift_conn_id="",
+                 sql="",
+                 mode="partition",
+                 table_name="",
+                 partition_column="stay_date",
+                 partition_value="",
+                 partition_end_value="",
+                 rollup_table="",
+                 rollup_keys=(),
+                 measure="",
+                 key_column="",
+                 delete_condition="",
+                 *args, **kwargs):
+        """
+        :param redshift_conn_id: RedShift Connection ID
+        :param sql: SELECT producing the aggregate rows, in partition mode it is formatted
+                    with {start} and {end}, the first and last partition refreshed
+        :param mode: partition (replace the slice of the loaded fact partitions) or keys
+                     (replace the rows of every key_column value the SELECT returns)
+        :param table_name: Aggregate table name
+        :param partition_column: Column the aggregate is sliced on, like its fact table
+        :param partition_value: First partition to refresh, e.g. the run's date
+        :param partition_end_value: Last partition of a backfill range, empty refreshes partition_value alone
+        :param rollup_table: Optional totals table kept up to date from the slices of table_name
+        :param rollup_keys: Columns the totals are grouped by
+        :param measure: Additive column summed into the totals
+        :param key_column: Column identifying the replaced rows in keys mode
+        :param delete_condition: Optional condition on table_name in keys mode, matching rows are
+                                 deleted in the same transaction, e.g. keys that no longer exist
+        """
+        super(LoadAggregateOperator, self).__init__(*args, **kwargs)
+        self.redshift_conn_id    = redshift_conn_id
+        self.sql                 = sql
+        self.mode                = mode
+        self.table_name          = table_name
+        self.partition_column    = partition_column
+        self.partition_value     = partition_value
+        self.partition_end_value = partition_end_value
+        self.rollup_table        = rollup_table
+        self.rollup_keys         = rollup_keys
+        self.measure             = measure
+        self.key_column          = key_column
+        self.delete_condition    = delete_condition
+
+    @instrumented
+    def execute(self, context):
+        if not self.table_name:
+            raise ValueError("LoadAggregateOperator requires table_name")
+        # RedShift Hook
+        redshift = get_redshift_hook(self.redshift_conn_id)
+        if self.mode == "keys":
+            if not self.key_column:
+                raise ValueError("Keys mode requires key_column")
+            prune = f"DELETE FROM {self.table_name} WHERE {self.delete_condition};" if self.delete_condition else ""
+            with self.metrics.phase("insert"):
+                redshift.run(LoadAggregateOperator.replace_keys_sql.format(
+                    table=self.table_name,
+                    select=self.sql,
+                    key=self.key_column,
+                    prune=prune
+                ))
+            self.log.info(f"Replaced the refreshed {self.key_column} rows of {self.table_name}")
+            return
+
+        if not self.partition_value:
+            raise ValueError("Partition mode requires partition_value")
+        start_value = self.partition_value.format(**context)
+        end_value = self.partition_end_value.format(**context) if self.partition_end_value else start_value
+        select = self.sql.format(start=start_value, end=end_value)
+        if self.rollup_table:
+            if not self.rollup_keys or not self.measure:
+                raise ValueError("A rollup_table requires rollup_keys and measure")
+            formatted_sql = LoadAggregateOperator.replace_partition_rollup_sql.format(
+                table=self.table_name,
+                column=self.partition_column,
+                start=start_value,
+                end=end_value,
+                select=select,
+                rollup=self.rollup_table,
+                keys=", ".join(self.rollup_keys),
+                measure=self.measure,
+                # NULL keys have to match too, or every change of their totals adds a row
+                rollup_match=" AND ".join(f"({self.rollup_table}.{key} = delta.{key} OR "
+                                          f"({self.rollup_table}.{key} IS NULL AND delta.{key} IS NULL))"
+                                          for key in self.rollup_keys)
+            )
+        else:
+            formatted_sql = LoadAggregateOperator.replace_partition_sql.format(
+                table=self.table_name,
+                column=self.partition_column,
+                start=start_value,
+                end=end_value,
+                select=select
+            )
+        with self.metrics.phase("insert"):
+            redshift.run(formatted_sql)
+        self.log.info(f"Refreshed {self.table_name} {self.partition_column} {start_value} to {end_value}")
@@ -1,35 +1,93 @@
-from airflow.hooks.postgres_hook import PostgresHook
-from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers import get_redshift_hook, instrumented
 from psycopg2.extras import execute_values
 
 class LoadDimensionOperator(BaseOperator):
 
     ui_color = '#80BD9E'
+    
+    # Staged merge: keep the first source row of every key, then only the rows that are new
+    # or differ from the table, replace those keys and leave every unchanged row untouched.
+    # Ties in order_by fall back to every column, so a source always keeps the same row
+    upsert_sql = """
+        BEGIN;
+        CREATE TEMP TABLE {table}_changes AS
+            SELECT {columns} FROM (
+                SELECT source.*, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY {order}) AS source_rank
+                FROM ({select}) AS source
+            ) AS ranked
+            WHERE source_rank = 1
+            EXCEPT
+            SELECT {columns} FROM {table};
+        DELETE FROM {table}
+            USING {table}_changes
+            WHERE {table}.{key} = {table}_changes.{key};
+        INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_changes;
+        DROP TABLE {table}_changes;
+        END;
+    """
+
+    columns_sql = """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = '{table}'
+        ORDER BY ordinal_position
+    """
 
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
                  aws_credentials_id="",
                  sql="",
+                 mode="append",
+                 table_name="",
+                 primary_key="",
+                 order_by="",
                  *args, **kwargs):
         """
         :param redshift_conn_id: RedShift Connection ID
         :param aws_credentials_id: AWS Credentials ID
-        :param sql: SQL Query for loading a dimension table
+        :param sql: SQL Query for loading a dimension table (a SELECT in upsert mode)
+        :param mode: append (run sql as is) or upsert (merge the SELECT on primary_key)
+        :param table_name: Dimension table name, required in upsert mode
+        :param primary_key: Primary key column of the dimension, required in upsert mode
+        :param order_by: ORDER BY over the SELECT's columns ranking the source rows of one key in upsert
+                         mode, the first is kept, e.g. "stay_date DESC". Ties fall back to every column
         """
         super(LoadDimensionOperator, self).__init__(*args, **kwargs)
         self.redshift_conn_id   = redshift_conn_id
         self.aws_credentials_id = aws_credentials_id
         self.sql                = sql
+        self.mode               = mode
+        self.table_name         = table_name
+        self.primary_key        = primary_key
+        self.order_by           = order_by
         
+    @instrumented
     def execute(self, context):
-        # AWS Hook
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
         # RedShift Hook
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
+        redshift = get_redshift_hook(self.redshift_conn_id)
         # Populate table
-        redshift.run(self.sql)
-        self.log.info("Inserted data into the dimension table")
+        if self.mode == "upsert":
+            if not self.table_name or not self.primary_key:
+                raise ValueError("Upsert mode requires table_name and primary_key")
+            # Columns the SELECT only has for ranking its rows stay out of the table
+            columns = [record[0] for record in redshift.get_records(
+                LoadDimensionOperator.columns_sql.format(table=self.table_name))]
+            if not columns:
+                raise ValueError(f"Dimension table {self.table_name} does not exist")
+            formatted_sql = LoadDimensionOperator.upsert_sql.format(
+                table=self.table_name,
+                select=self.sql,
+                key=self.primary_key,
+                columns=", ".join(columns),
+                order=", ".join([self.order_by] + columns if self.order_by else columns)
+            )
+            with self.metrics.phase("insert"):
+                redshift.run(formatted_sql)
+            self.log.info(f"Upserted changed rows into the dimension table {self.table_name}")
+        else:
+            with self.metrics.phase("insert"):
+                redshift.run(self.sql)
+            self.log.info("Inserted data into the dimension table")
@@ -1,35 +1,159 @@
-from airflow.hooks.postgres_hook import PostgresHook
-from airflow.contrib.hooks.aws_hook import AwsHook
+from datetime import datetime, timedelta
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers import get_redshift_hook, instrumented
 from psycopg2.extras import execute_values
 
 class LoadFactOperator(BaseOperator):
 
     ui_color = '#F98866'
+    
+    template_fields = ("partition_value", "partition_end_value", "source_version")
+    
+    loaded_version_sql = """
+        SELECT source_version
+        FROM fact_load_log
+        WHERE table_name = '{table}' AND partition_value = '{value}'
+    """
+    
+    # Swap the whole slice in one transaction so readers never see it half loaded
+    replace_partition_sql = """
+        BEGIN;
+        DELETE FROM {table} WHERE {column} = '{value}';
+        INSERT INTO {table}
+            SELECT * FROM ({select}) AS source
+            WHERE source.{column} = '{value}';
+        DELETE FROM fact_load_log WHERE table_name = '{table}' AND partition_value = '{value}';
+        INSERT INTO fact_load_log VALUES ('{table}', '{value}', '{version}', GETDATE());
+        END;
+    """
+    
+    loaded_range_versions_sql = """
+        SELECT partition_value, source_version
+        FROM fact_load_log
+        WHERE table_name = '{table}' AND partition_value BETWEEN '{start}' AND '{end}'
+    """
+    
+    # A backfill range is swapped the same way, with one load log row per day
+    replace_range_sql = """
+        BEGIN;
+        DELETE FROM {table} WHERE {column} BETWEEN '{start}' AND '{end}';
+        INSERT INTO {table}
+            SELECT * FROM ({select}) AS source
+            WHERE source.{column} BETWEEN '{start}' AND '{end}';
+        DELETE FROM fact_load_log WHERE table_name = '{table}' AND partition_value BETWEEN '{start}' AND '{end}';
+        INSERT INTO fact_load_log VALUES {log_rows};
+        END;
+    """
 
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
                  aws_credentials_id="",
                  sql="",
+                 mode="append",
+                 table_name="",
+                 partition_column="stay_date",
+                 partition_value="",
+                 partition_end_value="",
+                 source_version="",
                  *args, **kwargs):
         """
         :param redshift_conn_id: RedShift Connection ID
         :param aws_credentials_id: AWS Credentials ID
-        :param sql: SQL Query for loading the fact table
+        :param sql: SQL Query for loading the fact table. In partition mode a SELECT bounded by {start}
+                    and {end}, the first and last partition_value replaced
+        :param mode: append (run sql as is) or partition (replace one partition_value slice)
+        :param table_name: Fact table name, required in partition mode
+        :param partition_column: Column the fact table is sliced on
+        :param partition_value: Slice to replace, e.g. the run's date
+        :param partition_end_value: Last date (YYYY-MM-DD) of a backfill range, every slice from partition_value
+                                    to it is replaced at once. Empty replaces partition_value alone
+        :param source_version: Identifies the source data, a slice already loaded with it is skipped
         """
         super(LoadFactOperator, self).__init__(*args, **kwargs)
-        self.redshift_conn_id   = redshift_conn_id
-        self.aws_credentials_id = aws_credentials_id
-        self.sql                = sql
+        self.redshift_conn_id    = redshift_conn_id
+        self.aws_credentials_id  = aws_credentials_id
+        self.sql                 = sql
+        self.mode                = mode
+        self.table_name          = table_name
+        self.partition_column    = partition_column
+        self.partition_value     = partition_value
+        self.partition_end_value = partition_end_value
+        self.source_version      = source_version
         
+    @instrumented
     def execute(self, context):
-        # AWS Hook
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
         # RedShift Hook
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
+        redshift = get_redshift_hook(self.redshift_conn_id)
         # Populate table
-        redshift.run(self.sql)
-        self.log.info("Inserted data into the fact table")
+        if self.mode == "partition":
+            LoadFactOperator.load_partition(self, redshift, context)
+        else:
+            with self.metrics.phase("insert"):
+                redshift.run(self.sql)
+            self.log.info("Inserted data into the fact table")
+            
+    def load_partition(self, redshift, context):
+        if not self.table_name or not self.partition_value:
+            raise ValueError("Partition mode requires table_name and partition_value")
+        partition_value = self.partition_value.format(**context)
+        source_version = self.source_version.format(**context)
+        if self.partition_end_value:
+            LoadFactOperator.load_range(self, redshift, partition_value,
+                                        self.partition_end_value.format(**context), source_version)
+            return
+        
+        # Skip the slice if it was already loaded from the same source
+        if source_version:
+            with self.metrics.phase("lookup"):
+                records = redshift.get_records(LoadFactOperator.loaded_version_sql.format(
+                    table=self.table_name,
+                    value=partition_value
+                ))
+            if records and records[0][0] == source_version:
+                self.log.info(f"{self.table_name} {self.partition_column}={partition_value} already loaded from {source_version}, skipping")
+                return
+        
+        with self.metrics.phase("insert"):
+            redshift.run(LoadFactOperator.replace_partition_sql.format(
+                table=self.table_name,
+                column=self.partition_column,
+                value=partition_value,
+                select=self.sql.format(start=partition_value, end=partition_value),
+                version=source_version
+            ))
+        self.log.info(f"Replaced {self.table_name} {self.partition_column}={partition_value} slice of the fact table")
+    
+    def load_range(self, redshift, start_value, end_value, source_version):
+        start_date = datetime.strptime(start_value, "%Y-%m-%d")
+        end_date = datetime.strptime(end_value, "%Y-%m-%d")
+        if end_date < start_date:
+            raise ValueError(f"Partition range ends on {end_value} before it starts on {start_value}")
+        days = [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+                for offset in range((end_date - start_date).days + 1)]
+        
+        # Skip the range if every day of it was already loaded from the same source
+        if source_version:
+            with self.metrics.phase("lookup"):
+                records = redshift.get_records(LoadFactOperator.loaded_range_versions_sql.format(
+                    table=self.table_name,
+                    start=start_value,
+                    end=end_value
+                ))
+            loaded_versions = {value: version for value, version in records or []}
+            if all(loaded_versions.get(day) == source_version for day in days):
+                self.log.info(f"{self.table_name} {self.partition_column} {start_value} to {end_value} already loaded from {source_version}, skipping")
+                return
+        
+        log_rows = ", ".join(f"('{self.table_name}', '{day}', '{source_version}', GETDATE())" for day in days)
+        with self.metrics.phase("insert"):
+            redshift.run(LoadFactOperator.replace_range_sql.format(
+                table=self.table_name,
+                column=self.partition_column,
+                start=start_value,
+                end=end_value,
+                select=self.sql.format(start=start_value, end=end_value),
+                log_rows=log_rows
+            ))
+        self.log.info(f"Replaced {self.table_name} {self.partition_column} {start_value} to {end_value} slices of the fact table")
@@ -1,13 +1,13 @@
-from airflow.contrib.hooks.aws_hook import AwsHook
-from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers import (resolve_compression, copy_compression_clause, get_aws_credentials, get_redshift_hook, manifest_key,
+                     instrumented)
 
 class StageToRedshiftOperator(BaseOperator):
     
     ui_color = '#80BD9E'
     
-    template_fields = ("s3_key",)
+    template_fields = ("s3_key", "replace_condition")
     
     copy_csv_sql = """
         COPY {}
@@ -16,6 +16,7 @@ class StageToRedshiftOperator(BaseOperator):
         SECRET_ACCESS_KEY '{}'
         IGNOREHEADER {}
         DELIMITER '{}'
+        {}
     """
     
     copy_json_sql = """
@@ -24,6 +25,16 @@ class StageToRedshiftOperator(BaseOperator):
         ACCESS_KEY_ID '{}'
         SECRET_ACCESS_KEY '{}'
         FORMAT AS JSON '{}'
+        {}
+    """
+    
+    copy_parquet_sql = """
+        COPY {}
+        FROM '{}'
+        ACCESS_KEY_ID '{}'
+        SECRET_ACCESS_KEY '{}'
+        FORMAT AS PARQUET
+        {}
     """
 
     @apply_defaults
@@ -37,6 +48,9 @@ class StageToRedshiftOperator(BaseOperator):
                  delimiter="|",
                  ignore_headers=1,
                  json_path="auto",
+                 compression="auto",
+                 manifest=False,
+                 replace_condition="",
                  *args, **kwargs):
         """
         :param redshift_conn_id: RedShift Connection ID
@@ -44,10 +58,14 @@ class StageToRedshiftOperator(BaseOperator):
         :param table_name: Table Name
         :param s3_bucket: Name of the S3 Bucket
         :param s3_key: Key for partitioning
-        :param s3_format: json or csv
+        :param s3_format: json, csv or parquet
         :param delimiter: Delimiter for CSV format
         :param ignore_headers: Flag to ignore headers for CSV files
         :param json_path: auto or you can pass a json path
+        :param compression: auto (from the s3_key extension), None, gzip, zstd or bzip2
+        :param manifest: Load the objects listed in the s3_key COPY manifest (sharded cleaner output)
+        :param replace_condition: WHERE condition of the rows this load replaces, they are deleted in the
+                                  same transaction as the COPY so parallel loads into one table never mix
         """
 
         super(StageToRedshiftOperator, self).__init__(*args, **kwargs)
@@ -57,6 +75,9 @@ class StageToRedshiftOperator(BaseOperator):
         self.s3_bucket          = s3_bucket
         self.s3_key             = s3_key
         self.s3_format          = s3_format
+        self.compression        = compression
+        self.manifest           = manifest
+        self.replace_condition  = replace_condition
         if self.s3_format == "csv":
             self.delimiter = delimiter
             self.ignore_headers = ignore_headers
@@ -64,16 +85,20 @@ class StageToRedshiftOperator(BaseOperator):
             self.json_path = json_path
             
     
+    @instrumented
     def execute(self, context):
-        # AWS Hook
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
+        # AWS Credentials
+        credentials = get_aws_credentials(self.aws_credentials_id)
         # RedShift Hook
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
+        redshift = get_redshift_hook(self.redshift_conn_id)
         
         self.log.info("Copying data from S3 to Redshift")
         rendered_key = self.s3_key.format(**context)
         s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
+        copy_options = copy_compression_clause(resolve_compression(self.compression, rendered_key))
+        if self.manifest:
+            s3_path = "s3://{}/{}".format(self.s3_bucket, manifest_key(rendered_key))
+            copy_options = (copy_options + " MANIFEST").strip()
         
         if self.s3_format == "csv":
             formatted_sql = StageToRedshiftOperator.copy_csv_sql.format(
@@ -82,7 +107,17 @@ class StageToRedshiftOperator(BaseOperator):
                 credentials.access_key,
                 credentials.secret_key,
                 self.ignore_headers,
-                self.delimiter
+                self.delimiter,
+                copy_options
+            )
+        elif self.s3_format == "parquet":
+            # Parquet files carry their own compression, COPY takes no compression option
+            formatted_sql = StageToRedshiftOperator.copy_parquet_sql.format(
+                self.table_name,
+                s3_path,
+                credentials.access_key,
+                credentials.secret_key,
+                "MANIFEST" if self.manifest else ""
             )
         else:
             formatted_sql = StageToRedshiftOperator.copy_json_sql.format(
@@ -90,7 +125,21 @@ class StageToRedshiftOperator(BaseOperator):
                 s3_path,
                 credentials.access_key,
                 credentials.secret_key,
-                self.json_path
+                self.json_path,
+                copy_options
             )
-            
-        redshift.run(formatted_sql)
+        
+        if self.replace_condition:
+            # The table lock queues concurrent loads instead of failing them on serialization
+            replace_condition = self.replace_condition.format(**context)
+            with self.metrics.phase("copy"):
+                redshift.run([
+                    "BEGIN",
+                    f"LOCK {self.table_name}",
+                    f"DELETE FROM {self.table_name} WHERE {replace_condition}",
+                    formatted_sql,
+                    "END"
+                ])
+        else:
+            with self.metrics.phase("copy"):
+                redshift.run(formatted_sql)
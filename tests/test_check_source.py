@@ -0,0 +1,37 @@
+import pytest
+from botocore.exceptions import ClientError
+
+pytest.importorskip("airflow")
+from helpers import TaskMetrics
+from operators.check_source_data import CheckSourceOperator
+
+
+class FailingHead:
+    # S3 client whose HEAD request fails with the given error code and status
+
+    def __init__(self, code, status):
+        self.code = code
+        self.status = status
+
+    def head_object(self, Bucket, Key):
+        raise ClientError({"Error": {"Code": self.code}, "ResponseMetadata": {"HTTPStatusCode": self.status}},
+                          "HeadObject")
+
+
+def check(client):
+    operator = CheckSourceOperator(task_id="check", s3_bucket="bucket", s3_key="stays.json",
+                                   check_mode="metadata")
+    operator.metrics = TaskMetrics("test", "check")
+    CheckSourceOperator.check_metadata(operator, client, "stays.json", "s3://bucket/stays.json")
+
+
+def test_missing_source_is_reported_as_not_found():
+    with pytest.raises(ValueError, match="could not be found"):
+        check(FailingHead("404", 404))
+
+
+@pytest.mark.parametrize("code,status", [("403", 403), ("SlowDown", 503), ("ExpiredToken", 400)])
+def test_other_errors_are_raised_as_they_are(code, status):
+    with pytest.raises(ClientError) as raised:
+        check(FailingHead(code, status))
+    assert raised.value.response["Error"]["Code"] == code
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("airflow")
+from helpers import compact_frame, concat_frames
+from operators.clean_source_data import CleanSourceOperator
+
+VALUES = ["plain", None, np.nan, "nan", "banana", "a|b", 'say "hi"', "it's", "line\nbreak", "cr\rlf",
+          "x" * 300, "", "'\"\n"]
+
+
+def records():
+    rows = len(VALUES)
+    return pd.DataFrame({
+        "text": pd.Series(VALUES, dtype=object),
+        "city": pd.Series(["Boston", None, "Boston", "nan", "Miami", "Miami", "Boston", np.nan, "Ana\nheim",
+                           "Boston", "y" * 260, "", "Miami"], dtype=object),
+        "state": pd.Series(["MA", "MA", np.nan, "FL", "nan", "FL", "C|A", "MA", "'", "FL", "", "MA", np.nan],
+                           dtype=object),
+        "ints": pd.Series(range(-3, rows - 3), dtype="int64"),
+        "counts": pd.Series([1.0, np.nan, 3.0, 0.0, 12.0, np.nan, 7.0, 2.0, 1.0, 0.0, 5.0, 6.0, 9.0]),
+        "prices": pd.Series([1.5, np.nan, 250.0, 0.1, 1e20, -3.25, 7.0, 2.0, 1.0, 0.0, 5.5, 6.0, 9.0]),
+        "mixed": pd.Series([1, "a", 2.5, None, np.nan, "nan", 3, "b|c", "\n", 4.0, "z" * 251, "", 0],
+                           dtype=object),
+    })
+
+
+def reference(df):
+    # The original cleaning, one Python call per cell
+    apply = df.map if hasattr(df, "map") else df.applymap
+    return apply(CleanSourceOperator.clean_values)
+
+
+def as_csv(df):
+    return df.to_csv(index=False, sep='|').encode()
+
+
+def test_matches_applymap_byte_for_byte():
+    df = records()
+    assert as_csv(CleanSourceOperator.clean_columns(df)) == as_csv(reference(df))
+
+
+def test_compacted_columns_match_applymap_byte_for_byte():
+    df = records()
+    compacted, _ = compact_frame(df, {"text": "category", "city": "category", "state": "category",
+                                      "ints": "numeric", "counts": "numeric", "prices": "numeric"})
+    assert isinstance(compacted["state"].dtype, pd.CategoricalDtype)
+    # A categorical cannot tell None from NaN, the columns holding None stay objects
+    assert compacted["city"].dtype == object
+    assert compacted["counts"].dtype == np.float32
+    assert as_csv(CleanSourceOperator.clean_columns(compacted)) == as_csv(reference(df))
+
+
+def test_missing_values_become_zero_and_text_is_truncated():
+    cleaned = CleanSourceOperator.clean_columns(records())
+    assert cleaned["text"][1] == "None"
+    assert cleaned["text"][2] == "0"
+    assert cleaned["text"][3] == "0"
+    assert cleaned["text"][4] == "ba0a"
+    assert len(cleaned["text"][10]) == 250
+    assert cleaned["text"][12] == ""
+
+
+def test_chunks_compacted_separately_match_applymap_byte_for_byte():
+    df = records()
+    schema = {"text": "category", "city": "category", "state": "category", "ints": "numeric",
+              "counts": "numeric", "prices": "numeric"}
+    # Only the first chunk holds None in text and city
+    chunks = [compact_frame(df.iloc[start:start + 4], schema)[0] for start in range(0, len(df), 4)]
+    assert isinstance(chunks[1]["city"].dtype, pd.CategoricalDtype)
+    combined = concat_frames(chunks)
+    assert as_csv(CleanSourceOperator.clean_columns(combined)) == as_csv(reference(df))
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+pytest.importorskip("airflow")
+pytest.importorskip("psycopg2")
+from helpers.local_mode import LocalRedshiftHook
+from operators.load_dimension import LoadDimensionOperator
+
+# The upsert runs on a PostgreSQL standing in for Redshift, e.g. "host=localhost dbname=airbnb_test"
+DSN = os.environ.get("AIRBNB_TEST_POSTGRES_DSN")
+pytestmark = pytest.mark.skipif(not DSN, reason="AIRBNB_TEST_POSTGRES_DSN is not set")
+
+SOURCE = """
+    SELECT guest_id, guest_name, stay_date FROM test_dim_staging
+"""
+
+
+@pytest.fixture
+def redshift():
+    hook = LocalRedshiftHook("redshift", None, max_connections=1, dsn=DSN)
+    hook.run("""
+        DROP TABLE IF EXISTS test_dim_staging;
+        DROP TABLE IF EXISTS test_dim_guests;
+        CREATE TABLE test_dim_staging (guest_id VARCHAR, guest_name VARCHAR, stay_date VARCHAR);
+        CREATE TABLE test_dim_guests (guest_id VARCHAR, guest_name VARCHAR);
+        INSERT INTO test_dim_guests VALUES ('g1', 'Old'), ('g2', 'Kept');
+    """)
+    yield hook
+    hook.run("DROP TABLE test_dim_staging; DROP TABLE test_dim_guests;")
+
+
+def upsert(redshift, monkeypatch, order_by=""):
+    monkeypatch.setattr("operators.load_dimension.get_redshift_hook", lambda conn_id: redshift)
+    operator = LoadDimensionOperator(task_id="load_guests", sql=SOURCE, mode="upsert",
+                                     table_name="test_dim_guests", primary_key="guest_id", order_by=order_by)
+    operator.execute({})
+    return redshift.get_records("SELECT guest_id, guest_name FROM test_dim_guests ORDER BY guest_id")
+
+
+def test_key_with_two_differing_source_rows_keeps_the_latest(redshift, monkeypatch):
+    redshift.run("""INSERT INTO test_dim_staging VALUES
+        ('g1', 'Ann', '2017-01-01'), ('g1', 'Anna', '2017-01-02'), ('g3', 'New', '2017-01-01')""")
+    expected = [("g1", "Anna"), ("g2", "Kept"), ("g3", "New")]
+    assert upsert(redshift, monkeypatch, order_by="stay_date DESC") == expected
+    # A rerun on the same source changes nothing
+    assert upsert(redshift, monkeypatch, order_by="stay_date DESC") == expected
+
+
+def test_ties_keep_the_same_row_every_run(redshift, monkeypatch):
+    redshift.run("INSERT INTO test_dim_staging VALUES ('g1', 'Bea', '2017-01-01'), ('g1', 'Ann', '2017-01-01')")
+    for _ in range(2):
+        assert upsert(redshift, monkeypatch) == [("g1", "Ann"), ("g2", "Kept")]
@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+
+pytest.importorskip("airflow")
+from helpers.seen_index import SeenKeyIndex, hash_keys, date_number
+
+
+class FakeS3:
+    # In-memory S3 client, get_object fails once with `failures[key]` for the keys listed there
+
+    def __init__(self):
+        self.objects = {}
+        self.failures = {}
+
+    def get_object(self, Bucket, Key):
+        code = self.failures.pop(Key, None)
+        if code:
+            raise ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": 503}}, "GetObject")
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+                              "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.encode()
+
+
+def deliver(client, ids, date, partitions=4):
+    index = SeenKeyIndex(client, "bucket", "stays/seen_index", partitions)
+    keys = hash_keys(pd.Series(ids))
+    return index.filter_and_update(keys, date_number(date), np.ones(len(ids), dtype=bool))
+
+
+def test_redelivered_ids_are_dropped():
+    client = FakeS3()
+    first = [str(i) for i in range(1000)]
+    assert deliver(client, first, "2017-01-01").all()
+    assert not deliver(client, first, "2017-01-02").any()
+    # Rerunning the first day keeps its records
+    assert deliver(client, first, "2017-01-01").all()
+
+
+def test_throttled_partition_read_keeps_history():
+    client = FakeS3()
+    first = [str(i) for i in range(1000)]
+    deliver(client, first, "2017-01-01")
+    stored = dict(client.objects)
+
+    client.failures["stays/seen_index/part-0002.npy"] = "SlowDown"
+    with pytest.raises(ClientError):
+        deliver(client, [str(i) for i in range(1000, 2000)], "2017-01-02")
+    assert client.objects["stays/seen_index/part-0002.npy"] == stored["stays/seen_index/part-0002.npy"]
+
+    # Every id of the first day is still known when it is delivered again
+    assert not deliver(client, first, "2017-01-03").any()
+
+
+def test_throttled_meta_read_keeps_partition_count():
+    client = FakeS3()
+    deliver(client, ["1", "2"], "2017-01-01", partitions=4)
+    meta = client.objects["stays/seen_index/_index.json"]
+
+    client.failures["stays/seen_index/_index.json"] = "InternalError"
+    with pytest.raises(ClientError):
+        deliver(client, ["3"], "2017-01-02", partitions=64)
+    assert client.objects["stays/seen_index/_index.json"] == meta
+    assert not deliver(client, ["1", "2"], "2017-01-03", partitions=64).any()